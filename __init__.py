@@ -10,11 +10,53 @@ ALLOW_REMOTE_ACCESS = True
 IP_WHITELIST        = ['130.37.193.190']
 LOG_DIRECTORY       = '/home/bas/Documents/SCRY/logs/'  # Directory for SCRY to log HTTP requests and responses in -- will be created if it does not exist
 SERVICE_CONFIG_FILE = '/home/bas/Documents/SCRY/scry/services/registered_modules.txt'
+SERVICE_MANIFEST    = '/home/bas/Documents/SCRY/scry/services/service_manifest.json' # Cache of the registered procedures' descriptions -- see services.load_procedures()
 ORB_DESCRIPTION     = {'author'      : "Bas Stringer",
                        'description' : "SCRY - the SPARQL Compatible seRvice laYer (version %s)" % __version__,
                        'provenance'  : "SCRY - the SPARQL Compatible seRvice laYer (version %s)" % __version__,
                        'version'     : __version__ }
                    
+# Logging settings
+LOG_FILE             = 'scry.log'        # File in LOG_DIRECTORY to which requests and responses are logged as JSON lines
+LOG_MAX_BYTES        = 100 * 1024 * 1024 # Size at which the log file is rotated
+LOG_BACKUPS          = 10                # Number of rotated log files to keep
+LOG_SAMPLE_RATE      = 1.0               # Fraction of requests (and their responses) to log
+LOG_BODY_BYTES       = 64 * 1024         # Number of bytes of every response body to log; longer bodies are truncated
+LOG_COMPRESS_BODY    = True              # Log response bodies zlib compressed (and base64 encoded), rather than as text
+LOG_QUEUE_SIZE       = 10000             # Number of records waiting to be written before new ones are dropped, rather than delaying requests
+
+# Serving settings
+SERVING_MODE         = 'development'     # 'development' runs Flask's single-threaded development server; 'production' runs server.serve()
+SERVER_PORT          = 5000              # Port on which the orb listens for requests
+SERVER_WORKERS       = 4                 # Number of worker processes forked by the production server, after loading the services
+SERVER_THREADS       = 8                 # Number of threads handling requests in every worker process of the production server
+
+# Workspace settings -- the scratch directories procedures get through QueryHandler.get_temp_dir() (see workspace.py)
+WORKSPACE_ROOT          = '/dev/shm/scry'    # Directory (preferably on a tmpfs) holding the pooled workspaces; falls back on the system's temporary directory
+WORKSPACE_POOL_SIZE     = 32                 # Number of emptied workspaces every process keeps for reuse
+WORKSPACE_QUERY_QUOTA   = 256 * 1024 * 1024  # Number of bytes the workspaces of a single query may take up, before it is refused more of them
+WORKSPACE_TOTAL_QUOTA   = 1024 * 1024 * 1024 # Number of bytes all workspaces of a process may take up, before new ones are created on disk instead
+WORKSPACE_MAX_AGE       = 6 * 3600           # Number of seconds after which workspaces which were never released (e.g. by failed requests) are reclaimed
+WORKSPACE_REAP_INTERVAL = 60                 # Number of seconds between the background sweeps reclaiming workspaces and measuring their size
+
+# Profiling settings -- queries from IP_WHITELIST are profiled on request (see profiler.py)
+PROFILE_SAMPLE_INTERVAL = 0.005 # Number of seconds between the stack samples taken of a profiled query
+
+# Performance settings
+QUERY_CACHE_SIZE      = 256              # Number of parsed queries (and the handler plans extracted from them) to keep in memory -- 0 disables the cache
+RESPONSE_CACHE_BYTES  = 64 * 1024 * 1024 # Maximum total size of the serialized responses cached for queries which only invoke deterministic procedures -- 0 disables the cache
+RESPONSE_CACHE_TTL    = 3600             # Number of seconds after which cached responses expire
+PROCEDURE_CACHE_BYTES = 32 * 1024 * 1024 # Maximum (estimated) size of the outputs kept for memoized procedure invocations -- 0 disables memoization
+SERVICE_WORKERS       = 4                # Number of threads executing independent context handlers (i.e. service calls) in parallel -- 1 executes them one at a time
+FAST_PATH             = True             # Answer SELECT queries made only of scry:input/output triples, VALUES and BIND straight from the service call bindings
+STREAM_RESULTS        = True             # Stream XML and CSV serialized SELECT results to the client as a chunked response, rather than serializing them in memory first
+STREAM_CHUNK_ROWS     = 1000             # Number of result rows serialized per chunk of a streamed response
+PIPELINE_BINDINGS     = False            # Start service calls on the bindings of the calls they depend on as they are produced, rather than once those have finished -- requires SERVICE_WORKERS > 1
+PIPELINE_BATCH_ROWS   = 100              # Number of upstream bindings a pipelined service call processes at once
+PIPELINE_BUFFER_ROWS  = 10000            # Number of bindings a service call may run ahead of the pipelined calls consuming them, before it waits for them to catch up
+ORB_RESULT_CACHE      = 256              # Number of results of GRAPH scry:orb_description patterns to keep in memory -- 0 disables the cache
+LAZY_SERVICES         = True             # Register procedures from SERVICE_MANIFEST, importing their modules on first use rather than on startup
+
 SUPPORTED_REQUEST_METHODS = ['get','url-encoded-post'] # Still have to implement 'direct-post'
 SUPPORTED_RESPONSE_TYPES  = {'application/sparql-results+xml':'xml',
                              'text/csv'                      :'csv'}
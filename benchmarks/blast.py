@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+# Benchmarks the BLAST services against local stand-ins, so their own overhead can be measured reproducibly:
+#  - fake_blast.py is installed as blastp and blastn, and writes '-outfmt 5' XML of a configurable size after a
+#    configurable delay (note that the stand-in's own interpreter start-up is part of the measured spawn time)
+#  - a database directory holds empty .psq/.nsq files, so run_blast finds its databases
+#  - an HTTP server on localhost serves FASTA files in place of the UniProt and Ensembl REST APIs
+# The BLAST services are pointed at these through their SCRY_* environment variables (see services/BLAST/__init__.py),
+# which are set before the services are imported.
+#
+# Usage: python benchmarks/blast.py [--scenario NAME ...] [--save FILE] [--baseline FILE] [options]
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from engine                import percentile, compare # Also puts the orb's own directory on the path
+from workspace             import get_workspace_pool
+
+from rdflib.term           import Literal
+from BaseHTTPServer        import HTTPServer, BaseHTTPRequestHandler
+from SocketServer          import ThreadingMixIn
+from threading             import Thread, Lock
+from tempfile              import mkdtemp, gettempdir
+from shutil                import rmtree
+from argparse              import ArgumentParser
+from time                  import time, sleep
+from json                  import dumps, loads
+from stat                  import S_IRWXU, S_IRGRP, S_IXGRP, S_IROTH, S_IXOTH
+from os.path               import join, dirname, abspath
+
+KIT_DATABASES = ['HPA','BENCH'] # HPA is run_blast's DEFAULT_DB
+PROGRAMS      = ['blastp','blastn']
+AMINO_ACIDS   = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+## STAND-INS
+
+def make_sequence(identifier,length):
+    seed = sum(ord(c) for c in identifier)
+    return ''.join(AMINO_ACIDS[(seed + i * 7) % len(AMINO_ACIDS)] for i in xrange(length))
+
+# Serves '>identifier\nSEQUENCE' for GET /uniprot/<id>.fasta and /ensembl/<id>.fasta, after 'delay' seconds
+class FastaServer(ThreadingMixIn,HTTPServer):
+    daemon_threads = True
+
+    def __init__(self,delay,length):
+        HTTPServer.__init__(self,('127.0.0.1',0),FastaRequestHandler)
+        self.delay    = delay  # Seconds every request takes, as if it went to the real API
+        self.length   = length # The length of the served sequences
+        self.requests = 0      # The number of requests served
+        self.lock     = Lock()
+
+    def start(self):
+        thread = Thread(target=self.serve_forever,name='scry-bench-fasta')
+        thread.daemon = True
+        thread.start()
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+### END OF FastaServer
+
+class FastaRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.count()
+        path = self.path.split('?')[0]
+        if not path.endswith('.fasta'):
+            self.send_error(404)
+            return
+        if self.server.delay:
+            sleep(self.server.delay)
+        identifier = path.rsplit('/',1)[-1][:-len('.fasta')]
+        body       = '>%s Synthetic sequence\n%s\n' % (identifier,make_sequence(identifier,self.server.length))
+        self.send_response(200)
+        self.send_header('Content-Type','text/x-fasta')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+### END OF FastaRequestHandler
+
+
+# Creates the directories the stand-ins use under 'root', and points the BLAST services' settings at them
+def install_kit(root,server):
+    bin_dir = join(root,'bin')
+    db_dir  = join(root,'db')
+    for path in (bin_dir,db_dir,join(root,'cache')):
+        os.makedirs(path)
+
+    with open(join(dirname(abspath(__file__)),'fake_blast.py')) as f:
+        script = f.read().split('\n',1)[1]
+    for program in PROGRAMS:
+        path = join(bin_dir,program)
+        with open(path,'w') as f:
+            f.write('#! %s\n%s' % (sys.executable,script))
+        os.chmod(path,S_IRWXU | S_IRGRP | S_IXGRP | S_IROTH | S_IXOTH)
+    for db in KIT_DATABASES:
+        for ext in ('.psq','.nsq'):
+            open(join(db_dir,db + ext),'w').close()
+
+    url = 'http://127.0.0.1:%i' % server.server_port
+    os.environ['SCRY_BLAST_BIN_ROOT']  = bin_dir
+    os.environ['SCRY_BLAST_DB_ROOT']   = db_dir
+    os.environ['SCRY_CACHE_DIRECTORY'] = join(root,'cache')
+    os.environ['SCRY_UNIPROT_URL']     = url + '/uniprot/%s.fasta'
+    os.environ['SCRY_ENSEMBL_URL']     = url + '/ensembl/%s.fasta?type=%s'
+    os.environ['SCRY_FAKE_BLAST_LOG']  = join(root,'blast_runs.log')
+
+def count_blast_runs():
+    try:
+        with open(os.environ['SCRY_FAKE_BLAST_LOG']) as f:
+            return sum(1 for line in f)
+    except IOError:
+        return 0
+
+
+# Stands in for the QueryHandler whose scratch directories the procedures use
+class BenchHandler(object):
+
+    def __init__(self):
+        self.temp_dirs = list()
+
+    def get_temp_dir(self):
+        path = get_workspace_pool().acquire(self.temp_dirs)
+        self.temp_dirs.append(path)
+        return path
+
+    def cleanup(self):
+        for path in self.temp_dirs:
+            get_workspace_pool().release(path)
+        self.temp_dirs = list()
+
+### END OF BenchHandler
+
+
+## SCENARIOS
+#  Every scenario is a function which sets the stand-ins up and returns a function making one timed call
+
+# A BLAST run without any hits -- measures spawning the program and writing and reading its files
+def spawn_scenario(options,kit):
+    from services.BLAST.run_blast import RunBLAST
+    os.environ['SCRY_FAKE_BLAST_HITS'] = '0'
+    seq = make_sequence('spawn',options.length)
+    return lambda h: RunBLAST.execute({'seq':Literal(seq)},['id'],h)
+
+# A BLAST run with many hits -- measures parsing the XML output and building the solutions
+def parse_scenario(options,kit):
+    from services.BLAST.run_blast import RunBLAST
+    os.environ['SCRY_FAKE_BLAST_HITS'] = str(options.hits)
+    seq = make_sequence('parse',options.length)
+    return lambda h: RunBLAST.execute({'seq':Literal(seq)},['id','e_val','bitscore','perc_identity','num_hits'],h)
+
+# Repeated identical BLAST runs through invoke_batch() -- after the first, these should be served from PROCEDURE_CACHE
+def memoize_scenario(options,kit):
+    from services.BLAST.run_blast import RunBLAST
+    os.environ['SCRY_FAKE_BLAST_HITS'] = str(options.hits)
+    seq = make_sequence('memoize',options.length)
+    return lambda h: RunBLAST.invoke_batch([{'seq':Literal(seq)}],['id','e_val'],h)
+
+# BLASTing a batch of distinct sequences at once, as a CallHandler does -- they are combined into a single BLAST run
+def batch_scenario(options,kit):
+    from services.BLAST.run_blast import RunBLAST
+    os.environ['SCRY_FAKE_BLAST_HITS'] = str(options.hits)
+    inputs = [{'seq':Literal(make_sequence('batch%i' % i,options.length))} for i in xrange(options.queries)]
+    return lambda h: RunBLAST.execute_batch(inputs,['id','e_val'],h)
+
+# Fetching a sequence from the HTTP stand-in, bypassing the sequence cache
+def fetch_scenario(options,kit):
+    from services.BLAST.fetch_sequence import FetchSequence
+    return lambda h: FetchSequence.execute({'id':Literal('P12345'),'reload':Literal(True)},['seq'],h)
+
+# Fetching a sequence which is in the sequence cache -- should not make any HTTP requests after the first
+def cached_scenario(options,kit):
+    from services.BLAST.fetch_sequence import FetchSequence
+    return lambda h: FetchSequence.execute({'id':Literal('Q9Y6K9')},['seq'],h)
+
+# A query fetching sequences and BLASTing them, sent to the orb -- the services' overhead within the query engine
+# Only the distinct hits are selected: the triples of a call bind independently (see benchmarks/engine.py), so selecting
+# ?id and ?e_val as well would return the cross product of every sequence's hits and E-values
+def orb_scenario(options,kit):
+    import launch
+    import services
+    from __init__ import IP_WHITELIST
+    os.environ['SCRY_FAKE_BLAST_HITS'] = str(options.hits)
+
+    config_file = join(kit,'registered_modules.txt')
+    with open(config_file,'w') as f:
+        f.write('services.BLAST.fetch_sequence\nservices.BLAST.run_blast\n')
+    launch.set_services(services.load_procedures(config_file))
+
+    ids   = ' '.join('"P%05i"' % i for i in xrange(options.queries))
+    query = ('PREFIX scry: <http://www.scry.com/> PREFIX blast: <http://www.scry.com/blast/> '
+             'SELECT DISTINCT ?hit WHERE { VALUES ?id { %s } '
+             'blast:fetch_sequence scry:input ?id ; <http://www.scry.com/output?seq> ?seq . '
+             'blast:blast <http://www.scry.com/input?seq> ?seq ; <http://www.scry.com/output?id> ?hit . }' % ids)
+    client = launch.orb.test_client()
+
+    def call(h):
+        response = client.post('/scry/',data={'query':query},headers={'Accept':'text/csv'},environ_base={'REMOTE_ADDR':IP_WHITELIST[0]})
+        body     = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(body[:500])
+        rows = body.count('\n') - 1 # Every row ends in a line break, including the header
+        if rows != options.hits: # The stand-in reports the same hits for every sequence
+            raise RuntimeError('Expected %i result rows, got %i' % (options.hits,rows))
+    return call
+
+SCENARIOS = [('spawn'  , spawn_scenario),
+             ('parse'  , parse_scenario),
+             ('memoize', memoize_scenario),
+             ('batch'  , batch_scenario),
+             ('fetch'  , fetch_scenario),
+             ('cached' , cached_scenario),
+             ('orb'    , orb_scenario)]
+
+
+## RUNNING
+
+def run_scenario(name,call,options,server):
+    latencies = list()
+    errors    = 0
+    error     = None
+    runs      = count_blast_runs()
+    requests  = server.requests
+    for i in xrange(options.warmup + options.iterations):
+        if i == options.warmup: # Only the timed calls' BLAST runs and HTTP requests are counted
+            runs     = count_blast_runs()
+            requests = server.requests
+        handler = BenchHandler()
+        start   = time()
+        try:
+            call(handler)
+        except Exception as e:
+            errors += 1
+            error   = error or '%s: %s' % (e.__class__.__name__,e)
+        elapsed = time() - start
+        handler.cleanup()
+        if i >= options.warmup:
+            latencies.append(elapsed)
+
+    ordered = sorted(latencies)
+    return {'scenario'      : name,
+            'calls'         : len(latencies),
+            'errors'        : errors,
+            'first_error'   : error,
+            'blast_runs'    : count_blast_runs() - runs,
+            'http_requests' : server.requests - requests,
+            'throughput'    : len(latencies) / sum(latencies),
+            'p50_ms'        : 1000 * percentile(ordered,0.50),
+            'p90_ms'        : 1000 * percentile(ordered,0.90),
+            'p99_ms'        : 1000 * percentile(ordered,0.99)}
+
+
+def report(results):
+    print '%-8s %9s %9s %9s %9s %7s %7s %7s' % ('scenario','calls/s','p50 ms','p90 ms','p99 ms','blasts','fetches','errors')
+    for r in results:
+        print '%-8s %9.2f %9.2f %9.2f %9.2f %7i %7i %7i' % (r['scenario'],r['throughput'],r['p50_ms'],r['p90_ms'],r['p99_ms'],r['blast_runs'],r['http_requests'],r['errors'])
+        if r['first_error']:
+            print '         first error: %s' % r['first_error'].strip().replace('\n',' ')
+
+
+def main(argv):
+    parser = ArgumentParser(description="Benchmarks SCRY's BLAST services against local stand-ins.")
+    parser.add_argument('--scenario'   , action='append', choices=[n for n, f in SCENARIOS], help="Scenario to run (repeatable; default: all)")
+    parser.add_argument('--iterations' , type=int  , default=20  , help="Timed calls per scenario")
+    parser.add_argument('--warmup'     , type=int  , default=2   , help="Untimed calls per scenario, made first")
+    parser.add_argument('--hits'       , type=int  , default=250 , help="Hits per query in the stand-in's BLAST output")
+    parser.add_argument('--hsps'       , type=int  , default=2   , help="HSPs per hit in the stand-in's BLAST output")
+    parser.add_argument('--blast-delay', type=float, default=0.0 , help="Seconds the stand-in BLAST takes per query")
+    parser.add_argument('--http-delay' , type=float, default=0.0 , help="Seconds the stand-in REST API takes per request")
+    parser.add_argument('--length'     , type=int  , default=400 , help="Length of the query and served sequences")
+    parser.add_argument('--queries'    , type=int  , default=10  , help="Sequences BLASTed per call in the 'batch' and 'orb' scenarios")
+    parser.add_argument('--workdir'    , help="Directory to install the stand-ins in (default: a new temporary directory, removed afterwards)")
+    parser.add_argument('--save'       , metavar='FILE', help="Save the results as JSON, for use as a baseline")
+    parser.add_argument('--baseline'   , metavar='FILE', help="Compare the results against those saved in FILE")
+    parser.add_argument('--tolerance'  , type=float, default=0.10, help="Relative change of a metric reported as a regression")
+    options = parser.parse_args(argv)
+
+    root   = options.workdir or mkdtemp(prefix='scry-bench-',dir=gettempdir())
+    server = FastaServer(options.http_delay,options.length)
+    server.start()
+    install_kit(root,server)
+    os.environ['SCRY_FAKE_BLAST_HSPS']  = str(options.hsps)
+    os.environ['SCRY_FAKE_BLAST_DELAY'] = str(options.blast_delay)
+
+    stdout  = sys.stdout
+    results = list()
+    try:
+        for name, scenario in SCENARIOS:
+            if options.scenario and name not in options.scenario:
+                continue
+            call       = scenario(options,root)
+            sys.stdout = open(os.devnull,'w') # The orb prints a line for every request
+            try:
+                results.append(run_scenario(name,call,options,server))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+    finally:
+        server.shutdown()
+        if not options.workdir:
+            rmtree(root)
+    report(results)
+
+    config = dict((k,getattr(options,k)) for k in ('iterations','warmup','hits','hsps','blast_delay','http_delay','length','queries'))
+    if options.save:
+        with open(options.save,'w') as f:
+            f.write(dumps({'config':config,'results':results},indent=2,sort_keys=True))
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = loads(f.read())
+        if baseline['config'] != config:
+            print '\nWARNING: the baseline was run with different options: %s' % dumps(baseline['config'],sort_keys=True)
+        lines, regressions = compare(results,baseline,options.tolerance)
+        print '\nCompared to %s:' % options.baseline
+        for line in lines:
+            print line
+        if regressions:
+            print '\n%i regression(s) beyond %g%%' % (len(regressions),100 * options.tolerance)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
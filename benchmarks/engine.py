@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+# Benchmarks the core query engine: queries are sent to the orb through Flask's test client, against synthetic
+# procedures with a configurable fan-out (solutions per input), latency (seconds per input) and output width
+# (output arguments per procedure). Every scenario is run in a forked process of its own, so the peak memory
+# reported for it is not inflated by the scenarios run before it.
+#
+# Usage: python benchmarks/engine.py [--scenario NAME ...] [--save FILE] [--baseline FILE] [options]
+#
+# The results of a run may be saved as JSON, and later runs compared against them: every metric which is worse
+# than the baseline by more than --tolerance is reported as a regression, and the exit status is then 1.
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The orb's own directory
+
+import launch
+import workspace
+
+from __init__         import IP_WHITELIST
+from services.classes import Procedure, Argument
+
+from rdflib           import Namespace
+from rdflib.term      import Literal
+from argparse         import ArgumentParser
+from ast              import literal_eval
+from time             import time, sleep
+from json             import dumps, loads
+from resource         import getrusage, RUSAGE_SELF
+from traceback        import format_exc
+
+BENCH    = Namespace('http://www.scry.com/bench/')
+ACCEPTED = {'xml' : 'application/sparql-results+xml',
+            'csv' : 'text/csv'}
+
+# Metrics compared against a baseline, pointing to whether higher values are better
+COMPARED = {'throughput' : True,
+            'p50_ms'     : False,
+            'p90_ms'     : False,
+            'p99_ms'     : False,
+            'peak_rss_mb': False}
+
+
+# A procedure generating 'fanout' solutions for every input, each binding 'width' output arguments (out0, out1, ...)
+# to Literals derived from the input value. Every input takes 'latency' seconds, as if it called a remote service.
+class SyntheticProcedure(Procedure):
+
+    def __init__(self,name,fanout=1,latency=0.0,width=1):
+        super(SyntheticProcedure,self).__init__(BENCH[name],
+                                                author      = "SCRY benchmarks",
+                                                description = "Synthetic procedure (fan-out %i, latency %gs, width %i)" % (fanout,latency,width),
+                                                provenance  = "benchmarks/engine.py",
+                                                version     = '1.0')
+        self.fanout  = fanout
+        self.latency = latency
+        self.width   = width
+        self.add_input(Argument('in',BENCH['argument/in'],description="Any RDF node"),required=True,default=True)
+        for i in range(width):
+            self.add_output(Argument('out%i' % i,BENCH['argument/out%i' % i],description="A Literal derived from the input"),default=(i == 0))
+
+    def execute(self,input_dict,expected_outputs,handler):
+        if self.latency:
+            sleep(self.latency)
+        value = unicode(input_dict['in'])
+        return [dict((k,Literal(u'%s.%i.%s' % (value,j,k))) for k in expected_outputs) for j in xrange(self.fanout)]
+
+### END OF SyntheticProcedure
+
+
+def get_service_config(options):
+    procs = [SyntheticProcedure('chain-a',options.fanout,options.latency,options.width),
+             SyntheticProcedure('chain-b',options.fanout,options.latency,options.width),
+             SyntheticProcedure('flat',1,options.latency,1),
+             SyntheticProcedure('fan',options.rows * 10,options.latency,1),
+             SyntheticProcedure('none',0,options.latency,1)]
+    service_config = dict()
+    for proc in procs:
+        proc.assert_validity()
+        service_config[proc.uri] = proc
+    return service_config
+
+
+## SCENARIOS
+#  Every scenario is a function which generates its query string from the command line options, and returns it along
+#  with the number of result rows the query should produce.
+#
+#  All triples of a procedure call share its PAU as their subject, so two of its variables are only correlated when its
+#  triples are matched within a single solution -- i.e. within a GRAPH ?variable pattern, which gives every solution a
+#  context of its own (see CallHandler.add_solution_graphs). Outside of one, each triple binds independently and the
+#  result is the cross product of their values. The scenarios below use GRAPH patterns, so their results grow linearly
+#  with --rows; the 'fanout' scenario binds a single variable per call, so it is the one answered by the fast path.
+#  (RDFLib evaluates a GRAPH ?variable pattern by scanning every context, for every solution it is joined with, so the
+#  time these queries take still grows quadratically with --rows.)
+
+PREFIXES = 'PREFIX scry: <http://www.scry.com/> PREFIX bench: <http://www.scry.com/bench/> '
+
+def values_block(var,rows,prefix='v'):
+    return 'VALUES ?%s { %s }' % (var,' '.join('"%s%i"' % (prefix,i) for i in xrange(rows)))
+
+def outputs(var,width):
+    return ' ; '.join('<http://www.scry.com/output?out%i> ?%s%i' % (i,var,i) for i in xrange(width))
+
+def output_vars(var,width):
+    return ' '.join('?%s%i' % (var,i) for i in xrange(width))
+
+# Two CallHandlers, the second consuming the first's outputs -- exercises merge_and_filter and the scheduler
+def chain_query(options):
+    query = (PREFIXES + 'SELECT ?x %s %s WHERE { %s '
+             'GRAPH ?a { bench:chain-a scry:input ?x ; %s . } '
+             'GRAPH ?b { bench:chain-b scry:input ?y0 ; %s . } }' % (output_vars('y',options.width),
+                                                                    output_vars('z',options.width),
+                                                                    values_block('x',options.rows),
+                                                                    outputs('y',options.width),
+                                                                    outputs('z',options.width)))
+    return query, options.rows * options.fanout ** 2
+
+# A VarSubCallHandler, dispatching every row to the procedure bound to ?p
+def varsub_query(options):
+    paus = ['bench:chain-a','bench:chain-b','bench:flat']
+    rows = ' '.join('(%s "v%i")' % (paus[i % len(paus)],i) for i in xrange(options.rows))
+    query = (PREFIXES + 'SELECT ?p ?x ?y WHERE { VALUES (?p ?x) { %s } '
+             'GRAPH ?g { ?p scry:input ?x ; scry:output ?y . } }' % rows)
+    return query, sum((1 if i % len(paus) == 2 else options.fanout) for i in xrange(options.rows))
+
+# A single call handler fed by a large VALUES block -- exercises batching, materialization and serialization
+def values_query(options):
+    rows  = options.rows * 4
+    query = (PREFIXES + 'SELECT ?x ?y WHERE { %s '
+             'GRAPH ?g { bench:flat scry:input ?x ; scry:output ?y . } }' % values_block('x',rows))
+    return query, rows
+
+# A call handler whose input is computed by a BIND expression
+def bind_query(options):
+    query = (PREFIXES + 'SELECT ?x ?b ?y WHERE { %s '
+             'BIND(CONCAT(STR(?x),"-bound") AS ?b) '
+             'GRAPH ?g { bench:flat scry:input ?b ; scry:output ?y . } }' % values_block('x',options.rows))
+    return query, options.rows
+
+# A single call with a constant input, generating --rows times 10 solutions -- the only scenario answered by the fast path
+def fanout_query(options):
+    query = (PREFIXES + 'SELECT ?y WHERE { '
+             'bench:fan scry:input "seed" ; scry:output ?y . }')
+    return query, options.rows * 10
+
+# A chain whose first call produces no solutions -- the second must not be invoked, and the result has no rows
+def empty_query(options):
+    query = (PREFIXES + 'SELECT ?x ?y ?z WHERE { %s '
+             'bench:none scry:input ?x ; scry:output ?y . '
+             'bench:chain-b scry:input ?y ; scry:output ?z . }' % values_block('x',options.rows))
+    return query, 0
+
+# A query of the orb's description, without any procedure calls
+def orb_query(options):
+    query = ('PREFIX scry: <http://www.scry.com/> '
+             'SELECT ?proc ?arg ?desc WHERE { GRAPH scry:orb_description { '
+             '?proc a scry:procedure ; scry:generates_output ?arg . '
+             '?arg scry:description ?desc . } }')
+    return query, options.width * 2 + 3 # The outputs of chain-a, chain-b, flat, fan and none, which share their Arguments' URIs
+
+SCENARIOS = [('chain' , chain_query),
+             ('varsub', varsub_query),
+             ('values', values_query),
+             ('bind'  , bind_query),
+             ('fanout', fanout_query),
+             ('empty' , empty_query),
+             ('orb'   , orb_query)]
+
+
+## RUNNING
+
+def percentile(ordered,fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered)-1,int(fraction * len(ordered)))]
+
+def peak_rss_mb():
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0) # Reported in bytes on OS X, in kilobytes elsewhere
+
+def count_rows(body,result_format):
+    if result_format == 'csv':
+        return max(0,body.count('\n') - 1) # Every row ends in a line break, including the header
+    return body.count('<result>')
+
+def run_scenario(name,query,expected,options):
+    client  = launch.orb.test_client()
+    environ = {'REMOTE_ADDR' : IP_WHITELIST[0]}
+    headers = {'Accept' : ACCEPTED[options.format]}
+
+    latencies = list()
+    errors    = 0
+    error     = None
+    size      = 0
+    for i in xrange(options.warmup + options.iterations):
+        start = time()
+        try:
+            response = client.post('/scry/',data={'query':query},headers=headers,environ_base=environ)
+            body     = response.get_data() # Consumes streamed responses
+            failure  = (body[:500] if response.status_code != 200 else None)
+            if not failure and count_rows(body,options.format) != expected:
+                failure = 'Expected %i result rows, got %i' % (expected,count_rows(body,options.format))
+        except Exception as e: # With DEBUG set, Flask propagates the exceptions of the orb
+            body     = ''
+            failure  = '%s: %s' % (e.__class__.__name__,e)
+        elapsed = time() - start
+        if i < options.warmup:
+            continue
+        if failure:
+            errors += 1
+            error   = error or failure
+        latencies.append(elapsed)
+        size = len(body)
+
+    ordered = sorted(latencies)
+    return {'scenario'     : name,
+            'requests'     : len(latencies),
+            'errors'       : errors,
+            'first_error'  : error,
+            'response_kb'  : size / 1024.0,
+            'throughput'   : len(latencies) / sum(latencies),
+            'p50_ms'       : 1000 * percentile(ordered,0.50),
+            'p90_ms'       : 1000 * percentile(ordered,0.90),
+            'p99_ms'       : 1000 * percentile(ordered,0.99),
+            'peak_rss_mb'  : peak_rss_mb()}
+
+# Runs a scenario in a child process, which sends its results back as JSON through a pipe
+def run_isolated(name,query,expected,options):
+    if not options.fork:
+        return run_scenario(name,query,expected,options)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = run_scenario(name,query,expected,options)
+        except Exception:
+            result = {'scenario':name,'crashed':format_exc()}
+        with os.fdopen(write_fd,'w') as f:
+            f.write(dumps(result))
+        workspace.close_workspace_pool()
+        os._exit(0) # Skips the atexit handlers (e.g. flushing the request log) of the parent
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    os.waitpid(pid,0)
+    return loads(data)
+
+
+# Overrides module-level settings (e.g. FAST_PATH=False) in the modules which imported them from __init__
+def apply_settings(settings):
+    root = os.path.dirname(launch.__file__)
+    for setting in settings:
+        key, value = setting.split('=',1)
+        value      = literal_eval(value)
+        found      = False
+        for mod in sys.modules.values():
+            if mod is not None and hasattr(mod,key) and (getattr(mod,'__file__',None) or '').startswith(root):
+                setattr(mod,key,value)
+                found = True
+        if not found:
+            raise KeyError("No SCRY module uses a setting named %s" % key)
+
+
+def compare(results,baseline,tolerance):
+    previous    = dict((r['scenario'],r) for r in baseline['results'])
+    regressions = list()
+    lines       = list()
+    for r in results:
+        old = previous.get(r['scenario'])
+        if old is None or 'crashed' in r or 'crashed' in old:
+            continue
+        for key, higher_is_better in sorted(COMPARED.items()):
+            if not old.get(key):
+                continue
+            change = (r[key] - old[key]) / old[key]
+            worse  = (-change if higher_is_better else change) > tolerance
+            lines.append('%-8s %-12s %10.2f -> %10.2f  %+7.1f%%%s' % (r['scenario'],key,old[key],r[key],100 * change,('  REGRESSION' if worse else '')))
+            if worse:
+                regressions.append((r['scenario'],key))
+    return lines, regressions
+
+
+def report(results):
+    print '%-8s %9s %9s %9s %9s %9s %9s %7s' % ('scenario','req/s','p50 ms','p90 ms','p99 ms','peak MB','resp KB','errors')
+    for r in results:
+        if 'crashed' in r:
+            print '%-8s CRASHED\n%s' % (r['scenario'],r['crashed'])
+            continue
+        print '%-8s %9.2f %9.2f %9.2f %9.2f %9.1f %9.1f %7i' % (r['scenario'],r['throughput'],r['p50_ms'],r['p90_ms'],r['p99_ms'],r['peak_rss_mb'],r['response_kb'],r['errors'])
+        if r['first_error']:
+            print '         first error: %s' % r['first_error'].strip().replace('\n',' ')
+
+
+def main(argv):
+    parser = ArgumentParser(description="Benchmarks SCRY's query engine with synthetic procedures.")
+    parser.add_argument('--scenario'  , action='append', choices=[n for n, f in SCENARIOS], help="Scenario to run (repeatable; default: all)")
+    parser.add_argument('--iterations', type=int  , default=20   , help="Timed requests per scenario")
+    parser.add_argument('--warmup'    , type=int  , default=3    , help="Untimed requests per scenario, sent first")
+    parser.add_argument('--rows'      , type=int  , default=25   , help="VALUES rows per query (4 times as many for 'values'; 10 times as many solutions for 'fanout')")
+    parser.add_argument('--fanout'    , type=int  , default=2    , help="Solutions generated per input by the chained procedures")
+    parser.add_argument('--width'     , type=int  , default=2    , help="Output arguments bound by the chained procedures")
+    parser.add_argument('--latency'   , type=float, default=0.0  , help="Seconds every procedure takes per input")
+    parser.add_argument('--format'    , choices=sorted(ACCEPTED)  , default='xml', help="Result format to request")
+    parser.add_argument('--set'       , action='append', default=[], dest='settings', metavar='NAME=VALUE', help="Override a setting from __init__.py, e.g. FAST_PATH=False")
+    parser.add_argument('--no-fork'   , action='store_false', dest='fork', help="Run every scenario in this process (peak memory is then cumulative)")
+    parser.add_argument('--save'      , metavar='FILE', help="Save the results as JSON, for use as a baseline")
+    parser.add_argument('--baseline'  , metavar='FILE', help="Compare the results against those saved in FILE")
+    parser.add_argument('--tolerance' , type=float, default=0.10 , help="Relative change of a metric reported as a regression")
+    options = parser.parse_args(argv)
+
+    apply_settings(options.settings)
+    launch.set_services(get_service_config(options))
+
+    stdout  = sys.stdout
+    results = list()
+    for name, build_query in SCENARIOS:
+        if options.scenario and name not in options.scenario:
+            continue
+        query, expected = build_query(options)
+        sys.stdout = open(os.devnull,'w') # The orb prints a line for every request
+        try:
+            results.append(run_isolated(name,query,expected,options))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    report(results)
+
+    config = dict((k,getattr(options,k)) for k in ('iterations','warmup','rows','fanout','width','latency','format','settings'))
+    if options.save:
+        with open(options.save,'w') as f:
+            f.write(dumps({'config':config,'results':results},indent=2,sort_keys=True))
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = loads(f.read())
+        if baseline['config'] != config:
+            print '\nWARNING: the baseline was run with different options: %s' % dumps(baseline['config'],sort_keys=True)
+        lines, regressions = compare(results,baseline,options.tolerance)
+        print '\nCompared to %s:' % options.baseline
+        for line in lines:
+            print line
+        if regressions:
+            print '\n%i regression(s) beyond %g%%' % (len(regressions),100 * options.tolerance)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# A stand-in for NCBI's blastp/blastn, installed under those names by benchmarks/blast.py. It accepts the same
+# command lines as run_blast builds, and writes '-outfmt 5' XML with one Iteration per query sequence, after
+# sleeping for a while as if it searched the database. Its behaviour is set through environment variables:
+#  SCRY_FAKE_BLAST_HITS  -- the number of hits per query (default 10)
+#  SCRY_FAKE_BLAST_HSPS  -- the number of HSPs per hit (default 1)
+#  SCRY_FAKE_BLAST_DELAY -- the number of seconds to sleep per query (default 0)
+#  SCRY_FAKE_BLAST_LOG   -- if set, a file to which a line is appended for every run, so runs can be counted
+import sys
+
+from os                import environ
+from os.path           import basename, isfile
+from time              import sleep
+from xml.sax.saxutils  import escape
+
+
+def parse_args(argv):
+    args = dict()
+    key  = None
+    for a in argv:
+        if a.startswith('-') and not a[1:].replace('.','').isdigit():
+            key       = a[1:]
+            args[key] = True # Flags have no value
+        elif key:
+            args[key] = a
+            key       = None
+    return args
+
+def read_queries(path):
+    queries = list() # (definition, sequence) tuples
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                queries.append([line[1:],''])
+            elif line and queries:
+                queries[-1][1] += line
+    return queries
+
+def element(tag,text):
+    return '<%s>%s</%s>' % (tag,escape(str(text)),tag)
+
+def make_hsp(num,seq,hit_num):
+    length = max(1,len(seq) - hit_num % max(1,len(seq)))
+    qseq   = seq[:length]
+    return ''.join(['<Hsp>',
+                    element('Hsp_num'        , num),
+                    element('Hsp_bit-score'  , 1000.0 / (hit_num + num)),
+                    element('Hsp_score'      , 2500 // (hit_num + num)),
+                    element('Hsp_evalue'     , '%g' % (1e-100 * 10 ** hit_num)),
+                    element('Hsp_query-from' , 1),
+                    element('Hsp_query-to'   , length),
+                    element('Hsp_hit-from'   , 1),
+                    element('Hsp_hit-to'     , length),
+                    element('Hsp_query-frame', 0),
+                    element('Hsp_hit-frame'  , 0),
+                    element('Hsp_identity'   , length - hit_num % length),
+                    element('Hsp_positive'   , length),
+                    element('Hsp_gaps'       , 0),
+                    element('Hsp_align-len'  , length),
+                    element('Hsp_qseq'       , qseq),
+                    element('Hsp_hseq'       , qseq),
+                    element('Hsp_midline'    , qseq),
+                    '</Hsp>'])
+
+def make_iteration(num,definition,seq,db,hits,hsps):
+    parts = ['<Iteration>',
+             element('Iteration_iter-num'  , num),
+             element('Iteration_query-ID'  , 'Query_%i' % num),
+             element('Iteration_query-def' , definition),
+             element('Iteration_query-len' , len(seq)),
+             '<Iteration_hits>']
+    for h in xrange(1,hits+1):
+        parts.extend(['<Hit>',
+                      element('Hit_num'       , h),
+                      element('Hit_id'        , 'sp|FAKE%05i|%s' % (h,db)),
+                      element('Hit_def'       , 'Synthetic hit %i for %s' % (h,definition)),
+                      element('Hit_accession' , 'FAKE%05i' % h),
+                      element('Hit_len'       , len(seq)),
+                      '<Hit_hsps>'])
+        parts.extend(make_hsp(n,seq,h) for n in xrange(1,hsps+1))
+        parts.append('</Hit_hsps></Hit>')
+    parts.extend(['</Iteration_hits>',
+                  '<Iteration_stat><Statistics>',
+                  element('Statistics_db-num' , hits),
+                  element('Statistics_db-len' , hits * len(seq)),
+                  '</Statistics></Iteration_stat>'])
+    if not hits:
+        parts.append(element('Iteration_message','No hits found'))
+    parts.append('</Iteration>')
+    return ''.join(parts)
+
+def main(argv):
+    program = basename(argv[0])
+    args    = parse_args(argv[1:])
+    for required in ('query','out','db'):
+        if required not in args:
+            sys.stderr.write('%s: missing argument -%s\n' % (program,required))
+            return 1
+    if args.get('outfmt') != '5':
+        sys.stderr.write('%s: only -outfmt 5 is supported by this stand-in\n' % program)
+        return 1
+    db = args['db']
+    if not (isfile(db + '.psq') or isfile(db + '.nsq')):
+        sys.stderr.write('BLAST Database error: No alias or index file found for database [%s]\n' % db)
+        return 2
+
+    hits    = int(environ.get('SCRY_FAKE_BLAST_HITS' ,10))
+    hsps    = int(environ.get('SCRY_FAKE_BLAST_HSPS' ,1))
+    delay   = float(environ.get('SCRY_FAKE_BLAST_DELAY',0))
+    log     = environ.get('SCRY_FAKE_BLAST_LOG')
+    queries = read_queries(args['query'])
+    if delay:
+        sleep(delay * len(queries))
+
+    first = (queries[0] if queries else ('',''))
+    with open(args['out'],'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">\n')
+        f.write('<BlastOutput>')
+        f.write(element('BlastOutput_program'  , program))
+        f.write(element('BlastOutput_version'  , '%s 2.2.29+' % program.upper()))
+        f.write(element('BlastOutput_reference', 'SCRY benchmark stand-in'))
+        f.write(element('BlastOutput_db'       , db))
+        f.write(element('BlastOutput_query-ID' , 'Query_1'))
+        f.write(element('BlastOutput_query-def', first[0]))
+        f.write(element('BlastOutput_query-len', len(first[1])))
+        f.write('<BlastOutput_param><Parameters>%s</Parameters></BlastOutput_param>' % element('Parameters_expect',args.get('evalue',10)))
+        f.write('<BlastOutput_iterations>')
+        for i, (definition, seq) in enumerate(queries):
+            f.write(make_iteration(i+1,definition,seq,basename(db),hits,hsps))
+        f.write('</BlastOutput_iterations></BlastOutput>\n')
+
+    if log:
+        with open(log,'a') as f:
+            f.write('%s %i\n' % (program,len(queries)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,208 @@
+from itertools import izip, repeat
+
+
+# A table of variable bindings, stored column by column: one list of values per variable, where the
+# values of a single solution share the same index in every column. This avoids allocating a dictionary
+# for each of a handler's (possibly hundreds of thousands of) solutions. Unbound values are stored as None.
+# Handlers build their bindings as BindingTables, and join them through join() below.
+class BindingTable(object):
+    __slots__ = ['vars','columns','index','length']
+
+    def __init__(self,variables=()):
+        self.vars    = list(variables)                              # The Variables of the table, in the order of 'columns'
+        self.columns = [list() for v in self.vars]                  # One list of values per Variable
+        self.index   = dict((v,i) for i, v in enumerate(self.vars)) # Variables pointing to the position of their column
+        self.length  = 0                                            # The number of rows; tracked separately, as a table may have no columns
+
+    @classmethod
+    def from_dicts(cls,dicts):
+        table = cls()
+        for d in dicts:
+            table.append(d)
+        return table
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        return self.length > 0
+
+    def __contains__(self,var):
+        return var in self.index
+
+    def column(self,var):
+        return self.columns[self.index[var]]
+
+    def add_column(self,var):
+        self.index[var] = len(self.vars)
+        self.vars.append(var)
+        self.columns.append([None] * self.length)
+
+    # Adds a row of values, in the order of 'vars'
+    def add_row(self,values):
+        for col, val in izip(self.columns,values):
+            col.append(val)
+        self.length += 1
+
+    # Adds a row from a dictionary, adding columns for any Variables the table did not have yet
+    def append(self,d):
+        for var in d:
+            if var not in self.index:
+                self.add_column(var)
+        self.add_row([d.get(v) for v in self.vars])
+
+    # Adds all rows of another table, with None for the Variables either table lacks
+    def add_rows(self,table):
+        for var in table.vars:
+            if var not in self.index:
+                self.add_column(var)
+        for var, col in izip(self.vars,self.columns):
+            if var in table.index:
+                col.extend(table.column(var))
+            else:
+                col.extend(repeat(None,table.length))
+        self.length += table.length
+
+    def rows(self):
+        if not self.columns:
+            return repeat((),self.length)
+        return izip(*self.columns)
+
+    # Yields the rows as dictionaries of their bound values, for code which evaluates expressions against them
+    def dicts(self):
+        for row in self.rows():
+            yield dict((v,x) for v, x in izip(self.vars,row) if x is not None)
+
+    def slice(self,start,stop):
+        table         = BindingTable(self.vars)
+        table.columns = [col[start:stop] for col in self.columns]
+        table.length  = max(0,min(stop,self.length) - start)
+        return table
+
+    # Returns a copy of the table with a column added for 'var'
+    def with_column(self,var,values):
+        table         = BindingTable(self.vars + [var])
+        table.columns = [list(col) for col in self.columns] + [list(values)]
+        table.length  = self.length
+        return table
+
+    # Returns a table with the columns of 'variables' (None for those this table lacks), in that order
+    # The columns are shared with this table, rather than copied
+    def project(self,variables):
+        table         = BindingTable(variables)
+        empty         = [None] * self.length
+        table.columns = [(self.column(v) if v in self.index else empty) for v in variables]
+        table.length  = self.length
+        return table
+
+    # Returns a table without duplicate rows; rows whose values are in 'seen' are skipped, and those kept are added to it
+    def distinct(self,seen=None):
+        if seen is None:
+            seen = set()
+        table = BindingTable(self.vars)
+        for row in self.rows():
+            if row not in seen:
+                seen.add(row)
+                table.add_row(row)
+        return table
+
+### END OF BindingTable
+
+
+# A table of bindings which consumers may read while its producer is still adding to it, used when
+# context handlers are pipelined. All streams of a query share one Condition, which is notified whenever
+# rows are added or a stream is closed. Consumers which register themselves read the rows in order,
+# through their own cursor; to bound how far a producer runs ahead of them, it blocks while its slowest
+# registered consumer lags 'max_lag' rows behind. (Unregistered readers, e.g. handlers which wait for the
+# stream to be closed before reading it as a whole, never hold up its producer.) Producers must only add
+# rows through add_rows(); a closed stream can be used like any other handler's bindings.
+class BindingStream(BindingTable):
+    __slots__ = ['condition','max_lag','cursors','closed']
+
+    def __init__(self,condition,max_lag=None):
+        super(BindingStream,self).__init__()
+        self.condition = condition # The threading.Condition shared by all streams of a query
+        self.max_lag   = max_lag   # The maximum number of rows registered consumers may lag behind, or None to never block
+        self.cursors   = dict()    # Registered consumers pointing to the number of rows they have read
+        self.closed    = False     # Set once the producer will not add any more rows
+
+    def add_rows(self,table):
+        with self.condition:
+            while self.max_lag and self.cursors and self.length - min(self.cursors.values()) >= self.max_lag:
+                self.condition.wait()
+            super(BindingStream,self).add_rows(table)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def register(self,consumer):
+        with self.condition:
+            self.cursors[consumer] = 0
+
+    def unregister(self,consumer):
+        with self.condition:
+            self.cursors.pop(consumer,None)
+            self.condition.notify_all()
+
+    # Returns a table of up to 'max_rows' rows the consumer has not read yet, waiting for the producer if there are none
+    # Returns an empty table once the stream is closed and every row has been read
+    def read(self,consumer,max_rows):
+        with self.condition:
+            start = self.cursors[consumer]
+            while self.length == start and not self.closed:
+                self.condition.wait()
+            rows = self.slice(start,start+max_rows)
+            self.cursors[consumer] = start + len(rows)
+            self.condition.notify_all()
+            return rows
+
+### END OF BindingStream
+
+
+# SPARQL's join of two binding tables: merges every pair of rows which agree on the Variables they both bind.
+# The right table is indexed on the shared Variables bound in every row of both tables, so each row of the
+# left table is only compared to the rows it may be compatible with; other shared Variables (i.e. those which
+# are unbound in some rows) are compared row by row. Without any shared Variables, this is a cross product.
+# If 'unique' is True, duplicate merged rows are only kept once.
+def join(left,right,unique=False):
+    variables = left.vars + [v for v in right.vars if v not in left.index]
+    out       = BindingTable(variables)
+    if not left or not right:
+        return out
+
+    shared = [v for v in left.vars if v in right.index]
+    keys   = [v for v in shared if not (has_unbound(left.column(v)) or has_unbound(right.column(v)))]
+    loose  = [(left.index[v],right.index[v]) for v in shared if v not in keys]
+    lkeys  = [left.index[v]  for v in keys]
+    rkeys  = [right.index[v] for v in keys]
+    extra  = [right.index[v] for v in variables[len(left.vars):]] # Positions of the right table's own Variables
+
+    table = dict()
+    for row in right.rows():
+        table.setdefault(tuple(row[i] for i in rkeys),list()).append(row)
+
+    seen = set()
+    for a in left.rows():
+        for b in table.get(tuple(a[i] for i in lkeys),()):
+            row = a
+            if loose:
+                if not all(a[i] is None or b[j] is None or a[i] == b[j] for i, j in loose):
+                    continue
+                row = list(a)
+                for i, j in loose:
+                    if row[i] is None:
+                        row[i] = b[j]
+                row = tuple(row)
+            row += tuple(b[j] for j in extra)
+            if unique:
+                if row in seen:
+                    continue
+                seen.add(row)
+            out.add_row(row)
+    return out
+
+def has_unbound(column):
+    return any(x is None for x in column)
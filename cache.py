@@ -0,0 +1,170 @@
+from threading   import Lock
+from collections import OrderedDict
+from heapq       import heappush, heappop, heapify
+from time        import time
+from sys         import getsizeof
+
+
+# A thread-safe, bounded Least Recently Used cache, which counts its hits and misses so it can be sized
+# By default every entry weighs 1, making max_size the maximum number of entries. Entries may optionally
+# be weighed by a function of their value instead (e.g. their size in bytes), and expire after 'ttl' seconds.
+# A max_size of 0 (or less) disables the cache; get() will then always miss and put() is a no-op
+class LRUCache(object):
+    def __init__(self,max_size,weigh=None,ttl=None):
+        self.max_size = max_size      # The maximum total weight of the entries kept in the cache
+        self.weigh    = weigh         # A function returning the weight of a value, or None to weigh every entry as 1
+        self.ttl      = ttl           # The number of seconds after which entries expire, or None to keep them until they are evicted
+        self.entries  = OrderedDict() # Keys pointing to (value, weight, expiry time) tuples, ordered from least to most recently used
+        self.weight   = 0             # The total weight of all entries
+        self.lock     = Lock()
+        self.hits     = 0
+        self.misses   = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def get(self,key,default=None):
+        with self.lock:
+            try:
+                value, weight, expires = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time():
+                self.weight -= weight
+                self.misses += 1
+                return default
+            self.entries[key] = (value,weight,expires) # Re-insert the entry to mark it as most recently used
+            self.hits += 1
+            return value
+
+    def put(self,key,value):
+        weight  = (self.weigh(value) if self.weigh else 1)
+        expires = (time() + self.ttl if self.ttl else None)
+        if weight > self.max_size: return
+        with self.lock:
+            self.remove_unlocked(key)
+            self.entries[key] = (value,weight,expires)
+            self.weight      += weight
+            while self.weight > self.max_size:
+                old_key, (old_value, old_weight, old_expires) = self.entries.popitem(last=False)
+                self.weight -= old_weight
+
+    def discard(self,key):
+        with self.lock:
+            self.remove_unlocked(key)
+
+    # Removes an entry without acquiring the lock; callers must hold it
+    def remove_unlocked(self,key):
+        try:
+            value, weight, expires = self.entries.pop(key)
+            self.weight -= weight
+        except KeyError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+
+    def stats(self):
+        return {'size'     : len(self.entries),
+                'weight'   : self.weight,
+                'max_size' : self.max_size,
+                'hits'     : self.hits,
+                'misses'   : self.misses}
+
+### END OF LRUCache
+
+
+# A thread-safe cache bounded by the total size of its values, which evicts entries according to the
+# GreedyDual-Size policy: every entry has a priority equal to the cost of (re)computing its value divided
+# by its size, offset by an "inflation" value which rises to the priority of each evicted entry. Entries
+# which are costly to recompute for their size are kept longest, while those which were not used
+# for a while eventually lose out to newer ones, like in an LRU cache.
+class CostAwareCache(object):
+    def __init__(self,max_size):
+        self.max_size  = max_size # The maximum total size of the values kept in the cache, e.g. in bytes
+        self.entries   = dict()   # Keys pointing to (value, size, cost, priority) tuples
+        self.heap      = list()   # (priority, sequence number, key) tuples; may contain outdated entries, which are skipped
+        self.inflation = 0.0      # The priority of the most recently evicted entry
+        self.size      = 0        # The total size of all cached values
+        self.count     = 0        # Sequence number for heap entries, so equal priorities are evicted in the order they were set
+        self.lock      = Lock()
+        self.hits      = 0
+        self.misses    = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self,key,default=None):
+        with self.lock:
+            try:
+                value, size, cost, priority = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.set_priority(key,value,size,cost)
+            self.hits += 1
+            return value
+
+    def put(self,key,value,cost,size=None):
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_size: return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.set_priority(key,value,size,cost)
+            self.size += size
+            while self.size > self.max_size:
+                self.evict()
+
+    # Must be called while holding the lock
+    def set_priority(self,key,value,size,cost):
+        priority          = self.inflation + float(cost) / max(size,1)
+        self.entries[key] = (value,size,cost,priority)
+        self.count       += 1
+        heappush(self.heap,(priority,self.count,key))
+        if len(self.heap) > 2 * len(self.entries) + 64: # Drop outdated heap entries once they outnumber the current ones
+            self.heap = [(e[3],i,k) for i, (k,e) in enumerate(self.entries.iteritems())]
+            heapify(self.heap)
+
+    # Must be called while holding the lock
+    def evict(self):
+        while self.heap:
+            priority, count, key = heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[3] == priority:
+                del self.entries[key]
+                self.size     -= entry[1]
+                self.inflation = priority
+                return
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.heap = list()
+            self.size = 0
+
+    def stats(self):
+        return {'size'      : len(self.entries),
+                'bytes'     : self.size,
+                'max_bytes' : self.max_size,
+                'hits'      : self.hits,
+                'misses'    : self.misses}
+
+### END OF CostAwareCache
+
+
+# A rough estimate of the memory used by a (nested) value, in bytes
+def estimate_size(value):
+    if isinstance(value,dict):
+        return getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.iteritems())
+    elif isinstance(value,(list,tuple,set,frozenset)):
+        return getsizeof(value) + sum(estimate_size(v) for v in value)
+    else:
+        return getsizeof(value)
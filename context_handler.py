@@ -1,14 +1,22 @@
-from utility                       import SCRYError, EmptyListError
+from __init__                      import ORB_RESULT_CACHE
+from utility                       import SCRYError
+from bindings                      import BindingTable, BindingStream, join
+from cache                         import LRUCache
+from metrics                       import SOLUTIONS, BINDINGS_JOINED, register_cache
 
-from rdflib                        import Namespace
 from rdflib.graph                  import Graph
 from rdflib.term                   import URIRef, Literal, BNode, Variable
 from rdflib.plugins.sparql.sparql  import Prologue, Query
 from rdflib.plugins.sparql.algebra import CompValue
 
+ORB_RESULTS = LRUCache(ORB_RESULT_CACHE) # (Normalized query string, index of the GRAPH node) tuples pointing to (orb description, BindingTable) tuples
+register_cache('orb',ORB_RESULTS)
+
 
 # Superclass of OrbHandler, CallHandler, VarSubCallHandler, ValuesHandler and BindHandler
 class ContextHandler(object):
+    __slots__ = ['query_handler','input_vars','output_vars','bound_vars','dependencies','executed','bindings']
+
     def __init__(self, query_handler):
         self.query_handler       = query_handler
         self.input_vars          = set()   # A set of Variable instances which must be bound prior to executing this handler
@@ -17,71 +25,66 @@ class ContextHandler(object):
         self.dependencies        = set()   # A set of other ContextHandlers, whose outputs intersect this handler's inputs
 
         self.executed            = False   # A boolean to keep track of whether or not this Handler's bindings have been evaluated
-        self.bindings            = list()  # A list of dictionaries with the values for 'bound_vars' produced by this handler
-
-    def get_independent_handler(self,checked):
-        if self in checked:
-            raise SCRYError("Circular Input/Output dependencies could not be resolved!")
-        checked.append(self)
-        for handler in self.dependencies:
-            if not handler.executed:
-                return handler.get_independent_handler(checked)
-        return self
+        self.bindings            = BindingTable() # A table with the values for 'bound_vars' produced by this handler
 
     def set_bound_vars(self):
         self.bound_vars = self.input_vars.union(self.output_vars)
+
+    # Returns the Procedure instances invoked by this handler
+    def get_procedures(self):
+        return list()
+
+    # Replaces this handler's bindings by a BindingStream, so pipelined dependents can read them as they are produced
+    def stream_bindings(self,condition,max_lag=None):
+        self.bindings = BindingStream(condition,max_lag)
+
+    # Called once this handler has stopped executing, whether it succeeded or not
+    def close_bindings(self):
+        if isinstance(self.bindings,BindingStream):
+            self.bindings.close()
+
+    # Blocks until at most 'streamed' of this handler's dependencies are still producing bindings, and returns those that are
+    # Without pipelining, dependencies have always finished by the time a handler is executed
+    def wait_for_dependencies(self,streamed=0):
+        condition = self.query_handler.pipeline_cond
+        with condition:
+            while True:
+                producing = [dep for dep in self.dependencies if isinstance(dep.bindings,BindingStream) and not dep.bindings.closed]
+                if len(producing) <= streamed:
+                    return producing
+                condition.wait()
         
     def execute(self):
         raise NotImplementedError("Children of the ContextHandler class should override the 'execute' method's definition!")
 
     # Used by CallHandler and BindHandler to combine valid inputs from the outputs of their dependencies
-    def merge_and_filter(self,keys,dict_lists):
-        N = len(dict_lists)
-        
-        def num_shared_keys(i,j):
-            try:
-                x = dict_lists[i][0].keys()
-                y = dict_lists[j][0].keys()
-            except IndexError:
-                raise EmptyListError()
-            return len(set(x).intersection(set(y)))
-        
-        def merge_two(shared,i,j):
-            try:
-                x     = dict_lists.pop(j)
-                y     = dict_lists.pop(i)
-                z     = list()
-                valid = list()        
-                E     = len(x[0]) + len(y[0]) - shared # Expected size of merged dictionaries
-            except IndexError:
-                raise EmptyListError()
-            for a in x:
-                for b in y:
-                    c = set(a.items()).union(set(b.items()))
-                    if len(c) == E:
-                        valid.append(c)        
-            for v in valid: # Iterate over valid sets
-                for u in z: # Iterate over unique sets stored so far
-                    if v == u:
-                        break
-                else:
-                    z.append(v)
-            out = [{t[0]:t[1] for t in s} for s in z]
-            dict_lists.append(out)
-
-        try:
-            while N != 1:
-                max_shared = (0,0,1)
-                for i in range(N):
-                    for j in range(i+1,N):
-                        shared = num_shared_keys(i,j)
-                        if shared > max_shared[0]:
-                            max_shared = (shared,i,j)
-                merge_two(*max_shared)
-                N -= 1
-            return dict_lists[0]
-        except EmptyListError:
-            return list()
+    # The two tables sharing the most variables are joined first, until a single table of merged rows remains
+    # If no rows remain, the empty table still has a column for every variable of 'tables'
+    def merge_and_filter(self,keys,tables):
+        tables    = list(tables) # Copied, as the merged tables replace the ones they were built from
+        variables = list()
+        for table in tables:
+            variables.extend(v for v in table.vars if v not in variables)
+        if not tables or not all(tables):
+            return BindingTable(variables)
+
+        while len(tables) != 1:
+            N          = len(tables)
+            max_shared = (0,0,1) # Tables without any shared variables are merged as a cross product
+            for i in range(N):
+                for j in range(i+1,N):
+                    shared = len(set(tables[i].vars).intersection(tables[j].vars))
+                    if shared > max_shared[0]:
+                        max_shared = (shared,i,j)
+            shared, i, j = max_shared
+            x      = tables.pop(j)
+            y      = tables.pop(i)
+            merged = join(x,y,unique=True)
+            BINDINGS_JOINED.inc(value=len(merged))
+            if not merged:
+                return BindingTable(variables)
+            tables.append(merged)
+        return tables[0]
             
 ### END OF ContextHandler
 
@@ -89,6 +92,8 @@ class ContextHandler(object):
 
 # The most commonly used class in this file -- executes service calls to services specified by its PAU
 class CallHandler(ContextHandler):
+    __slots__ = ['procedure','pau','input_triples','output_triples','description_triples']
+
     def __init__(self,query_handler,proc,pau):
         super(CallHandler,self).__init__(query_handler)
         self.procedure           = proc    # The Procedure instance this Call is associated with
@@ -96,6 +101,9 @@ class CallHandler(ContextHandler):
         self.input_triples       = list()
         self.output_triples      = list()
         self.description_triples = list()
+
+    def get_procedures(self):
+        return [self.procedure]
       
     def add_input(self,triple):
         self.input_triples.append(triple)
@@ -119,11 +127,8 @@ class CallHandler(ContextHandler):
         def_id  = None
         
         for t in self.input_triples:
-            p = t[1].encode()
-            try:
-                spec = p.split('?')[1]
-                if spec == '_': raise IndexError
-            except IndexError:
+            spec = self.query_handler.split_uri(t[1])[1]
+            if spec is None or spec == '_':
                 if default:
                     def_id = default.id_string
                     spec   = def_id
@@ -146,11 +151,8 @@ class CallHandler(ContextHandler):
         def_id   = None
         
         for t in self.output_triples:
-            p = t[1].encode()
-            try:
-                spec = p.split('?')[1]
-                if spec == '_': raise IndexError
-            except IndexError:
+            spec = self.query_handler.split_uri(t[1])[1]
+            if spec is None or spec == '_':
                 if default:
                     def_id = default.id_string
                     spec   = def_id
@@ -193,8 +195,10 @@ class CallHandler(ContextHandler):
         # [ {'a':"foo", 'b':<http://www.example.com/hello>}, {'a':"foo", 'b':<http://www.example.com/world>} ]
         #
         # Third, execute the function associated with this call's procedure N times, where N is the
-        # number of input value dictionaries. Note that these functions are expected to accept
-        # exactly three input arguments:
+        # number of input value dictionaries. (Procedures which override Procedure.execute_batch instead receive all N
+        # input value dictionaries in a single call, and return the N outputs at once; procedures marked io_bound execute the
+        # N invocations concurrently, on a thread pool shared by all queries.) Note that these functions are
+        # expected to accept exactly three input arguments:
         #  1) an input value dictionary as shown above
         #  2) a list of specifiers from the Call's scry:output?$spec$ predicates
         #  3) a reference to the QueryHandler object executing this Call (among others, to offer functions access to QH.service_env)
@@ -212,86 +216,154 @@ class CallHandler(ContextHandler):
         # Finally, the execute function will add 1 subgraph to the QueryHandler's conjunctive graph for every solution
         # dictionary. It will also update its own 'bindings' attribute, so that future Calls may access them.
 
-        dep_binds = [dep.bindings for dep in self.dependencies]
-        
+        # When pipelined, the inputs are read from one dependency while it is still executing, in batches of rows
+        # which are merged with the (complete) bindings of the other dependencies, and executed as soon as they arrive
+
         known_in, var_in, default_in = self.get_input_specifiers(self.procedure)
         out_spec, default_out        = self.get_output_specifiers(self.procedure)
         var_nodes                    = [var_in[k] for k in var_in]
-        var_in_values                = self.merge_and_filter(var_nodes,dep_binds)
         
         constants  = Graph()
         constants += self.get_descriptions(self.procedure,self.pau)
         for spec in known_in:
            constants.add(known_in[spec])
+
+        producing = self.wait_for_dependencies(streamed=1)
+        if not producing:
+            dep_binds     = [dep.bindings for dep in self.dependencies]
+            var_in_values = self.merge_and_filter(var_nodes,dep_binds)
+            if not (var_in_values or var_in):
+                var_in_values.add_row(()) # A single row without any variables; the procedure is invoked once
+            self.execute_rows(var_in_values,known_in,var_in,out_spec,default_out,constants)
+        else:
+            stream    = producing[0].bindings
+            dep_binds = [dep.bindings for dep in self.dependencies if dep is not producing[0]]
+            seen      = set() # Merged rows are only unique within a batch; duplicates across batches are skipped here
+            stream.register(self)
+            try:
+                while True:
+                    rows = stream.read(self,self.query_handler.pipeline_rows)
+                    if not rows: break
+                    var_in_values = self.merge_and_filter(var_nodes,[rows] + dep_binds)
+                    if dep_binds:
+                        var_in_values = var_in_values.project(sorted(var_in_values.vars)).distinct(seen) # Projected to one column order for every batch
+                    self.execute_rows(var_in_values,known_in,var_in,out_spec,default_out,constants)
+            finally:
+                stream.unregister(self)
         
-        if not (var_in_values or var_in):
-            var_in_values.append(dict())
-        for d in var_in_values:
+        if not self.input_triples + self.output_triples: # If only descriptive predicates were used with this PAU...
+            self.add_solution_graphs(constants,[list()])
+
+        self.executed = True
+
+    # Invokes the procedure for a table of merged input bindings, adding the solutions to the graph and 'bindings'
+    def execute_rows(self,var_in_values,known_in,var_in,out_spec,default_out,constants):
+        if not var_in_values:
+            return # The dependencies produced no valid inputs, so there is nothing to invoke the procedure for
+        in_cols  = [(k,var_in_values.column(var_in[k][2])) for k in var_in]
+        in_dicts = list()
+        for i in xrange(len(var_in_values)):
             in_dict = dict()
             for k in known_in:
                 in_dict[k] = known_in[k][2]
-            for k in var_in:
-                in_dict[k] = d[var_in[k][2]]
-            
-            solution_dicts = self.procedure.execute(in_dict,out_spec.keys(),self.query_handler)
-
-            if not solution_dicts:
-                continue # Abort if the function call produced no output
-            elif isinstance(solution_dicts,list):
-                pass
-            elif isinstance(solution_dicts,dict):
-                solution_dicts = [solution_dicts]
-            elif isinstance(solution_dicts,(URIRef,Literal)):
-                solution_dicts = [{default_out:solution_dicts}]
-            else:
-                raise SCRYError("Invalid output type: %s" % type(solution_dicts))
+            for k, col in in_cols:
+                in_dict[k] = col[i]
+            in_dicts.append(in_dict)
+
+        # The procedure is invoked for all input dictionaries at once, so it may process them as a batch
+        outputs = self.procedure.invoke_batch(in_dicts,out_spec.keys(),self.query_handler)
 
-            for sd in solution_dicts:
-                # Add a subgraph and update self.bindings
-                binds = dict()
-                g     = Graph(self.query_handler.graph.store,BNode())
-                g    += constants
+        # Every solution is added as a row of values, to a table with a column per input and output variable
+        out_vars = [var_in[k][2] for k in var_in] + [out_spec[k][2] for k in out_spec if isinstance(out_spec[k][2],Variable)]
+        bindings = BindingTable(sorted(set(out_vars)))
+        position = bindings.index
+        solution_triples = list()
+        for in_dict, output in zip(in_dicts,outputs):
+            for sd in self.get_solution_dicts(output,default_out):
+                # Add a subgraph and a row of bindings
+                row     = [None] * len(position)
+                triples = list()
                 for k in var_in:
-                    s,p,var    = var_in[k]
-                    binds[var] = in_dict[k]
-                    g.add((s,p,in_dict[k]))
+                    s,p,var = var_in[k]
+                    row[position[var]] = in_dict[k]
+                    triples.append((s,p,in_dict[k]))
 
                 for k in out_spec:
                     s,p,var = out_spec[k]
                     if isinstance(var,Variable):
-                        binds[var] = sd[k] 
-                    g.add((s,p,sd[k]))
-             
-                self.bindings.append(binds)
-        
-        if not self.input_triples + self.output_triples: # If only descriptive predicates were used with this PAU...
-            g  = Graph(self.query_handler.graph.store,BNode())
-            g += constants
+                        row[position[var]] = sd[k]
+                    triples.append((s,p,sd[k]))
 
-        self.executed = True
+                solution_triples.append(triples)
+                bindings.add_row(row)
+        self.add_solution_graphs(constants,solution_triples)
+        self.bindings.add_rows(bindings) # Added at once, so pipelined consumers are notified once per batch
+        SOLUTIONS.inc((self.__class__.__name__,),len(bindings))
+
+    # Procedures may return a list of solution dictionaries, a single dictionary, a single RDF node, or nothing at all
+    def get_solution_dicts(self,output,default_out):
+        if not output:
+            return list() # The function call produced no output
+        elif isinstance(output,list):
+            return output
+        elif isinstance(output,dict):
+            return [output]
+        elif isinstance(output,(URIRef,Literal)):
+            return [{default_out:output}]
+        else:
+            raise SCRYError("Invalid output type: %s" % type(output))
+
+    # Adds the subgraphs of a batch of solutions (each a list of triples) to the QueryHandler's conjunctive graph, unless
+    # the query planner determined the query can be answered from the handlers' bindings alone. The query is evaluated
+    # against the union of the graph's contexts, so unless it matches contexts through GRAPH ?variable patterns, every
+    # solution and its constant triples are added to a single shared context; otherwise, each solution gets its own.
+    # Either way, all triples are added to the store in a single addN() call.
+    def add_solution_graphs(self,constants,solutions):
+        qh = self.query_handler
+        if not (qh.materialize and solutions): return
+        with qh.graph_lock: # Handlers may be executed in parallel, but adding to the graph is not thread-safe
+            if qh.parsed_query.graph_vars:
+                quads = list()
+                for triples in solutions:
+                    g = Graph(qh.graph.store,BNode())
+                    quads.extend((s,p,o,g) for s,p,o in constants)
+                    quads.extend((s,p,o,g) for s,p,o in triples)
+            else:
+                g     = qh.solution_graph
+                quads = [(s,p,o,g) for s,p,o in constants] # Triples the shared context already holds are ignored by the store
+                for triples in solutions:
+                    quads.extend((s,p,o,g) for s,p,o in triples)
+            qh.graph.addN(quads)
  
 ### END OF CallHandler
 
 
 class VarSubCallHandler(CallHandler):
+    __slots__ = ['subject','procedures']
+
     def __init__(self,query_handler,var):
         super(VarSubCallHandler,self).__init__(query_handler,None,None)
-        self.subject = var
+        self.subject    = var
+        self.procedures = list() # The Procedure instances associated with the PAUs bound to 'subject'
         self.input_vars.add(var)
+
+    def get_procedures(self):
+        return self.procedures
     
     def execute(self):
+        self.wait_for_dependencies() # The PAUs bound to 'subject' must all be known before any are invoked
         dep_binds      = [dep.bindings for dep in self.dependencies]
         service_config = self.query_handler.global_dict['service_config']
 
         paus = set()
-        for dict_list in dep_binds:
-            if self.subject in dict_list[0]:
-                for d in dict_list:
-                    paus.add(d[self.subject])
+        for table in dep_binds:
+            if self.subject in table:
+                paus.update(table.column(self.subject))
         
         for pau in paus:
-            short_uri = URIRef(pau.encode().split('?')[0])
+            short_uri = self.query_handler.split_uri(pau)[0]
             procedure = service_config[short_uri]
+            self.procedures.append(procedure)
             
             known_in, var_in, default_in = self.get_input_specifiers(procedure)
             out_spec, default_out        = self.get_output_specifiers(procedure)
@@ -303,7 +375,8 @@ class VarSubCallHandler(CallHandler):
             for spec in known_in:
                 constants.add(known_in[spec])
 
-            for d in var_in_values:
+            in_dicts = list()
+            for d in var_in_values.dicts():
                 if d[self.subject] != pau: continue
                 
                 in_dict = dict()
@@ -312,37 +385,33 @@ class VarSubCallHandler(CallHandler):
                 for k in var_in:
                     if k != self.subject:
                         in_dict[k] = d[var_in[k][2]]
+                in_dicts.append(in_dict)
                 
-                solution_dicts = procedure.execute(in_dict,out_spec.keys(),self.query_handler)
+            outputs  = procedure.invoke_batch(in_dicts,out_spec.keys(),self.query_handler)
+            bindings = BindingTable()
+            solution_triples = list()
     
-                if not solution_dicts:
-                    continue # Abort if the function call produced no output
-                elif isinstance(solution_dicts,list):
-                    pass
-                elif isinstance(solution_dicts,dict):
-                    solution_dicts = [solution_dicts]
-                elif isinstance(solution_dicts,(URIRef,Literal)):
-                    solution_dicts = [{default_out:solution_dicts}]
-                else:
-                    raise SCRYError("Invalid output type: %s" % type(solution_dicts))
-    
-                for sd in solution_dicts:
+            for in_dict, output in zip(in_dicts,outputs):
+                for sd in self.get_solution_dicts(output,default_out):
                     # Add a subgraph and update self.bindings
-                    binds = dict()
-                    g     = Graph(self.query_handler.graph.store,BNode())
-                    g    += constants
+                    binds   = dict()
+                    triples = list()
                     for k in var_in:
                         s,p,var    = var_in[k]
                         binds[var] = in_dict[k]
-                        g.add((pau,p,in_dict[k]))
+                        triples.append((pau,p,in_dict[k]))
 
                     for k in out_spec:
                         s,p,var = out_spec[k]
                         if isinstance(var,Variable):
                             binds[var] = sd[k]
-                        g.add((pau,p,sd[k]))
+                        triples.append((pau,p,sd[k]))
 
-                    self.bindings.append(binds)
+                    solution_triples.append(triples)
+                    bindings.append(binds)
+            self.add_solution_graphs(constants,solution_triples)
+            self.bindings.add_rows(bindings)
+            SOLUTIONS.inc((self.__class__.__name__,),len(bindings))
             
             #if not self.input_triples + self.output_triples: # If only descriptive predicates were used with this PAU...
             #    g  = Graph(self.query_handler.graph.store,BNode())
@@ -357,37 +426,53 @@ class VarSubCallHandler(CallHandler):
 # NOTE: OrbHandlers *CAN NOT* have dependencies on other context handlers!
 # If a query containing BIND or VALUES clauses in the GRAPH scry:orb_description { ... }
 # block is received, it will most likely *NOT* evaluate correctly!
+#
+# The pattern is evaluated against the orb's description graph, which is shared (read-only) by all requests, rather than
+# against a copy of it in the request's graph; queries not answered on the fast path are evaluated against a read-only
+# union of the request's graph and the description. Since the description only changes when the orb's services do, the
+# resulting bindings are cached in ORB_RESULTS. Cached tables are shared by the requests using them, so they must not be modified.
 class OrbHandler(ContextHandler):
+    __slots__ = ['algebra']
+
     def __init__(self,query_handler,algebra):
         super(OrbHandler,self).__init__(query_handler)
         self.algebra = algebra
         self.execute() # OrbHandlers must be independent of other context handlers.
                        # It should always be safe to execute upon instantiation.
 
-    def describe_orb(self):
-        if not self.query_handler.orb_description:
-            scry = Namespace('http://www.scry.com/')
-            g    = Graph(self.query_handler.graph.store,scry.orb_description)
-            g   += self.query_handler.global_dict['orb_description']
-            self.query_handler.orb_description = g
-        return self.query_handler.orb_description
-    
     def execute(self):
+        qh          = self.query_handler
+        description = qh.global_dict['orb_description']
+        nodes       = [alg for name, alg in qh.parsed_query.nodes]
+        key         = (qh.parsed['query_key'],nodes.index(self.algebra))
+
+        entry = ORB_RESULTS.get(key)
+        if entry is not None and entry[0] is description: # Results for a description which has since been replaced are stale
+            table = entry[1]
+        else:
+            table = self.query_description(description)
+            ORB_RESULTS.put(key,(description,table))
+
+        self.output_vars = self.algebra._vars
+        self.bindings    = table
+        self.executed    = True
+
+    def query_description(self,description):
         alg = self.algebra
-        g   = self.describe_orb()
-        
         M = CompValue('Project',p=alg.p,PV=list(alg._vars))
         M = CompValue('Distinct',p=M)
         M = CompValue('SelectQuery',p=M,PV=M.p.PV)
         Q = Query(Prologue(),M)
-        
-        results = g.query(Q)
-        
-        self.output_vars = alg._vars
-        self.bindings    = [dict(zip(results.vars,r)) for r in results]
-        self.executed    = True
+
+        results = description.query(Q)
+        table   = BindingTable(results.vars)
+        for r in results:
+            table.add_row(r)
+        return table
 
 class ValuesHandler(ContextHandler):
+    __slots__ = ['algebra']
+
     def __init__(self,query_handler,algebra):
         super(ValuesHandler,self).__init__(query_handler)
         self.algebra     = algebra
@@ -395,12 +480,14 @@ class ValuesHandler(ContextHandler):
                        # It should always be safe to execute upon instantiation.
         
     def execute(self):
-        self.bindings    = self.algebra.res
-        self.output_vars = set(self.bindings[0].keys())
+        self.bindings    = BindingTable.from_dicts(self.algebra.res)
+        self.output_vars = set(self.bindings.vars)
         self.executed    = True
         
 
 class BindHandler(ContextHandler):
+    __slots__ = ['algebra','expression']
+
     def __init__(self,query_handler,algebra):
         super(BindHandler,self).__init__(query_handler)
         self.algebra     = algebra
@@ -418,15 +505,19 @@ class BindHandler(ContextHandler):
         exp       = self.expression
         
         if self.dependencies:
+            self.wait_for_dependencies()
             dep_binds = [dep.bindings for dep in self.dependencies]
             in_vars   = [var.encode() for var in self.input_vars]
             inputs    = self.merge_and_filter(in_vars,dep_binds)        
-            for d in inputs:
-                self.bindings.append({self.algebra.var:exp.eval(d)})
+            bindings  = BindingTable([self.algebra.var])
+            for d in inputs.dicts():
+                bindings.add_row((exp.eval(d),))
+            self.bindings.add_rows(bindings)
 
         else:
             if hasattr(exp,'eval'):
                 exp = exp.eval()
-            self.bindings = [{self.algebra.var:exp}]
+            self.bindings = BindingTable([self.algebra.var])
+            self.bindings.add_row((exp,))
             
         self.executed = True
\ No newline at end of file
@@ -1,14 +1,22 @@
 #! /usr/bin/env python
 import services
+import metrics
 import flask
 
-from __init__      import DEBUG, ALLOW_REMOTE_ACCESS, IP_WHITELIST, SERVICE_CONFIG_FILE, ORB_DESCRIPTION
+from __init__      import DEBUG, ALLOW_REMOTE_ACCESS, IP_WHITELIST, SERVICE_CONFIG_FILE, SERVICE_MANIFEST, ORB_DESCRIPTION
+from __init__      import SERVING_MODE, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS, LAZY_SERVICES
 from query_handler import QueryHandler
+from profiler      import is_profiling_requested, profile_resolve
+from server        import serve
 
 # Create and configure the web application -- config.from_object uses the DEBUG variable
 orb = flask.Flask(__name__)
 orb.config.from_object(__name__)
 
+# The globals passed to every QueryHandler; set once by set_services(), before any requests are served, and
+# only read afterwards -- so they can be shared by all threads (and forked worker processes) serving requests
+ORB_GLOBALS = dict()
+
 # Route functions
 @orb.route('/')
 def scry_home():
@@ -20,25 +28,39 @@ def scry_query():
     print "SCRY REQUEST RECEIVED"
     ip = flask.request.remote_addr
     if ip in IP_WHITELIST:
-        query = QueryHandler(flask.request, flask.g)
+        query = QueryHandler(flask.request, ORB_GLOBALS)
+        if is_profiling_requested(flask.request):
+            return profile_resolve(query)
         return query.resolve()
     else:
         return "This IP address (%s) is not on the queried SCRY orb's whitelist." % ip, 500
 
+@orb.route('/scry/metrics', methods=['GET'])
+def scry_metrics():
+    ip = flask.request.remote_addr
+    if ip in IP_WHITELIST:
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    else:
+        return "This IP address (%s) is not on the queried SCRY orb's whitelist." % ip, 500
+
 @orb.errorhandler(500)
 def scry_error(e):
     return e.description, 500
 
+# Register the procedures of a service configuration dictionary, and the description of the orb offering them
+def set_services(service_config):
+    ORB_GLOBALS['service_config']  = service_config
+    ORB_GLOBALS['orb_description'] = services.get_orb_description(ORB_DESCRIPTION, service_config)
+
 # Start the app
 def launch():
-    flask.g = dict() # A dictionary for passing globals
-    flask.g['service_config']  = services.load_procedures(SERVICE_CONFIG_FILE)
-    flask.g['orb_description'] = services.get_orb_description(ORB_DESCRIPTION, flask.g['service_config'])
+    set_services(services.load_procedures(SERVICE_CONFIG_FILE, SERVICE_MANIFEST, LAZY_SERVICES)) # Loaded before the production server forks its workers
 
-    if ALLOW_REMOTE_ACCESS:
-        orb.run(host='0.0.0.0')
+    host = ('0.0.0.0' if ALLOW_REMOTE_ACCESS else '127.0.0.1')
+    if SERVING_MODE == 'production':
+        serve(orb, host, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS)
     else:
-        orb.run()
+        orb.run(host=host, port=SERVER_PORT)
     
 if __name__ == "__main__":
     launch()
\ No newline at end of file
@@ -1,73 +1,137 @@
-from __init__ import LOG_DIRECTORY
-from utility  import assert_dir
+from __init__         import LOG_DIRECTORY, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_SAMPLE_RATE, LOG_BODY_BYTES, LOG_COMPRESS_BODY, LOG_QUEUE_SIZE
+from utility          import assert_dir
 
-from os.path  import join
-from datetime import datetime
-from shutil   import copyfile
+from os.path          import join
+from datetime         import datetime
+from json             import dumps
+from zlib             import compress, crc32
+from base64           import b64encode
+from threading        import Thread
+from Queue            import Queue, Full
+from logging          import getLogger, Formatter, INFO
+from logging.handlers import RotatingFileHandler
+from atexit           import register
 
-REQUEST_DIR  = join(LOG_DIRECTORY,'requests')
-RESPONSE_DIR = join(LOG_DIRECTORY,'responses')
+# Requests and responses are logged as JSON lines, which are formatted and written to a rotating log file by a
+# background thread, so that the latency of a request does not include any disk I/O. Records are dropped, rather
+# than holding up requests, if the thread falls behind by more than LOG_QUEUE_SIZE records.
+# Responses are logged alongside the request they answer through the (date, time) key returned by log_request().
 
-assert_dir(REQUEST_DIR)
-assert_dir(RESPONSE_DIR)
+assert_dir(LOG_DIRECTORY)
+
+LOGGER  = getLogger('scry.requests')
+HANDLER = RotatingFileHandler(join(LOG_DIRECTORY,LOG_FILE),maxBytes=LOG_MAX_BYTES,backupCount=LOG_BACKUPS)
+HANDLER.setFormatter(Formatter('%(message)s'))
+LOGGER.addHandler(HANDLER)
+LOGGER.setLevel(INFO)
+LOGGER.propagate = False
+
+QUEUE  = Queue(LOG_QUEUE_SIZE)
+WRITER = None
+
+def write_records(queue):
+    while True:
+        record = queue.get()
+        if record is None: return
+        try:
+            LOGGER.info(dumps(format_record(record),sort_keys=True))
+        except Exception:
+            pass # A record which cannot be logged must not stop the thread
+        finally:
+            queue.task_done()
+
+def start_writer():
+    global WRITER
+    WRITER = Thread(target=write_records,args=(QUEUE,),name='scry-log-writer')
+    WRITER.daemon = True
+    WRITER.start()
+
+# Called in the worker processes of server.serve() after forking, as the writer thread does not survive fork(),
+# and the queue's locks may have been held by it at that moment. Every worker logs to a file of its own
+# (LOG_FILE suffixed with the worker's index), since processes can not safely share a rotating log file.
+def restart_writer(worker):
+    global QUEUE, HANDLER
+    LOGGER.removeHandler(HANDLER)
+    HANDLER.close()
+    HANDLER = RotatingFileHandler(join(LOG_DIRECTORY,'%s.%i' % (LOG_FILE,worker)),maxBytes=LOG_MAX_BYTES,backupCount=LOG_BACKUPS)
+    HANDLER.setFormatter(Formatter('%(message)s'))
+    LOGGER.addHandler(HANDLER)
+    QUEUE = Queue(LOG_QUEUE_SIZE)
+    start_writer()
+
+start_writer()
+
+@register
+def flush_log():
+    QUEUE.join()
+
+def enqueue(record):
+    try:
+        QUEUE.put_nowait(record)
+    except Full:
+        pass
+
+# Whether the request with the given key is logged; derived from the key, so its response is sampled along with it
+def is_sampled(date,time):
+    if LOG_SAMPLE_RATE >= 1: return True
+    return (crc32(date + time) & 0xffffffff) < LOG_SAMPLE_RATE * 0x100000000
+
+# Response bodies are truncated to LOG_BODY_BYTES when they are logged, and optionally compressed
+# This is done by the background thread, so only the truncated body is kept in the queue
+def format_record(record):
+    body = record.pop('body',None)
+    if body is not None:
+        if isinstance(body,unicode):
+            body = body.encode('utf-8')
+        if LOG_COMPRESS_BODY:
+            record['body_zlib'] = b64encode(compress(body))
+        else:
+            record['body'] = body.decode('utf-8','replace')
+    return record
 
 def log_request(request):
-    now       = datetime.now()    
-    date      = now.date().isoformat()
-    time      = now.time().isoformat()
-    last_path = join(LOG_DIRECTORY,'last_request.log')
-    spacer    = '\n\n----------\n\n'
-        
-    vals = request.values
-    print 'Logging HTTP request ('+time+')'
-    with open(last_path,'w') as f:
-
-        f.write('Method   :\t'+request.method+'\n')
-        f.write('Time     :\t'+time+'\n')
-        f.write('Base URL :\t'+request.base_url+'\n')
-        f.write('Full Path:\t'+request.full_path+spacer)
-        
-        f.write('Values (Len '+str(len(vals))+'):'+'\t'+str(vals) + '\n')
-        for k in vals:
-            f.write('\n'+k+':\t'+vals[k])
-        f.write(spacer)
-
-        f.write('Content Length     :\t'+str(request.content_length)+'\n')
-        f.write('Content Type       :\t'+str(request.content_type)+'\n')
-        f.write('Parsed Content Type:\t'+str(request._parsed_content_type)+spacer)        
-                    
-        f.write('Accepted Response Types:\t'+str(request.accept_mimetypes)+spacer)
-                
-        f.write(str(dir(request)) + spacer)
-        for prop in dir(request):
-
-            if prop.find('__') != -1: continue
-            elif prop == 'access_route': continue # Not sure why, but not skipping this causes issues
-            
-            f.write('=== ' + prop + ' ===\n\n')
-            val = getattr(request,prop)
-            fnc = hasattr(val,'__call__')
-            if fnc:
-                f.write(str(type(val)) + spacer)
-            else:
-                f.write(str(val) + spacer)
-
-    # Copy the new last_request.log file to the appropriate location
-    dir_path  = join(REQUEST_DIR,date)
-    file_path = join(dir_path,'%s.log' % (time))
-    assert_dir(dir_path)
-    copyfile(last_path,file_path)
-    
+    now  = datetime.now()
+    date = now.date().isoformat()
+    time = now.time().isoformat()
+    if is_sampled(date,time):
+        enqueue({'type'           : 'request',
+                 'date'           : date,
+                 'time'           : time,
+                 'method'         : request.method,
+                 'url'            : request.base_url,
+                 'remote_addr'    : request.remote_addr,
+                 'values'         : dict((k,request.values[k]) for k in request.values),
+                 'content_length' : request.content_length,
+                 'content_type'   : request.content_type,
+                 'accept'         : str(request.accept_mimetypes)})
     return date, time
 
 def log_response(response, date, time):
-    print 'Logging HTTP response ('+time+')'
-    last_path = join(LOG_DIRECTORY,'last_response.log')
-    with open(last_path,'w') as f:
-        f.write(response)
-
-    # Copy the new last_response.log file to the appropriate location
-    dir_path  = join(RESPONSE_DIR,date)
-    file_path = join(dir_path,'%s.log' % (time))
-    assert_dir(dir_path)
-    copyfile(last_path,file_path)
\ No newline at end of file
+    if is_sampled(date,time):
+        enqueue({'type'      : 'response',
+                 'date'      : date,
+                 'time'      : time,
+                 'bytes'     : len(response),
+                 'truncated' : len(response) > LOG_BODY_BYTES,
+                 'body'      : response[:LOG_BODY_BYTES]})
+
+# Logs a streamed response once it is complete, while passing its chunks on to the client
+def log_response_stream(chunks, date, time):
+    head = list() # The chunks making up the first LOG_BODY_BYTES of the response
+    size = 0
+    try:
+        for chunk in chunks:
+            if size < LOG_BODY_BYTES:
+                head.append(chunk)
+            size += len(chunk)
+            yield chunk
+    finally:
+        # Logged even if the client disconnected
+        if is_sampled(date,time):
+            enqueue({'type'      : 'response',
+                     'date'      : date,
+                     'time'      : time,
+                     'bytes'     : size,
+                     'truncated' : size > LOG_BODY_BYTES,
+                     'streamed'  : True,
+                     'body'      : ''.join(head)[:LOG_BODY_BYTES]})
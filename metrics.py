@@ -0,0 +1,167 @@
+from threading import Lock
+from time      import time
+from bisect    import bisect_left
+
+
+# Counters and latency histograms for the stages of resolving queries, exposed on /scry/metrics in the
+# Prometheus text format. Every metric may have labels (e.g. a procedure's URI); their values are
+# passed as a tuple in the order of the metric's label names. Metrics register themselves on creation.
+
+REGISTRY   = list() # All metrics, in the order they are rendered
+COLLECTORS = list() # Functions returning lines of additional metrics, evaluated whenever the metrics are rendered
+CACHES     = list() # (name, cache) tuples of the caches whose stats are rendered by collect_caches()
+
+DEFAULT_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0,300.0)
+
+
+def format_labels(names,values,extra=''):
+    pairs = ['%s="%s"' % (n,escape(v)) for n, v in zip(names,values)]
+    if extra:
+        pairs.append(extra)
+    return ('{%s}' % ','.join(pairs) if pairs else '')
+
+def escape(value):
+    if isinstance(value,unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+
+class Counter(object):
+    def __init__(self,name,description,labels=()):
+        self.name        = name
+        self.description = description
+        self.labels      = labels  # The names of the metric's labels
+        self.values      = dict()  # Tuples of label values pointing to the counts
+        self.lock        = Lock()
+        REGISTRY.append(self)
+
+    def inc(self,labels=(),value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels,0) + value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name,self.description),
+                 '# TYPE %s counter' % self.name]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name,format_labels(self.labels,labels),repr(float(value))))
+        return lines
+
+### END OF Counter
+
+
+class Histogram(object):
+    def __init__(self,name,description,labels=(),buckets=DEFAULT_BUCKETS):
+        self.name        = name
+        self.description = description
+        self.labels      = labels
+        self.buckets     = buckets # The upper bounds of the buckets, in ascending order; the +Inf bucket is implied
+        self.values      = dict()  # Tuples of label values pointing to [bucket counts, sum, count] lists
+        self.lock        = Lock()
+        REGISTRY.append(self)
+
+    def observe(self,value,labels=()):
+        i = bisect_left(self.buckets,value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets),0.0,0]
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self,labels=()):
+        return Timer(self,labels)
+
+    # Yields the items of an iterator, observing the time spent producing them -- but not the time its consumer spends in
+    # between -- once it is exhausted or closed (e.g. when the client of a streamed response disconnects)
+    def time_iter(self,iterator,labels=()):
+        seconds = 0.0
+        try:
+            start = time()
+            for item in iterator:
+                seconds += time() - start
+                yield item
+                start = time()
+            seconds += time() - start
+        finally:
+            self.observe(seconds,labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name,self.description),
+                 '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets,counts):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (self.name,format_labels(self.labels,labels,'le="%s"' % repr(bound)),cumulative))
+                lines.append('%s_bucket%s %d' % (self.name,format_labels(self.labels,labels,'le="+Inf"'),count))
+                lines.append('%s_sum%s %s'    % (self.name,format_labels(self.labels,labels),repr(total)))
+                lines.append('%s_count%s %d'  % (self.name,format_labels(self.labels,labels),count))
+        return lines
+
+### END OF Histogram
+
+
+# Observes the number of seconds spent within a 'with' block
+class Timer(object):
+    def __init__(self,histogram,labels=()):
+        self.histogram = histogram
+        self.labels    = labels
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.histogram.observe(time() - self.start,self.labels)
+
+### END OF Timer
+
+
+# Exposes the stats() of a cache.LRUCache or cache.CostAwareCache, labelled with the cache's name
+def register_cache(name,cache):
+    CACHES.append((name,cache))
+
+def collect_caches():
+    samples = dict() # Names of stats pointing to lines of samples, so each metric is rendered as a single group
+    for name, cache in CACHES:
+        for key, value in cache.stats().items():
+            samples.setdefault(key,list()).append('scry_cache_%s{cache="%s"} %s' % (key,escape(name),repr(float(value))))
+    lines = list()
+    for key in sorted(samples):
+        lines.append('# TYPE scry_cache_%s %s' % (key,('counter' if key in ('hits','misses') else 'gauge')))
+        lines.extend(samples[key])
+    return lines
+
+
+def render():
+    lines = list()
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in COLLECTORS:
+        lines.extend(collect())
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS     = Histogram('scry_stage_seconds',
+                              'Time spent in each stage of resolving a query',
+                              labels=('stage',))
+HANDLER_SECONDS   = Histogram('scry_handler_seconds',
+                              'Time spent executing context handlers, per handler type',
+                              labels=('handler',))
+PROCEDURE_SECONDS = Histogram('scry_procedure_seconds',
+                              'Time spent executing procedures, per procedure URI and per batch of inputs',
+                              labels=('procedure',))
+PROCEDURE_ERRORS  = Counter('scry_procedure_errors_total',
+                            'Number of procedure executions which raised an exception',
+                            labels=('procedure',))
+SOLUTIONS         = Counter('scry_solutions_total',
+                            'Number of solutions produced by procedure calls',
+                            labels=('handler',))
+BINDINGS_JOINED   = Counter('scry_bindings_joined_total',
+                            'Number of rows produced by merging the bindings of context handlers\' dependencies')
+
+COLLECTORS.append(collect_caches)
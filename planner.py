@@ -0,0 +1,226 @@
+from utility                         import SCRYError
+from context_handler                 import CallHandler, VarSubCallHandler, OrbHandler
+from scheduler                       import DAGScheduler
+from bindings                        import BindingTable, join
+
+from rdflib.term                     import Variable, URIRef
+from rdflib.query                    import Result
+from rdflib.plugins.sparql.algebra   import CompValue
+from rdflib.plugins.sparql.sparql    import SPARQLError
+
+
+# The fast path answers SELECT queries straight from the 'bindings' of their context handlers, which
+# saves both writing every solution into the QueryHandler's graph, and evaluating the query against it.
+#
+# It only applies to queries whose WHERE clause is built from nothing but basic graph patterns of
+# scry:input and scry:output triples, VALUES and BIND clauses and GRAPH scry:orb_description patterns, and
+# of which every triple has a (URI) PAU as its subject. For such queries, evaluating the query against the
+# graph is equivalent to:
+#  1) binding each triple pattern to the distinct values its handler stored under that subject and predicate
+#  2) joining the triple patterns of every BGP, and those with VALUES and the OrbHandlers' bindings, as in any SPARQL evaluation
+#  3) evaluating BIND expressions against every solution, leaving their variable unbound on errors
+#  4) projecting the solutions onto the selected variables, removing duplicates for SELECT DISTINCT
+# Everything else (other GRAPHs, FILTER, OPTIONAL, UNION, ORDER BY, LIMIT, aggregates, etc.) falls back on the graph.
+
+PATTERN_NODES   = ['BGP','Join','ToMultiSet','Extend','Graph']
+MODIFIER_NODES  = ['Distinct','Reduced']
+ORB_DESCRIPTION = URIRef('http://www.scry.com/orb_description')
+
+
+# Returns the Project node of a SELECT query's algebra if its shape allows the fast path, None otherwise
+# Only depends on the query itself, so it is evaluated once per ParsedQuery
+def find_fast_path_projection(algebra):
+    if algebra.name != 'SelectQuery': return None
+    node = algebra.p
+    while node.name in MODIFIER_NODES:
+        node = node.p
+    if node.name != 'Project' or not is_simple_pattern(node.p):
+        return None
+    return node
+
+def is_simple_pattern(node):
+    if not isinstance(node,CompValue) or node.name not in PATTERN_NODES:
+        return False
+    elif node.name == 'BGP':
+        return True
+    elif node.name == 'Join':
+        return is_simple_pattern(node.p1) and is_simple_pattern(node.p2)
+    elif node.name == 'ToMultiSet':
+        return isinstance(node.p,CompValue) and node.p.name == 'values'
+    elif node.name == 'Extend':
+        return is_simple_pattern(node.p)
+    elif node.name == 'Graph':
+        return node.term == ORB_DESCRIPTION # Evaluated by an OrbHandler
+
+
+# Returns a FastPath for the QueryHandler's query if it can be answered from its handlers' bindings, None otherwise
+# Must be called after the handlers' dependencies are set, but before they are executed
+def plan_fast_path(query_handler):
+    parsed = query_handler.parsed_query
+    if parsed.fast_path_projection is None:
+        return None
+    if any(role not in ('input','output') for role, t in parsed.calls):
+        return None
+
+    patterns = dict() # Triples pointing to the (handler, variable) tuple from which their values are taken
+    orbs     = dict() # The ids of GRAPH scry:orb_description nodes pointing to the OrbHandlers which evaluated them
+    for h in query_handler.context_handlers:
+        if isinstance(h,OrbHandler):
+            orbs[id(h.algebra)] = h
+        if not isinstance(h,CallHandler):
+            continue
+        if type(h) is not CallHandler or h.description_triples: # VarSubCallHandlers bind a variable subject; descriptions are not bindings
+            return None
+        try:
+            known_in, var_in, default_in = h.get_input_specifiers(h.procedure)
+            out_spec, default_out        = h.get_output_specifiers(h.procedure)
+        except SCRYError:
+            return None # Raised again when the handler is executed
+
+        used = known_in.values() + var_in.values() + out_spec.values()
+        if len(used) != len(h.input_triples) + len(h.output_triples):
+            return None # Several triples map to the same specifier, only one of which is stored
+        variables = [t[2] for t in used if isinstance(t[2],Variable)]
+        if len(variables) != len(set(variables)):
+            return None # The same variable is stored under several predicates
+        for t in known_in.values():
+            patterns[t] = (h,None)
+        for t in var_in.values():
+            patterns[t] = (h,t[2])
+        for t in out_spec.values():
+            if not isinstance(t[2],Variable):
+                return None # Stored values are the procedure's outputs, not the constant
+            patterns[t] = (h,t[2])
+
+    for t in parsed.triples:
+        if t not in patterns:
+            return None
+    is_distinct = (parsed.query.algebra.p.name == 'Distinct')
+    return FastPath(parsed.fast_path_projection,patterns,is_distinct,orbs)
+
+
+class FastPath(object):
+    def __init__(self,projection,patterns,distinct=False,orbs=None):
+        self.projection = projection     # The Project node of the query's algebra
+        self.patterns   = patterns       # Triples pointing to the (handler, variable) tuple which produced their values
+        self.distinct   = distinct       # Whether duplicate solutions should be removed (i.e. for SELECT DISTINCT)
+        self.orbs       = orbs or dict() # The ids of GRAPH scry:orb_description nodes pointing to their OrbHandlers
+
+    def evaluate(self):
+        PV        = self.projection.PV
+        solutions = self.evaluate_pattern(self.projection.p).project(PV)
+        if self.distinct:
+            solutions = solutions.distinct()
+
+        result          = Result('SELECT')
+        result.vars     = PV
+        result.bindings = solutions.dicts() # A generator; the rows' dictionaries are only created as the result is serialized
+        return result
+
+    def evaluate_pattern(self,node):
+        if node.name == 'BGP':
+            solutions = BindingTable()
+            solutions.add_row(()) # The empty solution, which is compatible with any other
+            for t in node.triples:
+                solutions = join(solutions,self.triple_bindings(t))
+            return solutions
+        elif node.name == 'Join':
+            return join(self.evaluate_pattern(node.p1),self.evaluate_pattern(node.p2))
+        elif node.name == 'ToMultiSet':
+            return BindingTable.from_dicts(node.p.res)
+        elif node.name == 'Extend':
+            solutions = self.evaluate_pattern(node.p)
+            return solutions.with_column(node.var,[evaluate_expression(node.expr,s) for s in solutions.dicts()])
+        elif node.name == 'Graph':
+            return self.orbs[id(node)].bindings
+
+    def triple_bindings(self,triple):
+        handler, var = self.patterns[triple]
+        table = BindingTable()
+        if var is None: # A known input; stored alongside every solution of its handler
+            if handler.bindings:
+                table.add_row(())
+            return table
+        table.add_column(var)
+        if var in handler.bindings:
+            seen = set()
+            for val in handler.bindings.column(var):
+                if val is not None and val not in seen:
+                    seen.add(val)
+                    table.add_row((val,))
+        return table
+
+### END OF FastPath
+
+
+def evaluate_expression(expr,solution):
+    if isinstance(expr,Variable):
+        return solution.get(expr)
+    elif not hasattr(expr,'eval'):
+        return expr # A constant URI or Literal
+    try:
+        val = expr.eval(solution)
+    except SPARQLError:
+        return None
+    return (None if isinstance(val,SPARQLError) else val)
+
+
+# The execution plan of a query's context handlers: the topological order in which they are executed, along
+# with their dependencies and the variables on which their dependencies' bindings are joined. It is compiled
+# once per ParsedQuery, and reused for every request for the same query. Context handlers are created anew
+# for every request, but always in the same order, so the plan refers to them by their index in that order.
+class ExecutionPlan(object):
+    def __init__(self,handlers):
+        index      = dict((h,i) for i, h in enumerate(handlers))
+        order      = DAGScheduler(handlers).sort() # Raises a SCRYError if the dependencies are circular
+        self.kinds = [h.__class__.__name__ for h in handlers] # Used to verify a request's handlers match the plan
+        self.order = [index[h] for h in order]
+        self.steps = [describe_step(h,index) for h in order]
+
+    # Sets the dependencies of a request's context handlers according to the plan, and returns them in the planned order
+    # Returns None if the handlers do not match the plan, e.g. because the service configuration was reloaded
+    def apply(self,handlers):
+        if [h.__class__.__name__ for h in handlers] != self.kinds:
+            return None
+        for h, step in zip([handlers[i] for i in self.order],self.steps):
+            h.set_bound_vars()
+            h.dependencies = set(handlers[i] for i in step['dependencies'])
+        return [handlers[i] for i in self.order]
+
+### END OF ExecutionPlan
+
+
+# A JSON serializable description of a context handler, as shown by the 'explain' request parameter
+def describe_step(handler,index):
+    step = {'handler'      : index[handler],
+            'kind'         : handler.__class__.__name__,
+            'input_vars'   : sorted(v.encode() for v in handler.input_vars),
+            'output_vars'  : sorted(v.encode() for v in handler.output_vars),
+            'dependencies' : sorted(index[dep] for dep in handler.dependencies),
+            'joins'        : plan_joins([dep.bound_vars for dep in handler.dependencies])}
+    if type(handler) is CallHandler:
+        step['pau']       = handler.pau.encode()
+        step['procedure'] = handler.procedure.uri.encode()
+    elif isinstance(handler,VarSubCallHandler):
+        step['pau']       = '?' + handler.subject.encode() # Procedures are only known once the PAUs are bound
+    return step
+
+# Mirrors the order in which ContextHandler.merge_and_filter merges its dependencies' bindings: returns the
+# variables shared by each pair of merged binding lists, where an empty list of variables is a cross product
+def plan_joins(var_sets):
+    var_sets = [set(v) for v in var_sets]
+    joins    = list()
+    while len(var_sets) > 1:
+        N          = len(var_sets)
+        max_shared = (0,0,1)
+        for i in range(N):
+            for j in range(i+1,N):
+                shared = len(var_sets[i].intersection(var_sets[j]))
+                if shared > max_shared[0]:
+                    max_shared = (shared,i,j)
+        shared, i, j = max_shared
+        x = var_sets.pop(j)
+        y = var_sets.pop(i)
+        joins.append(sorted(v.encode() for v in x.intersection(y)))
+        var_sets.append(x.union(y))
+    return joins
@@ -0,0 +1,84 @@
+from __init__  import IP_WHITELIST, LOG_DIRECTORY, PROFILE_SAMPLE_INTERVAL
+from utility   import assert_dir
+
+from cProfile  import Profile
+from threading import Thread, Event, current_thread, enumerate as all_threads
+from sys       import _current_frames
+from os.path   import join, basename
+
+PROFILE_DIR = join(LOG_DIRECTORY,'profiles')
+
+
+# Queries may be resolved under a profiler by whitelisted clients, through a 'profile' request parameter or an
+# X-SCRY-Profile header. Two profiles are saved under PROFILE_DIR/<date>/<time>, with the same date and time as
+# the request's log records:
+#  .pstats    -- cProfile's deterministic profile of the thread resolving the query (load it with the pstats module)
+#  .collapsed -- sampled stacks of that thread and the threads executing its context handlers, one line per distinct
+#                stack with the number of samples taken of it, which flame graph tools (e.g. flamegraph.pl) read
+
+def is_profiling_requested(request):
+    flag = request.values.get('profile',request.headers.get('X-SCRY-Profile'))
+    if flag is None or flag.lower() in ('0','false','no'):
+        return False
+    return request.remote_addr in IP_WHITELIST
+
+
+def profile_resolve(query_handler):
+    query_handler.stream = False # Serialize the results within resolve(), so that is profiled as well
+    profiler = Profile()
+    sampler  = StackSampler(current_thread(),PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        return profiler.runcall(query_handler.resolve)
+    finally:
+        sampler.stop()
+        if query_handler.log_key:
+            save_profile(profiler,sampler,*query_handler.log_key)
+
+
+def save_profile(profiler,sampler,date,time):
+    dir_path = join(PROFILE_DIR,date)
+    assert_dir(dir_path)
+    profiler.dump_stats(join(dir_path,'%s.pstats' % time))
+    with open(join(dir_path,'%s.collapsed' % time),'w') as f:
+        for stack, count in sorted(sampler.stacks.iteritems()):
+            f.write('%s %d\n' % (stack,count))
+
+
+# Samples the stacks of a thread, and the DAGScheduler threads it started, every 'interval' seconds
+class StackSampler(Thread):
+    def __init__(self,thread,interval):
+        super(StackSampler,self).__init__(name='scry-profiler')
+        self.daemon   = True
+        self.thread   = thread                            # The thread resolving the query
+        self.prefix   = 'scry-handler-%d-' % thread.ident # The name prefix of the threads executing its context handlers
+        self.interval = interval                          # The number of seconds between samples
+        self.stacks   = dict()                            # Collapsed stacks pointing to the number of times they were sampled
+        self.halt     = Event()
+
+    def run(self):
+        while not self.halt.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.halt.set()
+        self.join()
+
+    def sample(self):
+        idents = set([self.thread.ident])
+        for t in all_threads():
+            if t.name.startswith(self.prefix):
+                idents.add(t.ident)
+        frames = _current_frames()
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is None: continue
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name,basename(code.co_filename),code.co_firstlineno))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack)) # Outermost frame first
+            self.stacks[key] = self.stacks.get(key,0) + 1
+
+### END OF StackSampler
@@ -1,17 +1,201 @@
 import rdflib.plugins.sparql as sparql
 
-from __init__        import SUPPORTED_REQUEST_METHODS, SUPPORTED_RESPONSE_TYPES
+from __init__        import SUPPORTED_REQUEST_METHODS, SUPPORTED_RESPONSE_TYPES, QUERY_CACHE_SIZE, SERVICE_WORKERS, STREAM_RESULTS, STREAM_CHUNK_ROWS, FAST_PATH
+from __init__        import RESPONSE_CACHE_BYTES, RESPONSE_CACHE_TTL, PIPELINE_BINDINGS, PIPELINE_BATCH_ROWS, PIPELINE_BUFFER_ROWS
 from context_handler import OrbHandler, CallHandler, VarSubCallHandler, ValuesHandler, BindHandler
+from scheduler       import DAGScheduler
+from planner         import find_fast_path_projection, plan_fast_path, ExecutionPlan
+from streaming       import STREAMING_SERIALIZERS
+from cache           import LRUCache
+from metrics         import STAGE_SECONDS, register_cache
+from workspace       import get_workspace_pool
 from utility         import SCRYError
 
 from rdflib          import Namespace
-from rdflib.graph    import ConjunctiveGraph
-from rdflib.term     import URIRef, Variable
+from rdflib.plugins.sparql.algebra import CompValue
+from rdflib.graph    import ConjunctiveGraph, Graph, ReadOnlyGraphAggregate
+from rdflib.term     import URIRef, Variable, BNode
 from flask           import Response
-from log             import log_request, log_response
+from log             import log_request, log_response, log_response_stream
 
-from tempfile        import mkdtemp
-from shutil          import rmtree
+from threading       import Lock, Condition
+from itertools       import chain
+from hashlib         import sha1
+from json            import dumps
+
+
+SCRY        = Namespace('http://www.scry.com/')
+QUERY_CACHE    = LRUCache(QUERY_CACHE_SIZE)                 # Normalized query strings pointing to ParsedQuery instances
+RESPONSE_CACHE = LRUCache(RESPONSE_CACHE_BYTES,              # (Normalized query string, response type) tuples pointing to CachedResponse instances
+                          weigh = lambda entry: len(entry.body),
+                          ttl   = RESPONSE_CACHE_TTL)
+
+register_cache('query',QUERY_CACHE)
+register_cache('response',RESPONSE_CACHE)
+
+NON_DETERMINISTIC_FUNCTIONS = ['Builtin_NOW','Builtin_RAND','Builtin_UUID','Builtin_STRUUID','Builtin_BNODE']
+
+
+# Collapses insignificant whitespace in a SPARQL query string, so that trivially reformatted copies
+# of a query share one QUERY_CACHE entry. Whitespace inside string literals and comments is kept as is,
+# and runs of whitespace containing a line break are collapsed to a line break (which ends comments).
+def normalize_query(query_string):
+    out   = list()
+    quote = None  # The delimiter of the string literal currently being scanned, if any
+    i     = 0
+    n     = len(query_string)
+    while i < n:
+        c = query_string[i]
+        if quote:
+            if c == '\\':
+                out.append(query_string[i:i+2])
+                i += 2
+                continue
+            if query_string.startswith(quote,i):
+                out.append(quote)
+                i    += len(quote)
+                quote = None
+                continue
+            out.append(c)
+        elif c in '"\'':
+            quote = (query_string[i:i+3] if query_string[i:i+3] in ('"""',"'''") else c)
+            out.append(quote)
+            i += len(quote)
+            continue
+        elif c == '#' and (i == 0 or query_string[i-1].isspace()):
+            end = query_string.find('\n',i)
+            if end == -1: end = n
+            out.append(query_string[i:end])
+            i = end
+            continue
+        elif c.isspace():
+            j = i
+            while j < n and query_string[j].isspace():
+                j += 1
+            out.append('\n' if '\n' in query_string[i:j] else ' ')
+            i = j
+            continue
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out).strip()
+
+
+# Splits a (predicate) URI into its base URI and the specifier following the first '?', if any
+def split_uri(uri):
+    parts = uri.encode().split('?')
+    spec  = (parts[1] if len(parts) > 1 else None)
+    return URIRef(parts[0]), spec
+
+
+# Returns False if any SPARQL function whose result differs between evaluations is used in the algebra
+def is_deterministic(algebra):
+    if isinstance(algebra,CompValue):
+        if algebra.name in NON_DETERMINISTIC_FUNCTIONS:
+            return False
+        return all(is_deterministic(v) for v in algebra.values())
+    elif isinstance(algebra,(list,tuple)):
+        return all(is_deterministic(v) for v in algebra)
+    return True
+
+
+# The query-specific (as opposed to request-specific) results of parsing a SPARQL query string
+# Instances are shared between requests through QUERY_CACHE, so they must not be modified after construction
+# (except for 'plan', which the first request to resolve the query sets once it has compiled its ExecutionPlan, holding QUERY_CACHE's lock)
+class ParsedQuery(object):
+
+
+    def __init__(self,query_string):
+        qry             = sparql.prepareQuery(query_string)
+        self.query      = qry                              # An object with .prologue and .algebra attributes, generated from the query string through RDFLib's SPARQL parser
+        self.query_type = qry.algebra.name[0:-5].upper()   # 'SELECT', 'CONSTRUCT', 'ASK' or 'DESCRIBE'
+        self.nodes      = list()                           # (name, algebra) tuples of the VALUES, BIND and GRAPH scry:orb_description nodes, in the order they were found
+        self.triples    = list()                           # A list of triples parsed from the query algebra
+        self.calls      = list()                           # (role, triple) tuples for every triple which uses a SCRY predicate, or has scry:orb as its subject
+        self.splits     = dict()                           # URIs used in 'calls' pointing to their (base URI, specifier) tuples, as produced by split_uri()
+        self.graph_vars = False                            # True if the query has GRAPH ?variable patterns, which match individual contexts of the graph
+        self.parse_algebra(qry.algebra)
+        self.classify_triples()
+        self.fast_path_projection = find_fast_path_projection(qry.algebra) # The Project node of the algebra if its shape allows the fast path, None otherwise
+        self.deterministic        = is_deterministic(qry.algebra)          # False if the query uses NOW(), RAND(), UUID(), STRUUID() or BNODE()
+        self.plan                 = None                                   # The planner.ExecutionPlan of the query's context handlers, once compiled
+
+
+    def parse_algebra(self,algebra):
+        if isinstance(algebra,sparql.algebra.CompValue):
+            n = algebra.name
+            if n in ('values','Extend'):
+                self.nodes.append((n,algebra))
+            elif n == 'Graph' and algebra.term == SCRY.orb_description:
+                self.nodes.append((n,algebra))
+                return
+            elif n == 'Graph' and isinstance(algebra.term,Variable):
+                self.graph_vars = True
+            for key in algebra:
+                if key == 'triples':
+                    for t in algebra[key]:
+                        self.triples.append(t)
+                self.parse_algebra(algebra[key])
+
+
+    def classify_triples(self):
+        roles = {SCRY.input       : 'input',
+                 SCRY.output      : 'output',
+                 SCRY.author      : 'description',
+                 SCRY.description : 'description',
+                 SCRY.provenance  : 'description',
+                 SCRY.version     : 'description'}
+        for t in self.triples:
+            if t[0] == SCRY.orb:
+                self.calls.append(('orb',t))
+                continue
+            pred = self.split(t[1])[0] # Strip any specifiers/parameters from the predicate
+            if pred in roles:
+                self.calls.append((roles[pred],t))
+                if isinstance(t[0],URIRef):
+                    self.split(t[0])
+
+
+    def split(self,uri):
+        if uri not in self.splits:
+            self.splits[uri] = split_uri(uri)
+        return self.splits[uri]
+
+### END OF ParsedQuery
+
+
+# A serialized response, as stored in RESPONSE_CACHE
+class CachedResponse(object):
+    def __init__(self,body,procedures,description):
+        self.body        = body                    # The serialized query results
+        self.etag        = sha1(body).hexdigest()  # The entity tag sent along with the response, so clients can make conditional requests
+        self.procedures  = procedures              # (URI, version) tuples of the procedures invoked to generate 'body'
+        self.description = description             # The orb's description when 'body' was generated, which is replaced whenever the services are (re)set
+
+
+# A read-only union of a request's graph and the orb's (shared) description, against which queries using the orb are
+# evaluated, so the description need not be copied into every such request's graph. The description is the named graph
+# scry:orb_description; the contexts of the request's graph are the other named graphs, matched by GRAPH ?variable.
+class OrbDescriptionUnion(ReadOnlyGraphAggregate):
+    def __init__(self,graph,description):
+        super(OrbDescriptionUnion,self).__init__([graph,description])
+        self.default_union = True # The default graph is the union of all graphs, as it is in 'graph'
+        self.request_graph = graph
+        self.description   = description
+
+    def contexts(self,triple=None):
+        for c in self.request_graph.contexts(triple):
+            if c.identifier != self.request_graph.default_context.identifier:
+                yield c
+        if triple is None or triple in self.description:
+            yield self.description
+
+    def get_context(self,identifier,quoted=False):
+        if identifier == self.description.identifier:
+            return self.description
+        return self.request_graph.get_context(identifier,quoted)
+
+### END OF OrbDescriptionUnion
 
 
 class QueryHandler(object):
@@ -22,13 +206,26 @@ class QueryHandler(object):
         self.global_dict      = global_dict                   # The global environment dictionary of the Flask application
         self.service_config   = global_dict['service_config'] # A service configuration dictionary, pointing from PAUs to procedures
         self.parsed           = dict()                        # A dictionary for the results of parsing the HTTP request
+        self.parsed_query     = None                          # A ParsedQuery instance, shared with other requests for the same (normalized) query string
         self.query            = None                          # An object with .prologue and .algebra attributes, generated from the query string through RDFLib's SPARQL parser
         self.query_type       = None                          # One of: 'SELECT', 'CONSTRUCT', 'ASK' or 'DESCRIBE'
         self.triples          = list()                        # A list of triples parsed from the query algebra
         self.response_type    = None                          # The selected MIME type of the response
+        self.log_key          = None                          # The (date, time) tuple under which the request and response are logged
+        self.stream           = STREAM_RESULTS                # Whether SELECT results may be streamed to the client; disabled when profiling
         self.graph            = ConjunctiveGraph()            # The graph object against which 'query' will be resolved
-        self.orb_description  = False                         # When an OrbHandler adds the scry:orb_description context, this attribute stores the pointer to it
+        self.graph_lock       = Lock()                        # Serializes additions to 'graph' by context handlers executing in parallel
+        self.solution_graph   = Graph(self.graph.store,BNode()) # The context shared by all solutions added to 'graph', unless the query has GRAPH ?variable patterns
+        self.fast_path        = None                          # A planner.FastPath instance, if 'query' can be answered from the context handlers' bindings without evaluating it against 'graph'
+        self.materialize      = True                          # Whether context handlers should add their solutions to 'graph'; False when 'fast_path' is used
+        self.pipelined        = PIPELINE_BINDINGS             # Whether context handlers consume their dependencies' bindings as they are produced
+        self.pipelined       &= SERVICE_WORKERS > 1           # (Which requires them to be executed in parallel)
+        self.pipeline_rows    = PIPELINE_BATCH_ROWS           # The number of upstream bindings a pipelined CallHandler processes at once
+        self.pipeline_cond    = Condition()                   # Notified whenever a pipelined context handler produces bindings, or finishes
+        self.orb_description  = None                          # The orb's (shared) description, once describe_orb() found 'query' must be evaluated against it
         self.context_handlers = list()                        # A list of context handlers, needed for the bookkeeping of call_services()
+        self.plan             = None                          # The planner.ExecutionPlan according to which 'context_handlers' are executed
+        self.plan_reused      = False                         # Whether 'plan' was compiled by an earlier request for the same query
         self.var_binders      = dict()                        # A dictionary of ?variables used in the query, pointing to the context_handlers that bind values to them        
         self.result           = None                          # An RDFLib Result object, generated through graph.query()
         self.output           = None                          # Formatted results, generated through result.serialize()
@@ -39,16 +236,35 @@ class QueryHandler(object):
 
     def resolve(self):
         try:
-            date, time = log_request(self.request)
-            self.parse_http()           # Retrieve required information from the HTTP request              -- sets the 'parsed' attribute
-            self.parse_query()          # Parse the triples and possibly a VALUES statement from the query -- sets the 'query', 'query_type', 'triples', 'values' and 'values_vars' attributes
+            date, time   = log_request(self.request)
+            self.log_key = (date, time)
+            with STAGE_SECONDS.time(('parse_http',)):
+                self.parse_http()       # Retrieve required information from the HTTP request              -- sets the 'parsed' attribute
+            if self.parsed['explain']:  # Always answered with JSON, whatever response types the request accepts
+                self.output = self.explain()
+                log_response(self.output, date, time)
+                return Response(self.output, mimetype='application/json')
             self.select_response_type() # Based on ^, determine how to serialize the results later on      -- executed here to assert a valid response type is supported
-            self.call_services()        # Populate the 'graph' attribute's RDF graph by invoking the procedures encoded in 'triples'
-            self.resolve_query()        # Evaluate 'query' against 'graph'                                 -- sets the 'result' attribute
-            self.format_result()        # Serialize the results in a way determined by 'response_type'     -- sets the 'output' attribute
+            cached = self.get_cached_response()
+            if cached:
+                log_response(cached.body, date, time)
+                return self.make_response(cached.body, cached.etag)
+            with STAGE_SECONDS.time(('parse_query',)):
+                self.parse_query()      # Parse the triples and possibly a VALUES statement from the query -- sets the 'query', 'query_type', 'triples', 'values' and 'values_vars' attributes
+            with STAGE_SECONDS.time(('call_services',)):
+                self.call_services()    # Populate the 'graph' attribute's RDF graph by invoking the procedures encoded in 'triples'
+            with STAGE_SECONDS.time(('resolve_query',)):
+                self.resolve_query()    # Evaluate 'query' against 'graph'                                 -- sets the 'result' attribute (lazily, if it is streamed)
+            if self.is_streamable():
+                chunks = self.cache_stream(self.stream_result())
+                self.cleanup()
+                return Response(log_response_stream(chunks, date, time), mimetype=self.response_type)
+            with STAGE_SECONDS.time(('format_result',)):
+                self.format_result()    # Serialize the results in a way determined by 'response_type'     -- sets the 'output' attribute
             self.cleanup()
             log_response(self.output, date, time)
-            return Response(self.output, mimetype=self.response_type)            
+            cached = self.cache_response(self.output)
+            return self.make_response(self.output, cached.etag if cached else None)
 
         except SCRYError as e:
             self.output = e.description
@@ -93,34 +309,38 @@ class QueryHandler(object):
         
         q_string, q_default, q_named = parse_http_query_parameters()
         parsed['query_string']       = q_string
+        parsed['query_key']          = normalize_query(q_string)
         parsed['default_graph']      = q_default
         parsed['named_graphs']       = q_named
+        parsed['explain']            = rq.values.get('explain','false').lower() not in ('0','false','no') # Set by '?explain' or '?explain=true'
 
         self.parsed = parsed
 
 
     def parse_query(self):
-        qry             = sparql.prepareQuery(self.parsed['query_string'])
-        self.query      = qry
-        self.query_type = qry.algebra.name[0:-5].upper() # 'SELECT', 'CONSTRUCT', 'ASK' or 'DESCRIBE'
-
-        def parse_algebra(algebra):
-            if isinstance(algebra,sparql.algebra.CompValue):
-                n = algebra.name
-                if n == 'values':
-                    self.context_handlers.append(ValuesHandler(self,algebra))
-                elif n == 'Extend':
-                    self.context_handlers.append(BindHandler(self,algebra))
-                elif n == 'Graph' and algebra.term == URIRef('http://www.scry.com/orb_description'):
-                    self.context_handlers.append(OrbHandler(self,algebra))
-                    return
-                for key in algebra:
-                    if key == 'triples':
-                        for t in algebra[key]:
-                            self.triples.append(t)
-                    parse_algebra(algebra[key])
-
-        parse_algebra(qry.algebra)
+        key    = self.parsed['query_key']
+        parsed = QUERY_CACHE.get(key)
+        if parsed is None:
+            parsed = ParsedQuery(self.parsed['query_string'])
+            QUERY_CACHE.put(key,parsed)
+
+        self.parsed_query = parsed
+        self.query        = parsed.query
+        self.query_type   = parsed.query_type
+        self.triples      = parsed.triples
+
+        handler_classes = {'values' : ValuesHandler,
+                           'Extend' : BindHandler,
+                           'Graph'  : OrbHandler}
+        for name, algebra in parsed.nodes:
+            self.context_handlers.append(handler_classes[name](self,algebra))
+
+
+    def split_uri(self,uri):
+        try:
+            return self.parsed_query.splits[uri]
+        except (AttributeError,KeyError):
+            return split_uri(uri)
 
     def select_response_type(self):
         ### NEEDS REFINEMENT AND MORE THOROUGH TESTING WITH DIFFERENT TYPES OF QUERIES
@@ -136,10 +356,10 @@ class QueryHandler(object):
                                        "Accepted    : %s\n" % ', '.join(accepted)))
 
 
-    def call_services(self):
+    def call_services(self,execute=True):
         # First,  determine which triples use SCRY predicates (input, output, OTHERS???) and assign them to the appropriate CallHandlers
-        # Second, determine I/O dependence between the CallHandlers
-        # Third,  call the services in the appropriate order, passing on outputs as inputs where required
+        # Second, determine I/O dependence between the CallHandlers, and compile (or reuse) the resulting execution plan
+        # Third,  call the services in the appropriate order, passing on outputs as inputs where required -- unless 'execute' is False
         #         [Refine this to also take specifications from VALUES and BIND statements into account!]
         #         [Fake it with CallHandler subclasses?]
         
@@ -150,7 +370,7 @@ class QueryHandler(object):
                 return call_dict[uri]
             
             if isinstance(uri,URIRef):
-                short_uri = URIRef(uri.encode().split('?')[0]) # Crop off parameters if any are specified
+                short_uri = self.split_uri(uri)[0] # Crop off parameters if any are specified
                 if short_uri in self.service_config:
                     proc = self.service_config[short_uri]
                     handler        = CallHandler(self,proc,uri)
@@ -167,17 +387,14 @@ class QueryHandler(object):
                 return var_call_dict[uri]
         
         def parse_triples():
-            scry = Namespace('http://www.scry.com/')
-            for t in self.triples:
-                if t[0] == scry.orb:
-                    self.describe_orb()
-                    continue
-                pred = URIRef(t[1].encode().split('?')[0]) # Strip any specifiers/parameters from the predicate
-                if pred == scry.input:
+            for role, t in self.parsed_query.calls: # Triples were classified by role when the query was parsed
+                if role == 'orb':
+                    continue # Matched against the orb's description, once it is added to 'graph' below
+                elif role == 'input':
                     get_call_handler(t[0]).add_input(t)
-                elif pred == scry.output:
+                elif role == 'output':
                     get_call_handler(t[0]).add_output(t)
-                elif pred in [scry.author, scry.description, scry.provenance, scry.version]:
+                elif role == 'description':
                     get_call_handler(t[0]).add_description(t)
         
         output_dict = dict() # A dictionary mapping bound variables to the execution handlers that bind them as outputs
@@ -197,36 +414,190 @@ class QueryHandler(object):
                         raise SCRYError("Unable to resolve depencies involving the Variable %s" % k)
 
         def execute_all():
-            for h in self.context_handlers:
-                while not h.executed:
-                    indep = h.get_independent_handler(list())
-                    indep.execute()
+            if self.pipelined:
+                for h in self.context_handlers:
+                    if not h.executed: # Handlers executed upon instantiation (e.g. for VALUES) already hold all their bindings
+                        h.stream_bindings(self.pipeline_cond,PIPELINE_BUFFER_ROWS)
+            order     = [self.context_handlers[i] for i in self.plan.order]
+            scheduler = DAGScheduler(self.context_handlers,SERVICE_WORKERS,self.pipelined,order)
+            scheduler.run()
+
+        # The plan is compiled by the first request for a query, which raises a SCRYError if the dependencies are circular
+        # Plans are only read and replaced while holding QUERY_CACHE's lock, as the ParsedQuery is shared by concurrent requests
+        def compile_plan():
+            with QUERY_CACHE.lock:
+                plan = self.parsed_query.plan
+            if plan and plan.apply(self.context_handlers) is not None:
+                self.plan        = plan
+                self.plan_reused = True
+            else:
+                set_dependencies()
+                self.plan = ExecutionPlan(self.context_handlers)
+                with QUERY_CACHE.lock:
+                    self.parsed_query.plan = self.plan
+
+        def plan_execution():
+            if FAST_PATH:
+                self.fast_path   = plan_fast_path(self)
+                self.materialize = self.fast_path is None
+            # Triples with scry:orb as their subject and GRAPH scry:orb_description patterns are matched against the orb's
+            # description when the query is evaluated against 'graph' (OrbHandlers have their bindings for the fast path)
+            uses_orb = any(role == 'orb' for role, t in self.parsed_query.calls) or any(isinstance(h,OrbHandler) for h in self.context_handlers)
+            if self.materialize and uses_orb:
+                self.describe_orb()
                         
         parse_triples()
-        set_dependencies()
-        execute_all()
+        compile_plan()
+        plan_execution()
+        if execute:
+            execute_all()
+
+
+    # Returns a JSON description of how the query would be resolved, without invoking any services
+    def explain(self):
+        self.parse_query()
+        self.call_services(execute=False)
+        plan = {'query_type'  : self.query_type,
+                'fast_path'   : self.fast_path is not None,
+                'pipelined'   : self.pipelined,
+                'workers'     : SERVICE_WORKERS,
+                'plan_reused' : self.plan_reused,
+                'steps'       : self.plan.steps}
+        return dumps(plan,indent=2,sort_keys=True)
 
     
     def resolve_query(self):
-        self.result = self.graph.query(self.query)
+        if self.fast_path:
+            self.result = self.fast_path.evaluate()
+        else:
+            self.result = self.get_query_graph().query(self.query)
     
     
-    def format_result(self):
+    def get_result_format(self):
         if self.response_type is not None:
-            format = SUPPORTED_RESPONSE_TYPES[self.response_type]
+            return SUPPORTED_RESPONSE_TYPES[self.response_type]
         else:
-            format = 'xml'  
-        self.output = self.result.serialize(format = format)
+            return 'xml'
+
+
+    def format_result(self):
+        self.output = self.result.serialize(format = self.get_result_format())
+
+
+    # Only the rows of SELECT results can be streamed; ASK, CONSTRUCT and DESCRIBE results are always formatted in full
+    def is_streamable(self):
+        return self.stream and self.query_type == 'SELECT' and self.get_result_format() in STREAMING_SERIALIZERS
+
+
+    # The query is lazily evaluated as the result is serialized, so the first chunk is serialized here, within resolve(),
+    # where errors evaluating the query are handled like those of format_result(). The other chunks are serialized as
+    # the response is sent, by which point errors can only cut it short.
+    # The time spent serializing all chunks, which includes evaluating the query, is observed as the format_result stage
+    # once the response was sent; the resolve_query stage of streamed results only covers preparing the evaluation.
+    def stream_result(self):
+        serializer = STREAMING_SERIALIZERS[self.get_result_format()]
+        chunks     = STAGE_SECONDS.time_iter(serializer(self.result,STREAM_CHUNK_ROWS),('format_result',))
+        first      = next(chunks)
+        return chain([first],chunks)
+
+
+    def make_response(self,body,etag=None):
+        response = Response(body, mimetype=self.response_type)
+        if etag:
+            response.set_etag(etag)
+            response.make_conditional(self.request) # Turns the response into a 304 if the request's If-None-Match header lists 'etag'
+        return response
+
+
+    # Returns the CachedResponse for this request's query and response type, if any exists, the services have not been
+    # (re)set since it was generated, and the procedures which generated it are still deterministic and at the same (cache) version
+    def get_cached_response(self):
+        key   = (self.parsed['query_key'],self.response_type)
+        entry = RESPONSE_CACHE.get(key)
+        if entry is None:
+            return None
+        if entry.description is not self.global_dict['orb_description']: # Also covers responses without any procedures, e.g. of the orb's description
+            RESPONSE_CACHE.discard(key)
+            return None
+        for uri, version in entry.procedures:
+            proc = self.service_config.get(uri)
+            if proc is None or not proc.deterministic or proc.get_cache_version() != version:
+                RESPONSE_CACHE.discard(key)
+                return None
+        return entry
+
+
+    # Responses may only be cached if the query and all procedures invoked to resolve it are deterministic
+    def get_cacheable_procedures(self):
+        if RESPONSE_CACHE.max_size <= 0 or not self.parsed_query.deterministic:
+            return None
+        procedures = set()
+        for h in self.context_handlers:
+            for proc in h.get_procedures():
+                if not proc.deterministic:
+                    return None
+                procedures.add((proc.uri,proc.get_cache_version()))
+        return procedures
+
+
+    def cache_response(self,body):
+        procedures = self.get_cacheable_procedures()
+        if procedures is None:
+            return None
+        entry = CachedResponse(body,procedures,self.global_dict['orb_description'])
+        RESPONSE_CACHE.put((self.parsed['query_key'],self.response_type),entry)
+        return entry
+
+
+    # Passes on the chunks of a streamed response, caching them once complete, unless they exceed the cache's size
+    def cache_stream(self,chunks):
+        if self.get_cacheable_procedures() is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        body = list()
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                size += len(chunk)
+                if size <= RESPONSE_CACHE.max_size:
+                    body.append(chunk)
+                else:
+                    body = None
+            yield chunk
+        if body is not None:
+            self.cache_response(''.join(body))
+
+
+    # Marks the orb's (shared) description as part of the graph 'query' is evaluated against; it is never copied into 'graph'
+    def describe_orb(self):
+        if self.orb_description is None:
+            self.orb_description = self.global_dict['orb_description']
+        return self.orb_description
+
+
+    # Returns the graph against which 'query' is evaluated: 'graph', or its read-only union with the orb's description
+    def get_query_graph(self):
+        if self.orb_description is None:
+            return self.graph
+        return OrbDescriptionUnion(self.graph,self.orb_description)
 
 
+    # Leases an empty scratch directory from the workspace pool; raises a SCRYError if the query exceeded its quota
     def get_temp_dir(self):
-        path = mkdtemp()
+        path = get_workspace_pool().acquire(self.temp_dirs)
         self.temp_dirs.append(path)
         return path
 
 
+    # Hands the query's scratch directories back to the pool, which empties them in the background
     def cleanup(self):
-        for path in self.temp_dirs:
-            rmtree(path)
+        if not self.temp_dirs:
+            return # Queries without any service using scratch space never start a pool
+        pool           = get_workspace_pool()
+        temp_dirs      = self.temp_dirs
+        self.temp_dirs = list()
+        for path in temp_dirs:
+            pool.release(path)
             
 ### END OF QueryHandler
\ No newline at end of file
@@ -0,0 +1,131 @@
+from utility   import SCRYError
+from metrics   import HANDLER_SECONDS
+
+from threading import Thread, current_thread
+from Queue     import Queue
+from sys       import exc_info
+
+
+# Executes a list of ContextHandlers in an order that respects their 'dependencies' attributes.
+# Every handler whose dependencies have all been executed is dispatched at once to a pool of worker
+# threads, so independent handlers (e.g. two unrelated service calls) run concurrently, and the
+# wall-clock time of call_services() approaches that of the critical path through the dependency graph.
+#
+# When pipelined, handlers are instead dispatched as soon as all their dependencies have been *started*,
+# and read their dependencies' bindings as BindingStreams while those are still being produced (see
+# ContextHandler.wait_for_dependencies). Handlers are queued in topological order, so every handler a
+# worker waits on has already been taken up by another worker, and none wait on each other indefinitely.
+class DAGScheduler(object):
+    def __init__(self,handlers,workers=1,pipelined=False,order=None):
+        self.handlers  = handlers  # The ContextHandler instances to execute; handlers which are already executed are skipped
+        self.workers   = workers   # The maximum number of handlers executed simultaneously -- 1 executes them one at a time
+        self.pipelined = pipelined # Whether handlers are dispatched once their dependencies are started, rather than executed
+        self.order     = order     # The handlers in a topological order determined before (i.e. by an ExecutionPlan), or None to sort them
+
+    # Sorts the handlers topologically (Kahn's algorithm), raising a SCRYError if the dependencies contain a cycle
+    def sort(self):
+        remaining  = dict()
+        dependents = dict()
+        for h in self.handlers:
+            remaining[h]  = len(h.dependencies)
+            dependents[h] = list()
+        for h in self.handlers:
+            for dep in h.dependencies:
+                dependents[dep].append(h)
+
+        order = [h for h in self.handlers if not remaining[h]]
+        for h in order: # 'order' grows while it is iterated over
+            for d in dependents[h]:
+                remaining[d] -= 1
+                if not remaining[d]:
+                    order.append(d)
+
+        if len(order) != len(self.handlers):
+            cyclic = [h for h in self.handlers if remaining[h]]
+            names  = ["%s binding %s" % (h.__class__.__name__, ', '.join(sorted(v.encode() for v in h.bound_vars)) or 'nothing') for h in cyclic]
+            raise SCRYError("Circular Input/Output dependencies could not be resolved!\n" +
+                            "The following context handlers depend on each other:\n%s" % '\n'.join(names))
+        return order
+
+    def run(self):
+        order   = self.order or self.sort()
+        pending = [h for h in order if not h.executed]
+        if self.workers <= 1 or len(pending) <= 1:
+            for h in pending:
+                try:
+                    execute(h)
+                finally:
+                    h.close_bindings()
+            return
+
+        waiting_on = dict() # Pending handlers pointing to the set of their dependencies which have yet to be executed (or started, when pipelined)
+        dependents = dict() # Pending handlers pointing to the pending handlers which depend on them
+        for h in pending:
+            waiting_on[h] = set(dep for dep in h.dependencies if not dep.executed)
+            dependents[h] = list()
+        for h in pending:
+            for dep in waiting_on[h]:
+                dependents[dep].append(h)
+
+        tasks = Queue()
+        done  = Queue()
+        def work():
+            while True:
+                h = tasks.get()
+                if h is None: return
+                try:
+                    execute(h)
+                    done.put((h,None))
+                except Exception:
+                    done.put((h,exc_info()))
+                finally:
+                    h.close_bindings() # Lets pipelined dependents stop waiting for more bindings, even after a failure
+
+        prefix  = 'scry-handler-%d-' % current_thread().ident # Lets the profiler find the threads working for this request
+        threads = [Thread(target=work,name=prefix+str(i)) for i in range(min(self.workers,len(pending)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        def release(h): # Returns the dependents of 'h' which no longer wait on any other handler
+            released = list()
+            for d in dependents[h]:
+                waiting_on[d].discard(h)
+                if not waiting_on[d]:
+                    released.append(d)
+            return released
+
+        error   = None
+        running = 0
+        ready   = [h for h in pending if not waiting_on[h]]
+        try:
+            while ready or running:
+                if error is None: # Stop dispatching new handlers once one has failed
+                    for h in ready: # 'ready' grows while it is iterated over, when pipelined
+                        tasks.put(h)
+                        running += 1
+                        if self.pipelined:
+                            ready.extend(release(h))
+                ready = list()
+                if not running: break
+
+                h, exc   = done.get()
+                running -= 1
+                if exc:
+                    error = error or exc
+                    continue
+                if not self.pipelined:
+                    ready.extend(release(h))
+        finally:
+            for t in threads: tasks.put(None)
+            for t in threads: t.join()
+
+        if error:
+            raise error[0], error[1], error[2]
+
+### END OF DAGScheduler
+
+
+def execute(handler):
+    with HANDLER_SECONDS.time((handler.__class__.__name__,)):
+        handler.execute()
@@ -0,0 +1,110 @@
+import log
+
+from workspace             import remove_workspaces
+
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from threading             import Thread
+from Queue                 import Queue
+from signal                import signal, SIGTERM, SIGINT, SIG_DFL
+from os                    import fork, kill, wait, _exit, getpid
+from sys                   import stderr
+from errno                 import EINTR, ECHILD
+
+
+# The production server: the listening socket is opened, and the services loaded (by the caller), before 'workers'
+# processes are forked off, so every worker shares them copy-on-write rather than loading its own copy. Each worker
+# accepts connections on the shared socket and handles them with a pool of 'threads' threads, so a long-running query
+# only occupies one thread of one worker. The master process only restarts workers which exit unexpectedly, and stops
+# them all when it receives SIGTERM or SIGINT.
+#
+# Note that every worker has its own caches, metrics (so /scry/metrics reports those of the worker serving it) and
+# request log file (see log.restart_writer()).
+
+def serve(app,host,port,workers,threads):
+    server = PoolWSGIServer((host,port),QuietRequestHandler,threads)
+    server.set_app(app)
+    stderr.write("SCRY orb serving on http://%s:%i/ with %i workers of %i threads\n" % (host,port,workers,threads))
+
+    children = dict() # The pids of the workers pointing to their indices
+    stopping = list() # Non-empty once the master received SIGTERM or SIGINT
+
+    def spawn(index):
+        pid = fork()
+        if pid == 0:
+            signal(SIGTERM,SIG_DFL)
+            signal(SIGINT ,SIG_DFL)
+            try:
+                log.restart_writer(index)
+                server.start_threads()
+                server.serve_forever()
+            finally:
+                _exit(1)
+        children[pid] = index
+
+    def stop(signum,frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                kill(pid,SIGTERM)
+            except OSError:
+                pass
+
+    signal(SIGTERM,stop)
+    signal(SIGINT ,stop)
+    for i in range(workers):
+        spawn(i)
+
+    while children:
+        try:
+            pid, status = wait()
+        except OSError as e:
+            if e.errno == EINTR: continue
+            if e.errno == ECHILD: break
+            raise
+        index = children.pop(pid,None)
+        remove_workspaces(pid) # Workers exit without removing their own
+        if index is not None and not stopping:
+            stderr.write("SCRY worker %i (pid %i) exited with status %i; restarting it\n" % (index,pid,status))
+            spawn(index)
+    server.server_close()
+
+
+# A WSGI server whose requests are handled by a fixed pool of threads, rather than a new thread per request
+class PoolWSGIServer(WSGIServer):
+    allow_reuse_address = True
+    request_queue_size  = 128
+
+    def __init__(self,address,handler_class,threads):
+        WSGIServer.__init__(self,address,handler_class)
+        self.threads  = threads
+        self.requests = Queue(threads * 4) # Accepted connections waiting for a thread; accepting blocks while it is full
+
+    # Called in every worker after forking, as threads do not survive fork()
+    def start_threads(self):
+        for i in range(self.threads):
+            t = Thread(target=self.process_requests,name='scry-server-%i-%i' % (getpid(),i))
+            t.daemon = True
+            t.start()
+
+    def process_requests(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request,client_address)
+            except Exception:
+                self.handle_error(request,client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self,request,client_address):
+        self.requests.put((request,client_address))
+
+### END OF PoolWSGIServer
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Requests are already logged by log.py
+    def log_message(self,format,*args):
+        pass
+
+### END OF QuietRequestHandler
@@ -1,18 +1,27 @@
 # The SCRY BLAST scripts are intended for use with NCBI BLAST software version 2.2.29+
 # Currently supported programs are blastn, blastp, blastx, tblastn and tblastx.
 
+# The paths and URLs below may be overridden through the SCRY_<NAME> environment variables, e.g. SCRY_BLAST_BIN_ROOT,
+# which is how benchmarks/blast.py points these procedures at local stand-ins for BLAST and the sequence databases.
+
 from rdflib  import Namespace
-from os      import listdir
+from os      import listdir, environ
 from os.path import basename
 
 __version__     = '0.2'
 
 BLAST           = Namespace('http://www.scry.com/blast/')
-BLAST_BIN_ROOT  = '/usr/local/ncbi-blast-2.2.29+/bin/'  # Path to local BLAST 2.2.29+ binaries, i.e. where blastp, blastn, etc. are found
-BLAST_DB_ROOT   = '/usr/local/ncbi-blast-2.2.29+/db/'   # Path to local BLAST 2.2.29+ compatible databases
+BLAST_BIN_ROOT  = environ.get('SCRY_BLAST_BIN_ROOT', '/usr/local/ncbi-blast-2.2.29+/bin/')  # Path to local BLAST 2.2.29+ binaries, i.e. where blastp, blastn, etc. are found
+BLAST_DB_ROOT   = environ.get('SCRY_BLAST_DB_ROOT' , '/usr/local/ncbi-blast-2.2.29+/db/')   # Path to local BLAST 2.2.29+ compatible databases
+
+MAX_BATCH_QUERIES = 500 # Maximum number of query sequences combined into a single BLAST run
 
 CACHE_SEQUENCES = True  # Set to True if you want files of input sequences to be stored locally
-CACHE_DIRECTORY = '/home/bas/Documents/SCRY/scry/services/BLAST/sequence_cache/'
+CACHE_DIRECTORY = environ.get('SCRY_CACHE_DIRECTORY', '/home/bas/Documents/SCRY/scry/services/BLAST/sequence_cache/')
+
+# URLs from which FetchSequence retrieves FASTA files, formatted with the identifier (and for Ensembl, the sequence type)
+UNIPROT_URL     = environ.get('SCRY_UNIPROT_URL', 'http://www.uniprot.org/uniprot/%s.fasta')
+ENSEMBL_URL     = environ.get('SCRY_ENSEMBL_URL', 'http://rest.ensembl.org/sequence/id/%s.fasta?type=%s')
 
 DEFAULT_DB      = 'HPA'
 DATABASES       = list()
@@ -1,13 +1,15 @@
 import re
 
-from __init__         import __version__, BLAST, CACHE_SEQUENCES, CACHE_DIRECTORY
+from __init__         import __version__, BLAST, CACHE_SEQUENCES, CACHE_DIRECTORY, UNIPROT_URL, ENSEMBL_URL
 from services.classes import Procedure, Argument
 from utility          import assert_dir, SCRYError
 
 from rdflib.term      import URIRef, Literal
 
 from urllib2          import urlopen
+from os               import fdopen, rename
 from os.path          import join, isfile
+from tempfile         import mkstemp
 
 __all__ = ['FetchSequence']
 
@@ -40,8 +42,11 @@ def fetch_sequence(inputs,outputs,handler):
         assert_dir(file_dir)
         fetch_fnc = KNOWN_SOURCES[source]
         fetch     = fetch_fnc(identifier,seq_type,inputs)
-        with open(file_path,'w') as f:
+        # Written to a temporary file which is then renamed, as concurrent invocations may fetch the same sequence
+        fd, temp_path = mkstemp(dir=file_dir)
+        with fdopen(fd,'w') as f:
             f.write(fetch)
+        rename(temp_path,file_path)
 
     out = dict()
     out['file'] = URIRef(file_path)
@@ -56,7 +61,7 @@ def fetch_sequence(inputs,outputs,handler):
 def fetch_uniprot(identifier,seq_type,inputs):
     # format:   fasta
     # seq_type: protein
-    url   = 'http://www.uniprot.org/uniprot/%s.fasta' % identifier
+    url   = UNIPROT_URL % identifier
     fetch = urlopen(url).read()
     return fetch
 
@@ -66,7 +71,7 @@ def fetch_uniprot(identifier,seq_type,inputs):
 def fetch_ensembl(identifier,seq_type,inputs):
     # format:   fasta
     # seq_type: genomic,cds,cdna,protein
-    url   = 'http://rest.ensembl.org/sequence/id/%s.fasta?type=%s' % (identifier, seq_type)
+    url   = ENSEMBL_URL % (identifier, seq_type)
     fetch = urlopen(url).read()
     return fetch
 
@@ -99,6 +104,7 @@ p.author      = "Bas Stringer"
 p.description = "A function which can fetch biological sequences from a variety of sources\nCurrently supported; %s" % ', '.join(KNOWN_SOURCES.keys())
 p.provenance  = "Sequence fetched by SCRY BLAST version %s" % __version__
 p.version     = __version__
+p.io_bound    = True # Fetches for the identifiers of a batch are made concurrently
 FetchSequence = p
 
                                     
@@ -1,116 +1,199 @@
-from __init__              import __version__, BLAST, BLAST_BIN_ROOT, BLAST_DB_ROOT, DEFAULT_DB
+from __init__              import __version__, BLAST, BLAST_BIN_ROOT, BLAST_DB_ROOT, DEFAULT_DB, MAX_BATCH_QUERIES
 from services.classes      import Procedure, Argument
 from options               import ALLOWED_OPTIONS, ALLOWED_FLAGS, SPECIAL_OPTIONS
 from utility               import SCRYError
 
 from rdflib.term           import Literal
 
-from os                    import system
-from os.path               import join
+from os                    import system, listdir
+from os.path               import join, isfile, getmtime
+from hashlib               import sha1
 from subprocess            import check_call
 from xml.etree.ElementTree import parse
 
 __all__ = ['RunBLAST']
 
+# The input dictionaries of a batch which share a program, database and options are BLASTed together: their sequences
+# are written to a single multi-FASTA file, so BLAST is started (and loads the database) once per group rather than once
+# per input. BLAST reports every query sequence in an <Iteration> of its own, in the order of the input file, from which
+# the hits of every input dictionary are taken. (If an input file holds several sequences, only the hits of its last
+# sequence are reported, as they were when inputs were BLASTed one at a time.)
+
 def run_blast(inputs,outputs,handler):
-    
-    def make_files():
-        temp_dir = handler.get_temp_dir()
-        out_file = join(temp_dir,'output.xml')
-        if not ('seq' in inputs) ^ ('file' in inputs):
-            raise SCRYError("SCRY BLAST requires exactly one of 'seq' or 'file' to be specified.")
-        elif 'seq' in inputs:
-            seq = inputs['seq'].encode()
-            if not seq.startswith('>'):
-                seq = '>query_sequence\n%s' % seq
-            in_file = join(temp_dir,'input.fasta')
-            with open(in_file,'w') as f: f.write(seq)
+    return run_blast_batch([inputs],outputs,handler)[0]
+
+def run_blast_batch(input_dicts,outputs,handler):
+    groups = dict() # (program, db, options) tuples pointing to the positions of the input dictionaries using them
+    fastas = list() # The FASTA formatted query sequence(s) of every input dictionary
+    for i, inputs in enumerate(input_dicts):
+        fasta = read_query(inputs)
+        fastas.append(fasta)
+        groups.setdefault(get_group(inputs,fasta),list()).append(i)
+
+    results = [None] * len(input_dicts)
+    for (program, db, options), positions in groups.items():
+        for start in xrange(0,len(positions),MAX_BATCH_QUERIES):
+            chunk = positions[start:start+MAX_BATCH_QUERIES]
+            hits  = blast_queries(program,db,options,[fastas[i] for i in chunk],handler)
+            for i, h in zip(chunk,hits):
+                results[i] = format_hits(h,outputs)
+    return results
+
+# Returns the query sequence(s) of an input dictionary in the FASTA format
+def read_query(inputs):
+    if not ('seq' in inputs) ^ ('file' in inputs):
+        raise SCRYError("SCRY BLAST requires exactly one of 'seq' or 'file' to be specified.")
+    elif 'seq' in inputs:
+        seq = inputs['seq'].encode().strip()
+    else:
+        with open(inputs['file'].encode()) as f:
+            seq = f.read().strip()
+    if not seq.startswith('>'): # A definition line keeps the sequence apart from the others in the multi-FASTA file
+        seq = '>query_sequence\n%s' % seq
+    return seq + '\n'
+
+# Returns the (program, db, options) tuple of the BLAST run for an input dictionary; options are (option, value) tuples
+def get_group(inputs,fasta):
+    try:
+        program = inputs['program'].encode()
+    except KeyError:
+        if 'seq_type' in inputs:
+            seq_type = inputs['seq_type'].encode().lower()
         else:
-            in_file = inputs['file'].encode()
-        return in_file, out_file
-        
-    def get_program():
-        try:
-            return inputs['program'].encode()
-        except KeyError:
-            if 'seq_type' in inputs:
-                seq_type = inputs['seq_type'].encode().lower()
-            else:
-                seq_type = guess_type()
-            if seq_type == 'protein':
-                return 'blastp'
-            else:
-                return 'blastn'
-    
-    def guess_type():
-        with open(in_file) as f:
-            f.readline() # Skip the first line
-            alphabet  = set(f.read().lower())
-            prot_only = set('efijlopqz') # Characters only used for amino acid codes in the FASTA format
-            if len(alphabet) > 12 or alphabet.intersection(prot_only):
-                # If more than 12 different characters are used, or if any characters unique to proteins are used...
-                return 'protein'
-            else:
-                return 'nucleotide'
-
-    def get_cmd():
-        cmd = '%s -query %s -out %s -db %s -outfmt 5' % (program_file, in_file, out_file, db_file)
-        for k in inputs:
-            if k in ALLOWED_OPTIONS and ALLOWED_OPTIONS[k]:
-                cmd += ' -%s %s' % (k, inputs[k])
-            elif k in ALLOWED_FLAGS and ALLOWED_FLAGS[k]:
-                cmd += ' -%s' % k
-        return cmd
-
-    def parse_XML():
-        hsp_dicts = list()
-        with open(out_file) as f:
-            doc = parse(f)
-        root = doc.getroot()
-        hits = root[-1][-1][-2].getchildren() # Output_iterations / Last iteration / Iteration hits
-        for hit in hits:
-            hit_dict = {elem.tag:elem.text for elem in hit.getchildren()}
-            hsps = hit[-1].getchildren()
-            for hsp in hsps:
-                hsp_dict = {elem.tag:elem.text for elem in hsp.getchildren()}
-                hsp_dict.update(hit_dict)
-                for attr in ['identity','positive','gaps']:
-                    frac = float(hsp_dict['Hsp_%s' % attr]) / float(hsp_dict['Hsp_align-len'])
-                    hsp_dict['frac_%s' % attr] = frac
-                    hsp_dict['perc_%s' % attr] = frac * 100
-                hsp_dicts.append(hsp_dict)
-        return hsp_dicts
+            seq_type = guess_type(fasta)
+        if seq_type == 'protein':
+            program = 'blastp'
+        else:
+            program = 'blastn'
+    db      = (inputs['db'].encode() if 'db' in inputs else DEFAULT_DB)
+    options = list()
+    for k in sorted(inputs):
+        if k in ALLOWED_OPTIONS and ALLOWED_OPTIONS[k]:
+            options.append((k,inputs[k].encode()))
+        elif k in ALLOWED_FLAGS and ALLOWED_FLAGS[k]:
+            options.append((k,None))
+    return program, db, tuple(options)
 
+def guess_type(fasta):
+    alphabet  = set(fasta.split('\n',1)[-1].lower()) - set('\n') # Skip the first line
+    prot_only = set('efijlopqz') # Characters only used for amino acid codes in the FASTA format
+    if len(alphabet) > 12 or alphabet.intersection(prot_only):
+        # If more than 12 different characters are used, or if any characters unique to proteins are used...
+        return 'protein'
+    else:
+        return 'nucleotide'
 
-    in_file, out_file = make_files()
-    program           = get_program()
-    program_file      = join(BLAST_BIN_ROOT,program)
-    db                = (inputs['db'].encode() if 'db' in inputs else DEFAULT_DB)
-    db_file           = join(BLAST_DB_ROOT,db)
-    cmd               = get_cmd()
+# BLASTs the FASTA formatted queries in a single run, and returns a list of hits (HSP dictionaries) for every query
+def blast_queries(program,db,options,fastas,handler):
+    temp_dir = handler.get_temp_dir()
+    in_file  = join(temp_dir,'input.fasta')
+    out_file = join(temp_dir,'output.xml')
+    with open(in_file,'w') as f:
+        f.write(''.join(fastas))
 
+    cmd = '%s -query %s -out %s -db %s -outfmt 5' % (join(BLAST_BIN_ROOT,program), in_file, out_file, join(BLAST_DB_ROOT,db))
+    for k, v in options:
+        cmd += (' -%s' % k if v is None else ' -%s %s' % (k, v))
     system(cmd)
-    hits     = parse_XML()
+    if not isfile(out_file):
+        raise SCRYError("BLAST did not produce any output for the command:\n%s" % cmd)
+    iterations = parse_XML(out_file)
+
+    hits = list()
+    last = 0 # The number of the last iteration belonging to the previous query
+    for fasta in fastas:
+        last += max(1,fasta.count('\n>') + 1)
+        hits.append(iterations.get(last,list()))
+    return hits
+
+# Returns the iteration numbers of BLAST's XML output pointing to the HSP dictionaries of their hits
+def parse_XML(out_file):
+    with open(out_file) as f:
+        root = parse(f).getroot()
+    iterations = dict()
+    for i, iteration in enumerate(root.find('BlastOutput_iterations')):
+        num = int(iteration.findtext('Iteration_iter-num') or i+1)
+        iterations[num] = parse_hits(iteration.find('Iteration_hits'))
+    return iterations
+
+def parse_hits(hits):
+    hsp_dicts = list()
+    if hits is None:
+        return hsp_dicts
+    for hit in hits.findall('Hit'):
+        hit_dict = {elem.tag:elem.text for elem in hit if elem.tag != 'Hit_hsps'}
+        for hsp in hit.find('Hit_hsps'):
+            hsp_dict = {elem.tag:elem.text for elem in hsp}
+            hsp_dict.update(hit_dict)
+            for attr in ['identity','positive','gaps']:
+                frac = float(hsp_dict['Hsp_%s' % attr]) / float(hsp_dict['Hsp_align-len'])
+                hsp_dict['frac_%s' % attr] = frac
+                hsp_dict['perc_%s' % attr] = frac * 100
+            hsp_dicts.append(hsp_dict)
+    return hsp_dicts
+
+# Returns the solution dictionaries of a query's hits
+def format_hits(hits,outputs):
+    outputs  = list(outputs)
     num_hits = {}
     if 'num_hits' in outputs:
         num_hits = {'num_hits':Literal(len(hits))}
         outputs.remove('num_hits')
-    
+
     out = list()
     for d in hits:
         od = {k : Literal(d[out_dict[k][0]]) for k in outputs}
         od.update(num_hits)
         out.append(od)
-    
     return out
 
+
+# Returns a hash of the names and modification times of the files in BLAST_BIN_ROOT and BLAST_DB_ROOT
+# A missing or unreadable directory is hashed as such, rather than raising; BLAST itself reports the problem when it runs
+def get_installation_fingerprint():
+    h = sha1()
+    for root in (BLAST_BIN_ROOT,BLAST_DB_ROOT):
+        try:
+            names = sorted(listdir(root))
+        except OSError:
+            h.update('%s unreadable\n' % root)
+            continue
+        for name in names:
+            try:
+                h.update('%s %r\n' % (join(root,name),getmtime(join(root,name))))
+            except OSError:
+                pass # Removed while listing
+    return h.hexdigest()[:16]
+
+
+class BLASTProcedure(Procedure):
+
+    def execute_batch(self,input_dicts,expected_outputs,handler):
+        return run_blast_batch(input_dicts,expected_outputs,handler)
+
+    # Cached outputs expire whenever the BLAST binaries or databases are updated, without the version having to be bumped
+    def get_cache_version(self):
+        return '%s+%s' % (self.version,get_installation_fingerprint())
+
+    # Invocations with a 'file' input are memoized on the file's contents, as its path may be reused for another sequence
+    def get_memo_inputs(self,input_dict):
+        if 'file' in input_dict:
+            input_dict = dict(input_dict)
+            with open(input_dict['file'].encode(),'rb') as f:
+                input_dict['file'] = ('sha1',sha1(f.read()).hexdigest())
+        return super(BLASTProcedure,self).get_memo_inputs(input_dict)
+
+### END OF BLASTProcedure
+
 # PROCEDURE
-p = Procedure(BLAST.blast)
+p = BLASTProcedure(BLAST.blast)
 p.function    = run_blast
 p.author      = "Bas Stringer"
 p.description = "The SCRY BLAST procedure; a bridge between NCBI's BLAST program suite and SPARQL"
 p.provenance  = "Results generated by SCRY BLAST version %s" % __version__
 p.version     = __version__
+p.deterministic = True # For the same BLAST binaries and databases -- see BLASTProcedure.get_cache_version()
+p.memoize       = True
 RunBLAST      = p
 
 # ARGUMENTS
@@ -2,8 +2,10 @@ import numpy as np
 
 from __init__          import __version__
 from services.classes  import Procedure, Argument
+from utility           import SCRYError
 from rdflib            import Namespace
-from rdflib.term       import Literal, URIRef
+from rdflib.term       import Literal, URIRef, bind
+from base64            import b64encode, b64decode
 
 __all__ = list()
 
@@ -40,15 +42,22 @@ __all__ = list()
 #  Covariance
 #  PearsonR
 
+## BINARY ARRAYS
+#  Every input argument also accepts a math:binary-array literal, whose lexical form is "<dtype>;<shape>;<data>", e.g. "<f8;2,3;AAAA..."
+#  <dtype> is a NumPy type string, <shape> a comma-separated list of dimensions, and <data> the base64 encoded, little-endian values
+#  Procedures given binary input produce binary output; request the 'binary_out' output argument to get it for text input as well
+
 MATH = Namespace('http://www.scry.com/math/')
+BINARY_ARRAY = MATH['binary-array']
 
 # SOME ARGUMENTS
-arg_dict = {'val_in'      : ('http://www.scry.com/math/single-value' , "A single floating point value (Can also be a comma-separated values array!)"),
+arg_dict = {'val_in'      : ('http://www.scry.com/math/single-value' , "A single floating point value (Can also be a comma-separated values array, or a binary-array!)"),
             'val_out'     : ('http://www.scry.com/math/single-value' , "A single floating point value (Can also be a comma-separated values array!)"),
-            'array_in'    : ('http://www.scry.com/math/csv-array'    , "An array of comma-separated values"),
+            'array_in'    : ('http://www.scry.com/math/csv-array'    , "An array of comma-separated values (Can also be a binary-array!)"),
             'array_out'   : ('http://www.scry.com/math/csv-array'    , "An array of comma-separated values"),
-            'multi_in'    : ('http://www.scry.com/math/2D-array'     , "A rectangular, 2-D array\nRows are separated by semicolons (;)\nValues within rows are separated by commas (,)"),
+            'multi_in'    : ('http://www.scry.com/math/2D-array'     , "A rectangular, 2-D array\nRows are separated by semicolons (;)\nValues within rows are separated by commas (,)\n(Can also be a binary-array!)"),
             'multi_out'   : ('http://www.scry.com/math/2D-array'     , "A rectangular, 2-D array\nRows are separated by semicolons (;)\nValues within rows are separated by commas (,)"),
+            'binary_out'  : ('http://www.scry.com/math/binary-array' , "The output as a binary-array: '<dtype>;<shape>;<base64 encoded little-endian values>'"),
             'param'       : ('http://www.scry.com/math/parameter'    , "A parameter value used by certain multi-input functions")}
 
 for key in arg_dict:
@@ -61,55 +70,180 @@ for key in arg_dict:
     arg_dict[key] = arg
 
             
+# PARSING AND FORMATTING
+# Arrays are parsed and formatted as a whole by NumPy, rather than value by value
+
+def parse_array(text,two_d=False):
+    if not text.strip():
+        return np.empty(0)
+    arr = np.fromstring(text.replace(';',','),sep=',')
+    if arr.size != text.count(',') + text.count(';') + 1:
+        raise SCRYError("Could not parse '%s' as an array of comma-separated values." % (text if len(text) < 100 else text[:100] + '...'))
+    if two_d:
+        rows = text.count(';') + 1
+        if arr.size % rows:
+            raise SCRYError("A 2-D array must be rectangular; every row must contain the same number of values.")
+        arr = arr.reshape(rows,-1)
+    return arr
+
+def format_array(arr):
+    arr = np.atleast_1d(arr)
+    if arr.ndim == 1:
+        return ','.join(map(repr,arr.tolist()))
+    else:
+        return ';'.join([','.join(map(repr,row)) for row in arr.tolist()])
+
+# Binary arrays are decoded without copying their values, straight from the base64 decoded bytes
+# Through bind(), Literals of the binary-array datatype carry the decoded array as their value, and
+# Literal(BinaryArray(arr)) encodes any NumPy array; chained MATH procedures thus pass arrays along without re-parsing them
+class BinaryArray(object):
+    __slots__ = ['array']
+
+    def __init__(self,array):
+        self.array = array
+
+    def __nonzero__(self): # RDFLib evaluates Literals by their value, which is ambiguous for NumPy arrays
+        return self.array.size > 0
+
+### END OF BinaryArray
+
+def encode_binary_array(value):
+    arr = np.ascontiguousarray(value.array).reshape(value.array.shape) # ascontiguousarray() returns 0-d arrays as 1-d ones
+    arr = arr.astype(arr.dtype.newbyteorder('<'),copy=False)
+    return '%s;%s;%s' % (arr.dtype.str, ','.join(map(str,arr.shape)), b64encode(arr.tobytes()))
+
+# Only boolean, integer and floating point arrays are accepted; a SCRYError is raised for any other dtype
+def decode_binary_array(text):
+    dtype, shape, data = text.split(';')
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'biuf':
+        raise SCRYError("Binary arrays must have a numeric dtype; '%s' is not supported." % (dtype.str,))
+    shape = tuple(int(d) for d in shape.split(',') if d)
+    return BinaryArray(np.frombuffer(b64decode(data),dtype=dtype).reshape(shape))
+
+bind(BINARY_ARRAY,BinaryArray,constructor=decode_binary_array,lexicalizer=encode_binary_array)
+
+def binary_literal(arr):
+    return Literal(BinaryArray(np.asarray(arr)))
+
+def is_binary(literal):
+    return literal.datatype == BINARY_ARRAY
+
+# Returns the array held by a text or binary literal
+def get_array(literal,two_d=False):
+    if not is_binary(literal):
+        return parse_array(literal.encode(),two_d)
+    value = literal.value # Decoded by RDFLib when the Literal was created; None if that failed, or if
+    if value is None:     # it was created before this module was (lazily) imported and bound the datatype
+        try:
+            value = decode_binary_array(literal.encode())
+        except (ValueError,TypeError):
+            raise SCRYError("Could not decode '%s' as a binary array." % (literal if len(literal) < 100 else literal[:100] + '...'))
+    return value.array
+
+# Rounds half away from zero, like Python's built-in round(), rather than to even like np.round()
+def round_half_away(arr,decimals=0):
+    scale = np.power(10.0,np.trunc(decimals))
+    return np.copysign(np.floor(np.abs(arr) * scale + 0.5) / scale, arr)
+
+
 # SINGLE VALUE FUNCTIONS
 class ValueProc(Procedure):
-    def __init__(self,uri,operation):
+    def __init__(self,uri,operation,parameterized=False):
         super(ValueProc,self).__init__(uri)
-        self.operation = operation
+        self.operation     = operation      # A function applied to a whole NumPy array at once
+        self.parameterized = parameterized  # If True, 'operation' also takes the 'param' input, as a scalar or an array broadcast against the values
         self.add_input(arg_dict['val_in'],required=True,default=True)
-        self.add_output(arg_dict['val_out'])
-    
+        self.add_output(arg_dict['val_out'],default=True)
+        self.add_output(arg_dict['binary_out'])
+
+    def get_param(self,inputs):
+        if 'param' not in inputs:
+            raise SCRYError("The %s procedure requires a 'param' input argument." % self.uri.encode())
+        return get_array(inputs['param'])
+
+    def format_output(self,ans,outputs,binary=False):
+        out = dict()
+        if 'binary_out' in outputs:
+            out['binary_out'] = binary_literal(ans)
+        if 'val_out' in outputs or not out:
+            if binary:
+                out['val_out'] = binary_literal(ans)
+            elif ans.size == 1:
+                out['val_out'] = Literal(np.float64(ans.flat[0])) # Not float(): RDFLib lexicalizes those with unicode(), keeping only 12 digits
+            else:
+                out['val_out'] = Literal(format_array(ans))
+        return out
+
     def execute(self,inputs,outputs,handler):
-        arg = inputs['val_in'].encode()                  # Input argument; a single value or array of CSV values
-        arr = np.array([float(i) for i in arg.split(',')]) # Split a list of CSV into array of floats
-        if len(arr) == 0: return                           # Abort if no values were given
-        try:
-            ans   = [self.operation(i) for i in arr]       # Apply the specified operation to every element in the array
-        except IndexError:
-            param = float(inputs['param'].encode())
-            ans   = [self.operation((i,param)) for i in arr]
-        if len(ans) == 1:
-            pred = Literal(ans[0])
+        arr = get_array(inputs['val_in'])                # Input argument; a single value, array of CSV values or binary array
+        if arr.size == 0: return                         # Abort if no values were given
+        if self.parameterized:
+            ans = self.operation(arr,self.get_param(inputs))
+        else:
+            ans = self.operation(arr)                    # Apply the specified operation to the whole array at once
+        return self.format_output(ans,outputs,is_binary(inputs['val_in']))
+
+    # The values of all input dictionaries are combined into one array, to which the operation is applied once
+    def execute_batch(self,input_dicts,outputs,handler):
+        if not input_dicts: return list()
+        literals = [d['val_in'] for d in input_dicts]
+        binary   = [is_binary(l) for l in literals]
+        if any(binary): # Binary arrays are already decoded; text is still parsed per input dictionary
+            arrays  = [get_array(l) for l in literals]
+            shapes  = [a.shape for a in arrays]
+            lengths = [a.size for a in arrays]
+            arr     = np.concatenate([a.ravel() for a in arrays])
+        else: # Text is parsed as a single array
+            texts   = [l.encode() for l in literals]
+            shapes  = [None for t in texts]
+            lengths = [(t.count(',') + t.count(';') + 1 if t.strip() else 0) for t in texts]
+            arr     = parse_array(','.join([t for t in texts if t.strip()]))
+        if self.parameterized:
+            params = [self.get_param(d) for d in input_dicts]
+            if any(p.size != 1 for p in params): # Array parameters are broadcast per input dictionary instead
+                return super(ValueProc,self).execute_batch(input_dicts,outputs,handler)
+            ans = self.operation(arr,np.repeat(np.concatenate([p.ravel() for p in params]),lengths))
         else:
-            pred = Literal(','.join([str(i) for i in ans]))
-        return pred # Specifying the argument is optional if a default output is defined!
-
-single_val_fncs = {'Absolute'   : abs,
-                   'Arccosine'  : np.arccos,
-                   'Arcsine'    : np.arcsin,
-                   'Arctangent' : np.arctan,
-                   'Ceiling'    : np.ceil,
-                   'Cosine'     : np.cos,
-                   'Exponent'   : np.exp,
-                   'Floor'      : np.floor,
-                   'Log'        : np.log,
-                   'Log10'      : np.log10 ,
-                   'Modulo'     : lambda x: np.mod(x[0],x[1]),
-                   'Power'      : lambda x: x[0]**x[1],
-                   'Round'      : round,
-                   'Sine'       : np.sin,
-                   'Sqrt'       : np.sqrt,
-                   'Tangent'    : np.tan,
-                   'Truncate'   : lambda x: round(x[0],int(x[1]))}
+            ans = self.operation(arr)
+
+        results = list()
+        for part, shape, b in zip(np.split(ans,np.cumsum(lengths)[:-1]),shapes,binary):
+            if not part.size:
+                results.append(None)
+                continue
+            if shape is not None:
+                part = part.reshape(shape)
+            results.append(self.format_output(part,outputs,b))
+        return results
+
+single_val_fncs = {'Absolute'   : (np.absolute      , False),
+                   'Arccosine'  : (np.arccos        , False),
+                   'Arcsine'    : (np.arcsin        , False),
+                   'Arctangent' : (np.arctan        , False),
+                   'Ceiling'    : (np.ceil          , False),
+                   'Cosine'     : (np.cos           , False),
+                   'Exponent'   : (np.exp           , False),
+                   'Floor'      : (np.floor         , False),
+                   'Log'        : (np.log           , False),
+                   'Log10'      : (np.log10         , False),
+                   'Modulo'     : (np.mod           , True ),
+                   'Power'      : (np.power         , True ),
+                   'Round'      : (round_half_away  , False),
+                   'Sine'       : (np.sin           , False),
+                   'Sqrt'       : (np.sqrt          , False),
+                   'Tangent'    : (np.tan           , False),
+                   'Truncate'   : (round_half_away  , True )}
 
 for fnc in single_val_fncs:
     uri      = MATH[fnc.lower()]
-    p        = ValueProc(uri,single_val_fncs[fnc])
+    p        = ValueProc(uri,*single_val_fncs[fnc])
     p.author = "Bas Stringer"
     p.description = 'Invokes the %s function on a value, or a comma-separated array of values' % fnc
     p.provenance  = "Generated by SCRY MATH service's %s function, version %s" % (fnc,__version__)
     p.version     = __version__
-    if fnc in ['Modulo','Power','Truncate']:
+    p.deterministic = True
+    if p.parameterized:
         p.add_input(arg_dict['param'],required=True)
     vars()[fnc] = p # Bind the procedure to a variable with the name of $fnc$
     __all__.append(fnc)
@@ -123,27 +257,26 @@ class ArrayProc(Procedure):
         self.in_id     = in_id
         self.out_id    = out_id
         self.add_input(arg_dict[in_id],required=True) # Automatically set to 'default_input' if it's the only input argument!
-        self.add_output(arg_dict[out_id])
+        self.add_output(arg_dict[out_id],default=True)
+        self.add_output(arg_dict['binary_out'])
 
     def execute(self,inputs,outputs,handler):
-        arg = inputs[self.in_id].encode()                                              # Input argument; a single value or array of CSV values
-        arr = np.array([[float(i) for i in row.split(',')] for row in arg.split(';')]) # Split the input into 1 or 2D array of floats
-
-        if len(arr) == 0: return    # Abort if no values were given
-        ans = self.operation(arr)   # Apply the specified operation to the array
-        if np.size(ans) == 1:
-            ans_string = str(ans)
-        elif len(ans) == np.size(ans):
-            ans_string = ','.join([str(i) for i in ans])
-        else:
-            ans_string = ';'.join([','.join([str(i) for i in row]) for row in ans])
-        return {self.out_id : Literal(ans_string)}
+        literal = inputs[self.in_id]
+        arr = get_array(literal,two_d=(self.in_id == 'multi_in')) # Input argument; a 1 or 2D array of CSV values, or a binary array
+        if arr.size == 0: return    # Abort if no values were given
+        ans = np.asarray(self.operation(arr)) # Apply the specified operation to the array
+        out = dict()
+        if 'binary_out' in outputs:
+            out['binary_out'] = binary_literal(ans)
+        if self.out_id in outputs or not out:
+            out[self.out_id] = (binary_literal(ans) if is_binary(literal) else Literal(format_array(ans)))
+        return out
 
 array_fncs  = {'Covariance' : (np.cov                        , 'multi_in' , 'multi_out' , "Calculates the N-by-N covariance matrix of N arrays"),
-               'Maximum'    : (max                           , 'array_in' , 'val_out'   , "Returns the Maximum value of an array"),
+               'Maximum'    : (np.max                        , 'array_in' , 'val_out'   , "Returns the Maximum value of an array"),
                'Mean'       : (np.mean                       , 'array_in' , 'val_out'   , "Returns the Mean value of an array"),
                'Median'     : (np.median                     , 'array_in' , 'val_out'   , "Returns the Median value of an array"),
-               'Minimum'    : (min                           , 'array_in' , 'val_out'   , "Returns the Minimum value of an array"),
+               'Minimum'    : (np.min                        , 'array_in' , 'val_out'   , "Returns the Minimum value of an array"),
                'PearsonR'   : (lambda x:np.corrcoef(x)[0][1] , 'multi_in' , 'val_out'   , "Calculates the Pearson correlation coefficient between two arrays"),
                'StDev'      : (np.std                        , 'array_in' , 'val_out'   , "Calculates the Standard Deviation of an array"),
                'SumArrays'  : (lambda x:np.sum(x,axis=0)     , 'multi_in' , 'array_out' , "Returns N element-wise sums (for M arrays of length N)"),
@@ -158,5 +291,6 @@ for fnc in array_fncs:
     p.description = spec[3]
     p.provenance  = "Generated by SCRY MATH service's %s function, version %s" % (fnc,__version__)
     p.version     = __version__
+    p.deterministic = True
     vars()[fnc] = p # Bind the procedure to a variable with the name of $fnc$
     __all__.append(fnc)
\ No newline at end of file
@@ -2,39 +2,186 @@ from utility          import URIError
 from services.classes import SCRY, STANDARD_ATTRIBUTES, Procedure
 
 from rdflib.graph import Graph
-from rdflib.term  import Literal
+from rdflib.term  import Literal, URIRef
 
-def load_procedures(config_file):
+from imp          import find_module, PKG_DIRECTORY
+from os           import listdir, rename, getpid
+from os.path      import join, dirname, abspath
+from hashlib      import sha1
+from json         import dumps, loads
+from threading    import Lock
+
+MANIFEST_VERSION = 2      # Bumped whenever the manifest's format changes, which invalidates existing manifests
+IMPORT_LOCK      = Lock() # Serializes the imports of lazily loaded modules
+
+
+# Returns a dictionary pointing from URIs to the procedures of the modules listed in 'config_file'
+#
+# The URIs, attributes and descriptions of those procedures are stored in a manifest (at 'manifest_file', if given),
+# along with a hash of the source files of the modules defining them. If 'lazy' is True, modules whose hash matches
+# the manifest are not imported; their procedures are registered as LazyProcedures instead, which import the module
+# the first time the procedure is actually used. This keeps modules with slow imports (e.g. services.BLAST, which lists
+# its database directory) from delaying the orb's startup. Modules which are imported update the manifest.
+def load_procedures(config_file,manifest_file=None,lazy=False):
 
     service_config = dict()
+    manifest       = read_manifest(manifest_file)
+    updated        = False
 
-    def import_file(string):
-        path = string.split('.')
-        mod  = __import__(string)
-        while len(path) > 1: mod = getattr(mod,path.pop(1))
-        var_list = dir(mod)
-        if '__all__' in var_list:
-            var_list = mod.__all__
-        for i in var_list:
-            v = getattr(mod,i)
-            if isinstance(v,Procedure):
-                v.assert_validity()
-                if v.uri not in service_config:
-                    service_config[v.uri] = v
-                else:
-                    raise URIError("More than one registered procedure is using the URI %s" % v.uri.encode() )
+    def register(uri,proc):
+        if uri not in service_config:
+            service_config[uri] = proc
+        else:
+            raise URIError("More than one registered procedure is using the URI %s" % uri.encode() )
 
     with open(config_file) as f:
         for line in f:
             line = line.split('#')[0].strip()
             if not line: continue # Skip empty lines and full-line comments
-            import_file(line)
+            key   = hash_module(line)
+            entry = manifest.get(line)
+            if lazy and entry and entry['hash'] == key:
+                for attrs in entry['procedures']:
+                    register(URIRef(attrs['uri']),LazyProcedure(line,attrs))
+            else:
+                procs = import_file(line)
+                for v in procs:
+                    register(v.uri,v)
+                if not entry or entry['hash'] != key:
+                    manifest[line] = {'hash'       : key,
+                                      'procedures' : [describe_procedure(v) for v in procs]}
+                    updated = True
 
+    if updated:
+        write_manifest(manifest_file,manifest)
     return service_config
 
+
+# Imports a module, and returns the (validated) Procedure instances it defines
+def import_file(string):
+    path = string.split('.')
+    mod  = __import__(string)
+    while len(path) > 1: mod = getattr(mod,path.pop(1))
+    var_list = dir(mod)
+    if '__all__' in var_list:
+        var_list = mod.__all__
+    procs = list()
+    for i in var_list:
+        v = getattr(mod,i)
+        if isinstance(v,Procedure):
+            v.assert_validity()
+            procs.append(v)
+    return procs
+
+
+## MANIFEST
+
+# Hashes the source files a module's procedures may depend on, without importing it: the .py files in the directories
+# of the module and its packages (which includes the packages' __init__.py files and the module's siblings), and classes.py
+def hash_module(string):
+    dirs = list()
+    path = None
+    for part in string.split('.'):
+        f, pathname, desc = find_module(part,path)
+        if f: f.close()
+        if desc[2] == PKG_DIRECTORY:
+            path = [pathname]
+            dirs.append(pathname)
+        else:
+            dirs.append(dirname(pathname))
+    files = set(join(d,n) for d in dirs for n in listdir(d) if n.endswith('.py'))
+    files.add(join(dirname(abspath(__file__)),'classes.py'))
+    h = sha1()
+    for path in sorted(files):
+        with open(path,'rb') as f:
+            h.update(path)
+            h.update(f.read())
+    return h.hexdigest()
+
+def describe_procedure(proc):
+    attrs = dict((attr,getattr(proc,attr)) for attr in STANDARD_ATTRIBUTES)
+    attrs['uri']            = unicode(proc.uri)
+    attrs['deterministic']  = proc.deterministic
+    attrs['cache_version']  = proc.version if type(proc).get_cache_version == Procedure.get_cache_version else None # Computed when the response cache is checked otherwise
+    attrs['description_nt'] = proc.get_description().serialize(format='nt').decode('utf-8')
+    return attrs
+
+# Returns the manifest's modules pointing to their entries, or an empty dictionary if there is no (valid) manifest
+def read_manifest(manifest_file):
+    if not manifest_file:
+        return dict()
+    try:
+        with open(manifest_file) as f:
+            manifest = loads(f.read())
+    except (IOError,ValueError):
+        return dict()
+    if manifest.get('version') != MANIFEST_VERSION:
+        return dict()
+    return manifest['modules']
+
+# Writes the manifest to a temporary file first, so concurrently starting orbs never read a partial manifest
+def write_manifest(manifest_file,manifest):
+    if not manifest_file:
+        return
+    temp_file = '%s.%i.tmp' % (manifest_file,getpid())
+    try:
+        with open(temp_file,'w') as f:
+            f.write(dumps({'version':MANIFEST_VERSION,'modules':manifest},indent=1,sort_keys=True))
+        rename(temp_file,manifest_file)
+    except (IOError,OSError):
+        pass # An orb without write access to the manifest simply imports all modules on startup
+
+
+# Stands in for a procedure whose module has not been imported yet. Its URI, standard attributes, 'deterministic' flag,
+# cache version and description are read from the manifest, so describing the orb (or checking cached responses) does not
+# import the module; any other attribute imports it, and is then looked up on the actual Procedure instance.
+# (Procedures which override get_cache_version(), e.g. to fingerprint a database, are imported to check cached responses.)
+class LazyProcedure(object):
+
+    def __init__(self,module,attrs):
+        self.module         = module                          # The dotted name of the module defining the procedure
+        self.uri            = URIRef(attrs['uri'])
+        self.author         = attrs['author'].encode('utf-8')
+        self.description    = attrs['description'].encode('utf-8')
+        self.provenance     = attrs['provenance'].encode('utf-8')
+        self.version        = attrs['version'].encode('utf-8')
+        self.deterministic  = attrs['deterministic']
+        self.cache_version  = attrs['cache_version']          # The procedure's get_cache_version(), or None if it must be computed by the procedure itself
+        self.description_nt = attrs['description_nt']         # The procedure's description graph, serialized as N-Triples
+        self.procedure      = None                            # The actual Procedure instance, once the module is imported
+
+    def load(self):
+        if self.procedure is None:
+            with IMPORT_LOCK:
+                if self.procedure is None:
+                    for proc in import_file(self.module):
+                        if proc.uri == self.uri:
+                            self.procedure = proc
+                            break
+                    else:
+                        raise URIError("The module %s no longer defines the procedure %s" % (self.module,self.uri.encode()))
+        return self.procedure
+
+    def __getattr__(self,name):
+        return getattr(self.load(),name)
+
+    def get_description(self):
+        g = Graph()
+        g.parse(data=self.description_nt,format='nt')
+        return g
+
+    def get_cache_version(self):
+        if self.cache_version is None:
+            return self.load().get_cache_version()
+        return self.cache_version
+
+### END OF LazyProcedure
+
+
+# The description is the scry:orb_description named graph of the union queries using the orb are evaluated against
 def get_orb_description(desc_dict,service_config):
-    g    = Graph()
-    
+    g    = Graph(identifier=SCRY.orb_description)
+
     for attr in STANDARD_ATTRIBUTES:
         g.add((SCRY.orb, SCRY[attr], Literal(desc_dict[attr])))
 
@@ -43,4 +190,4 @@ def get_orb_description(desc_dict,service_config):
         desc = proc.get_description()
         g   += desc
 
-    return g
\ No newline at end of file
+    return g
@@ -1,11 +1,40 @@
+from __future__   import absolute_import # So __init__ is the orb's settings module, rather than the services package
+
+from __init__     import PROCEDURE_CACHE_BYTES
 from utility      import SCRYError
+from cache        import CostAwareCache
+from metrics      import PROCEDURE_SECONDS, PROCEDURE_ERRORS, register_cache
 from rdflib       import Namespace
 from rdflib.graph import Graph
 from rdflib.term  import Literal, URIRef
+from time         import time
+from threading    import Lock
+from os           import getpid
+from multiprocessing.pool import ThreadPool
+
+SCRY                  = Namespace('http://www.scry.com/')
+A                     = URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#type')
+STANDARD_ATTRIBUTES   = ['author','description','provenance','version']
+
+PROCEDURE_CACHE       = CostAwareCache(PROCEDURE_CACHE_BYTES) # (URI, cache version, memoized inputs, outputs) tuples pointing to the output of Procedure.execute()
+MISSING               = object()
+IO_POOL_THREADS       = 64 # Number of threads shared by the invocations of all I/O-bound procedures (see Procedure.io_bound), across all queries
+
+register_cache('procedure',PROCEDURE_CACHE)
 
-SCRY                = Namespace('http://www.scry.com/')
-A                   = URIRef('http://www.w3.org/1999/02/22-rdf-syntax-ns#type')
-STANDARD_ATTRIBUTES = ['author','description','provenance','version']
+# The thread pool of I/O-bound procedures is created on first use, and again after a fork (threads do not survive it),
+# so the worker processes of server.serve() each get their own
+IO_POOL      = None
+IO_POOL_PID  = None
+IO_POOL_LOCK = Lock()
+
+def get_io_pool():
+    global IO_POOL, IO_POOL_PID
+    with IO_POOL_LOCK:
+        if IO_POOL is None or IO_POOL_PID != getpid():
+            IO_POOL     = ThreadPool(IO_POOL_THREADS)
+            IO_POOL_PID = getpid()
+        return IO_POOL
 
 class DescribedURI(object):
     
@@ -36,6 +65,16 @@ class Procedure(DescribedURI):
                                     # Else, if only 1 accepted argument is specified, default_input is set to that.
         self.default_output = None  # The Argument instance to be associated with UNSPECIFIED scry:output predicates
                                     # If  only 1 generated argument is specified, default_output is set to that.
+        self.deterministic  = False # Set to True if, for the same get_cache_version(), this procedure always produces the same outputs for the same inputs
+                                    # Responses to queries which only invoke deterministic procedures may be served from the orb's response cache.
+        self.memoize        = False # Set to True to keep the outputs of this procedure's invocations in PROCEDURE_CACHE, so identical invocations
+                                    # (by any query) can reuse them. Only suitable for deterministic procedures whose outputs do not refer to
+                                    # temporary files or other per-query state -- and whose inputs only do if get_memo_inputs() is overridden.
+                                    # Only worthwhile if executing costs more than hashing the inputs and storing the outputs (e.g. a BLAST run,
+                                    # but not the elementwise NumPy operations of services.MATH).
+        self.io_bound       = False # Set to True if invocations mostly wait on I/O (e.g. fetching from a remote API), so the invocations of a
+                                    # batch are executed concurrently on the shared IO_POOL, rather than one after another. The procedure's
+                                    # function must then be safe to call from several threads at once.
                                     
         for key in kwargs:
             setattr(self,key,kwargs[key])
@@ -48,6 +87,68 @@ class Procedure(DescribedURI):
     def execute(self,input_dict,expected_outputs,handler):
         return self.function(input_dict,expected_outputs,handler)
 
+    # This method may be overwritten by procedures which can process many input dictionaries more efficiently at once
+    # It accepts a list of input dictionaries rather than a single one, and must return a list of the same length,
+    # in which every element is what execute() would have returned for the input dictionary at the same position
+    def execute_batch(self,input_dicts,expected_outputs,handler):
+        if self.io_bound and len(input_dicts) > 1:
+            return get_io_pool().map(lambda d: self.execute(d,list(expected_outputs),handler),input_dicts)
+        return [self.execute(d,list(expected_outputs),handler) for d in input_dicts] # Passes copies, as procedures may modify them
+
+    # Called by CallHandlers instead of execute(), to reuse memoized outputs where possible
+    def invoke(self,input_dict,expected_outputs,handler):
+        return self.invoke_batch([input_dict],expected_outputs,handler)[0]
+
+    # Called by CallHandlers instead of execute_batch(), to reuse memoized outputs where possible
+    # Only the input dictionaries without memoized outputs are passed on to execute_batch(). The time it takes is
+    # stored as the cost of the new entries, so expensive invocations stay cached longer than cheap ones.
+    def invoke_batch(self,input_dicts,expected_outputs,handler):
+        if not input_dicts:
+            return list()
+        if not (self.memoize and PROCEDURE_CACHE.max_size > 0):
+            return self.execute_checked(input_dicts,expected_outputs,handler)
+
+        out_key = tuple(sorted(expected_outputs))
+        version = self.get_cache_version()
+        keys    = [(self.uri,version,self.get_memo_inputs(d),out_key) for d in input_dicts]
+        outputs = [PROCEDURE_CACHE.get(key,MISSING) for key in keys]
+        missing = dict() # Keys without memoized outputs, pointing to their input dictionaries (so duplicates are executed once)
+        for key, d, output in zip(keys,input_dicts,outputs):
+            if output is MISSING:
+                missing[key] = d
+        if not missing:
+            return outputs
+
+        start    = time()
+        computed = dict(zip(missing.keys(),self.execute_checked(missing.values(),expected_outputs,handler)))
+        cost     = (time() - start) / len(missing)
+        for key in computed:
+            PROCEDURE_CACHE.put(key,computed[key],cost)
+        return [(computed[key] if output is MISSING else output) for key, output in zip(keys,outputs)]
+
+    # Returns the version under which the outputs of this procedure are cached, in the response cache and (if memoized)
+    # in PROCEDURE_CACHE. Procedures whose outputs depend on data which may change without 'version' being bumped (e.g.
+    # a database) should override this, to add a fingerprint of that data.
+    def get_cache_version(self):
+        return self.version
+
+    # Returns the part of the memoization key identifying an invocation's inputs. Procedures accepting file paths should
+    # override this, to key on the files' contents: paths in scratch directories are reused by later queries (see workspace.py).
+    def get_memo_inputs(self,input_dict):
+        return frozenset(input_dict.iteritems())
+
+    def execute_checked(self,input_dicts,expected_outputs,handler):
+        labels = (self.uri,)
+        try:
+            with PROCEDURE_SECONDS.time(labels):
+                outputs = self.execute_batch(input_dicts,expected_outputs,handler)
+        except Exception:
+            PROCEDURE_ERRORS.inc(labels)
+            raise
+        if len(outputs) != len(input_dicts):
+            raise SCRYError("The procedure %s returned %i outputs for %i inputs." % (self.uri.encode(), len(outputs), len(input_dicts)))
+        return outputs
+
     def add_input(self,argument,required=False,default=False):
         self.accepts.add(argument)
         if required:
@@ -139,7 +240,10 @@ class Procedure(DescribedURI):
              'default_output' : (type(None),Argument),
              'accepts'        : set,
              'requires'       : set,
-             'generates'      : set}
+             'generates'      : set,
+             'deterministic'  : bool,
+             'memoize'        : bool,
+             'io_bound'       : bool}
         for k in d:
             att = getattr(self,k)
             if att and not isinstance(att, d[k]):
@@ -0,0 +1,62 @@
+from rdflib.plugins.sparql.results.xmlresults import SPARQLXMLWriter
+from rdflib.plugins.sparql.results.csvresults import CSVResultSerializer
+
+from cStringIO import StringIO
+from csv       import writer
+
+
+# Generators which serialize the rows of a SELECT query's Result object in chunks of 'chunk_rows' rows,
+# so Flask can send them as a chunked response while later rows are still being serialized.
+# Their output is equivalent to that of RDFLib's own Result.serialize() for the same format.
+
+# Yields the rows of a SELECT Result as tuples, in the order of its variables. Iterating the Result itself would keep
+# every row in it (RDFLib appends them to Result._bindings), so the solutions are read from its generator instead.
+def iter_rows(result):
+    variables = result.vars
+    solutions = result._genbindings
+    if solutions is None: # Already evaluated, or built from a list
+        solutions = result.bindings
+    else:
+        result._genbindings = None # The generator is consumed here
+    for b in solutions:
+        yield tuple(b.get(v) for v in variables)
+
+def flush(buf):
+    chunk = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return chunk
+
+def stream_xml(result,chunk_rows):
+    buf = StringIO()
+    out = SPARQLXMLWriter(buf)
+    out.write_header(result.vars)
+    out.write_results_header()
+    n = 0
+    for row in iter_rows(result):
+        out.write_start_result()
+        for var, val in zip(result.vars,row):
+            if val is not None:
+                out.write_binding(var,val)
+        out.write_end_result()
+        n += 1
+        if n % chunk_rows == 0:
+            yield flush(buf)
+    out.close()
+    yield flush(buf)
+
+def stream_csv(result,chunk_rows):
+    buf  = StringIO()
+    out  = writer(buf,delimiter=',')
+    term = CSVResultSerializer(result).serializeTerm
+    out.writerow([term(v,'utf-8') for v in result.vars])
+    n = 0
+    for row in iter_rows(result):
+        out.writerow([term(val,'utf-8') for val in row])
+        n += 1
+        if n % chunk_rows == 0:
+            yield flush(buf)
+    yield flush(buf)
+
+STREAMING_SERIALIZERS = {'xml' : stream_xml,
+                         'csv' : stream_csv}
@@ -0,0 +1 @@
+# Run from the repository's root directory: python -m unittest discover -b -s tests -t .
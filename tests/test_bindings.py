@@ -0,0 +1,180 @@
+import unittest
+
+from bindings         import BindingTable, BindingStream, join
+from context_handler  import ContextHandler
+
+from rdflib.term      import Variable, Literal
+from itertools        import product
+from random           import Random
+from threading        import Condition, Thread
+
+A, B, C, D = [Variable(n) for n in 'abcd']
+
+
+def table(variables,*rows):
+    t = BindingTable(variables)
+    for row in rows:
+        t.add_row([(None if x is None else Literal(x)) for x in row])
+    return t
+
+def solutions(t):
+    return sorted(sorted(d.items()) for d in t.dicts())
+
+# SPARQL's join, as defined on solution mappings: every pair of compatible solutions, merged
+def reference_join(left,right):
+    out = list()
+    for a, b in product(list(left.dicts()),list(right.dicts())):
+        if all(b[v] == x for v, x in a.items() if v in b):
+            merged = dict(a)
+            merged.update(b)
+            out.append(merged)
+    return sorted(sorted(d.items()) for d in out)
+
+def reference_table(left,right):
+    t = BindingTable()
+    for d in reference_join(left,right):
+        t.append(dict(d))
+    return t
+
+
+class TestBindingTable(unittest.TestCase):
+
+    def test_append_adds_missing_columns(self):
+        t = BindingTable()
+        t.append({A:Literal(1)})
+        t.append({B:Literal(2)})
+        self.assertEqual(t.vars,[A,B])
+        self.assertEqual(list(t.rows()),[(Literal(1),None),(None,Literal(2))])
+
+    def test_add_rows_pads_unbound_values(self):
+        t = table([A],(1,))
+        t.add_rows(table([B],(2,),(3,)))
+        self.assertEqual(len(t),3)
+        self.assertEqual(t.column(A),[Literal(1),None,None])
+        self.assertEqual(t.column(B),[None,Literal(2),Literal(3)])
+
+    def test_tables_without_columns_count_their_rows(self):
+        t = BindingTable()
+        t.add_row(())
+        t.add_row(())
+        self.assertEqual(list(t.rows()),[(),()])
+
+    def test_project_and_slice(self):
+        t = table([A,B],(1,2),(3,4),(5,6))
+        self.assertEqual(list(t.project([B,C]).rows()),[(Literal(2),None),(Literal(4),None),(Literal(6),None)])
+        self.assertEqual(list(t.slice(1,5).rows()),[(Literal(3),Literal(4)),(Literal(5),Literal(6))])
+        self.assertEqual(len(t.slice(3,5)),0)
+
+    def test_distinct_shares_seen_rows(self):
+        seen = set()
+        self.assertEqual(len(table([A],(1,),(1,),(2,)).distinct(seen)),2)
+        self.assertEqual(len(table([A],(2,),(3,)).distinct(seen)),1)
+
+
+class TestJoin(unittest.TestCase):
+
+    def assertJoins(self,left,right):
+        self.assertEqual(solutions(join(left,right)),reference_join(left,right))
+
+    def test_shared_variables(self):
+        self.assertJoins(table([A,B],(1,2),(1,3),(2,4)),table([B,C],(2,5),(3,6),(3,7),(9,9)))
+
+    def test_cross_product(self):
+        out = join(table([A],(1,),(2,)),table([B],(3,),(4,),(5,)))
+        self.assertEqual(len(out),6)
+        self.assertEqual(out.vars,[A,B])
+
+    def test_unbound_values_are_compatible_with_any(self):
+        left  = table([A,B],(1,None),(2,2))
+        right = table([B,C],(2,5),(3,6))
+        self.assertJoins(left,right)
+        self.assertEqual(len(join(left,right)),3)
+
+    def test_unique(self):
+        left = table([A],(1,),(1,))
+        self.assertEqual(len(join(left,table([B],(2,)))),2)
+        self.assertEqual(len(join(left,table([B],(2,)),unique=True)),1)
+
+    def test_empty_tables_keep_their_variables(self):
+        out = join(table([A,B]),table([B,C],(1,2)))
+        self.assertEqual(len(out),0)
+        self.assertEqual(out.vars,[A,B,C])
+
+    def test_matches_the_reference_join(self):
+        rng = Random(0)
+        for trial in range(200):
+            tables = list()
+            for variables in ([A,B,C],[B,C,D]):
+                variables = rng.sample(variables,rng.randint(1,3))
+                rows = [[rng.choice((None,1,2,3)) for v in variables] for r in range(rng.randint(0,6))]
+                tables.append(table(variables,*rows))
+            self.assertJoins(*tables)
+
+
+# ContextHandler.merge_and_filter joins the tables of a handler's dependencies into its valid inputs
+class TestMergeAndFilter(unittest.TestCase):
+
+    def merge(self,*tables):
+        return ContextHandler(None).merge_and_filter(None,tables)
+
+    def test_joins_all_tables(self):
+        tables = [table([A,B],(1,2),(1,3)),table([B,C],(2,4),(3,5)),table([C,D],(4,6),(5,7),(8,9))]
+        merged = self.merge(*tables)
+        self.assertEqual(solutions(merged),reference_join(reference_table(tables[0],tables[1]),tables[2]))
+        self.assertEqual(len(merged),2)
+
+    def test_duplicate_rows_are_merged_once(self):
+        self.assertEqual(len(self.merge(table([A],(1,),(1,)),table([A,B],(1,2)))),1)
+
+    def test_empty_results_keep_every_variable(self):
+        for tables in ([table([A],(1,)),table([B])],[table([A],(1,)),table([A,B],(2,3))]):
+            merged = self.merge(*tables)
+            self.assertEqual(len(merged),0)
+            self.assertEqual(set(merged.vars),set(v for t in tables for v in t.vars))
+
+
+
+class TestBindingStream(unittest.TestCase):
+
+    def test_consumers_read_rows_in_order(self):
+        stream = BindingStream(Condition())
+        stream.register('consumer')
+        stream.add_rows(table([A],(1,),(2,),(3,)))
+        self.assertEqual(list(stream.read('consumer',2).rows()),[(Literal(1),),(Literal(2),)])
+        stream.add_rows(table([A],(4,)))
+        stream.close()
+        self.assertEqual(list(stream.read('consumer',5).rows()),[(Literal(3),),(Literal(4),)])
+        self.assertEqual(len(stream.read('consumer',5)),0) # Closed, and every row has been read
+
+    def test_producers_wait_for_lagging_consumers(self):
+        stream = BindingStream(Condition(),max_lag=2)
+        stream.register('consumer')
+        lags   = list() # How far the producer ran ahead after adding each row; asserted on here, rather than in its thread
+        def produce():
+            for i in range(10):
+                stream.add_rows(table([A],(i,)))
+                with stream.condition:
+                    lags.append(stream.length - stream.cursors['consumer'])
+            stream.close()
+        producer = Thread(target=produce)
+        producer.start()
+        read = list()
+        while True:
+            rows = stream.read('consumer',1)
+            if not rows: break
+            read.extend(rows.rows())
+        producer.join(5)
+        self.assertEqual(read,[(Literal(i),) for i in range(10)])
+        self.assertLessEqual(max(lags),2)
+
+    def test_unregistered_consumers_do_not_hold_up_producers(self):
+        stream = BindingStream(Condition(),max_lag=1)
+        stream.register('consumer')
+        stream.unregister('consumer')
+        for i in range(5):
+            stream.add_rows(table([A],(i,)))
+        self.assertEqual(len(stream),5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import sys
+import os
+
+from rdflib.term import Literal
+from tempfile    import mkdtemp
+from shutil      import rmtree
+from stat        import S_IRWXU
+from os.path     import join, dirname, abspath
+
+# The BLAST service lists its database directory when it is imported, so it is pointed at empty ones first
+ROOT = mkdtemp()
+os.environ['SCRY_BLAST_BIN_ROOT'] = join(ROOT,'bin')
+os.environ['SCRY_BLAST_DB_ROOT']  = join(ROOT,'db')
+os.mkdir(join(ROOT,'bin'))
+os.mkdir(join(ROOT,'db'))
+
+from services.BLAST import run_blast
+
+
+def tearDownModule():
+    rmtree(ROOT,ignore_errors=True)
+
+
+class TestInstallationFingerprint(unittest.TestCase):
+
+    def test_changes_with_the_databases(self):
+        before = run_blast.RunBLAST.get_cache_version()
+        with open(join(ROOT,'db','HPA.psq'),'w') as f:
+            f.write('sequences')
+        self.assertNotEqual(run_blast.RunBLAST.get_cache_version(),before)
+
+    def test_missing_directories_do_not_raise(self):
+        rmtree(join(ROOT,'bin'))
+        try:
+            missing = run_blast.get_installation_fingerprint()
+            self.assertEqual(run_blast.get_installation_fingerprint(),missing)
+        finally:
+            os.mkdir(join(ROOT,'bin'))
+        self.assertNotEqual(run_blast.get_installation_fingerprint(),missing)
+
+
+
+# Stands in for the QueryHandler whose scratch directories the procedures use
+class TempDirHandler(object):
+
+    def __init__(self):
+        self.temp_dirs = list()
+
+    def get_temp_dir(self):
+        self.temp_dirs.append(mkdtemp(dir=ROOT))
+        return self.temp_dirs[-1]
+
+### END OF TempDirHandler
+
+
+# BLASTs against benchmarks/fake_blast.py, installed as blastp and blastn, which logs the number of queries of every run
+class TestBatchedRuns(unittest.TestCase):
+
+    PROTEIN    = 'MEFLKRSCQDIPHWVYTAGN'
+    NUCLEOTIDE = 'ACGTTGCAACGTAGCTAGCA'
+
+    def setUp(self):
+        with open(join(dirname(dirname(abspath(__file__))),'benchmarks','fake_blast.py')) as f:
+            script = f.read().split('\n',1)[1]
+        for program in ('blastp','blastn'):
+            path = join(ROOT,'bin',program)
+            with open(path,'w') as f:
+                f.write('#! %s\n%s' % (sys.executable,script))
+            os.chmod(path,S_IRWXU)
+        open(join(ROOT,'db','HPA.psq'),'w').close()
+        self.log = join(ROOT,'blast_runs.log')
+        os.environ['SCRY_FAKE_BLAST_LOG']  = self.log
+        os.environ['SCRY_FAKE_BLAST_HITS'] = '2'
+        self.max_batch_queries = run_blast.MAX_BATCH_QUERIES
+
+    def tearDown(self):
+        run_blast.MAX_BATCH_QUERIES = self.max_batch_queries
+        for name in ('SCRY_FAKE_BLAST_LOG','SCRY_FAKE_BLAST_HITS'):
+            del os.environ[name]
+        for path in (self.log,join(ROOT,'db','HPA.psq')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Returns the (program, number of queries) tuples of the BLAST runs so far
+    def runs(self):
+        with open(self.log) as f:
+            return sorted((program,int(n)) for program, n in (line.split() for line in f))
+
+    def blast(self,input_dicts):
+        return run_blast.run_blast_batch(input_dicts,['def','num_hits'],TempDirHandler())
+
+    def test_rows_get_the_hits_of_their_own_sequence(self):
+        input_dicts = [{'seq':Literal('>p%i\n%s' % (i,self.PROTEIN))} for i in range(3)]
+        input_dicts.append({'seq':Literal(self.NUCLEOTIDE)})
+        input_dicts.append({'seq':Literal('>p3\n' + self.PROTEIN),'evalue':Literal('0.01')})
+        results = self.blast(input_dicts)
+        self.assertEqual(self.runs(),[('blastn',1),('blastp',1),('blastp',3)])
+        for i, name in enumerate(['p0','p1','p2','query_sequence','p3']):
+            self.assertEqual([r['def'] for r in results[i]],[Literal('Synthetic hit %i for %s' % (h,name)) for h in (1,2)])
+            self.assertTrue(all(r['num_hits'] == Literal(2) for r in results[i]))
+
+    def test_batches_are_split(self):
+        run_blast.MAX_BATCH_QUERIES = 2
+        results = self.blast([{'seq':Literal('>p%i\n%s' % (i,self.PROTEIN))} for i in range(5)])
+        self.assertEqual(self.runs(),[('blastp',1),('blastp',2),('blastp',2)])
+        self.assertEqual([r[0]['def'] for r in results],[Literal('Synthetic hit 1 for p%i' % i) for i in range(5)])
+
+    # A row whose input holds several sequences gets the hits of the last one, as when rows were BLASTed one at a time
+    def test_multiple_sequences_in_a_row(self):
+        input_dicts = [{'seq':Literal('>a\n%s\n>b\n%s' % (self.PROTEIN,self.PROTEIN))},{'seq':Literal('>c\n' + self.PROTEIN)}]
+        results     = self.blast(input_dicts)
+        self.assertEqual([r[0]['def'] for r in results],[Literal('Synthetic hit 1 for b'),Literal('Synthetic hit 1 for c')])
+
+    def test_single_inputs(self):
+        self.assertEqual(run_blast.run_blast({'seq':Literal(self.PROTEIN)},['num_hits'],TempDirHandler()),[{'num_hits':Literal(2)}] * 2)
+
+### END OF TestBatchedRuns
+
+
+if __name__ == '__main__':
+    unittest.main()
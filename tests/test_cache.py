@@ -0,0 +1,73 @@
+import unittest
+
+from cache         import LRUCache
+from query_handler import normalize_query, ParsedQuery
+from time          import sleep
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_the_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a',1)
+        cache.put('b',2)
+        cache.get('a')
+        cache.put('c',3)
+        self.assertEqual((cache.get('a'),cache.get('b'),cache.get('c')),(1,None,3))
+
+    def test_weighed_entries(self):
+        cache = LRUCache(10,weigh=len)
+        cache.put('a','x' * 6)
+        cache.put('b','x' * 6)
+        cache.put('c','x' * 11) # Heavier than the whole cache, so never kept
+        self.assertEqual((cache.get('a'),cache.get('b'),cache.get('c')),(None,'x' * 6,None))
+        self.assertEqual(cache.weight,6)
+
+    def test_replacing_entries_updates_their_weight(self):
+        cache = LRUCache(10,weigh=len)
+        cache.put('a','xxxx')
+        cache.put('a','xx')
+        self.assertEqual(cache.weight,2)
+        cache.discard('a')
+        self.assertEqual((len(cache),cache.weight),(0,0))
+
+    def test_entries_expire(self):
+        cache = LRUCache(10,ttl=0.05)
+        cache.put('a',1)
+        self.assertEqual(cache.get('a'),1)
+        sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.weight,0)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a',1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        cache.put('a',1)
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'],stats['misses'],stats['size']),(1,1,1))
+
+
+class TestQueryNormalization(unittest.TestCase):
+
+    def test_collapses_whitespace(self):
+        self.assertEqual(normalize_query('  SELECT  ?x\tWHERE {\n\n  ?x ?p ?o }  '),'SELECT ?x WHERE {\n?x ?p ?o }')
+
+    def test_keeps_literals_and_comments(self):
+        query = 'SELECT ?x WHERE { ?x ?p "a  b" . ?x ?q """c\n\n d""" } # a  comment\nLIMIT 1'
+        self.assertEqual(normalize_query(query),query)
+        self.assertEqual(normalize_query('SELECT ?x WHERE { ?x ?p "a \\"  b" }'),'SELECT ?x WHERE { ?x ?p "a \\"  b" }')
+
+    def test_deterministic_functions(self):
+        self.assertTrue(ParsedQuery('SELECT ?x WHERE { ?x ?p ?o FILTER(STRLEN(?o) > 1) }').deterministic)
+        self.assertFalse(ParsedQuery('SELECT ?x ?r WHERE { ?x ?p ?o BIND(RAND() AS ?r) }').deterministic)
+        self.assertFalse(ParsedQuery('SELECT ?x WHERE { ?x ?p ?o FILTER(?o < NOW()) }').deterministic)
+
+
+if __name__ == '__main__':
+    unittest.main()
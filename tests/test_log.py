@@ -0,0 +1,55 @@
+import unittest
+
+import log
+
+from zlib   import decompress
+from base64 import b64decode
+
+
+class TestLog(unittest.TestCase):
+
+    def setUp(self): # Records are kept here, rather than queued for the writer thread
+        self.records = list()
+        self.enqueue = log.enqueue
+        log.enqueue  = self.records.append
+
+    def tearDown(self):
+        log.enqueue = self.enqueue
+
+    def test_streamed_responses_are_logged_once_complete(self):
+        chunks = ['a' * log.LOG_BODY_BYTES,'b' * 10]
+        stream = log.log_response_stream(iter(chunks),'2015-01-01','12:00:00')
+        self.assertEqual(next(stream),chunks[0])
+        self.assertEqual(self.records,list())
+        self.assertEqual(list(stream),chunks[1:])
+        record = self.records[0]
+        self.assertEqual((record['bytes'],record['truncated'],record['streamed']),(log.LOG_BODY_BYTES + 10,True,True))
+        self.assertEqual(record['body'],chunks[0])
+
+    def test_interrupted_streams_are_logged(self):
+        stream = log.log_response_stream(iter(['a','b']),'2015-01-01','12:00:00')
+        next(stream)
+        stream.close() # The client disconnected
+        self.assertEqual(self.records[0]['bytes'],1)
+
+    def test_responses_are_truncated(self):
+        log.log_response('x' * (log.LOG_BODY_BYTES + 1),'2015-01-01','12:00:00')
+        self.assertEqual(len(self.records[0]['body']),log.LOG_BODY_BYTES)
+        self.assertTrue(self.records[0]['truncated'])
+
+    def test_format_record(self):
+        record = log.format_record({'type':'response','body':u'caf\xe9'})
+        if log.LOG_COMPRESS_BODY:
+            self.assertEqual(decompress(b64decode(record['body_zlib'])).decode('utf-8'),u'caf\xe9')
+        else:
+            self.assertEqual(record['body'],u'caf\xe9')
+        self.assertNotIn('body' if log.LOG_COMPRESS_BODY else 'body_zlib',record)
+
+    # Responses are sampled along with their requests, as both are derived from the request's key
+    def test_sampling_is_deterministic(self):
+        keys = [('2015-01-01','12:00:%02i.%06i' % (i % 60,i)) for i in range(100)]
+        self.assertEqual([log.is_sampled(*k) for k in keys],[log.is_sampled(*k) for k in keys])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+
+from services.MATH import basic
+from utility       import SCRYError
+from rdflib.term   import Literal
+
+
+# Single values must keep full (repr) precision, like arrays do; RDFLib lexicalizes Python floats with only 12 digits
+class TestOutputPrecision(unittest.TestCase):
+
+    def value(self,proc,text):
+        return proc.execute({'val_in':Literal(text)},set(['val_out']),None)['val_out']
+
+    def test_sqrt_round_trips(self):
+        out = self.value(basic.Sqrt,'2')
+        self.assertEqual(out.encode(),repr(np.sqrt(2.0)))
+        self.assertEqual(float(out.encode()),np.sqrt(2.0))
+
+    def test_chained_calls_do_not_compound_errors(self):
+        out = self.value(basic.Exponent,self.value(basic.Log,'2').encode())
+        self.assertEqual(float(out.encode()),np.exp(np.log(2.0)))
+
+    def test_batches_match_single_values(self):
+        inputs  = [{'val_in':Literal(t)} for t in ('2','3','2,3')]
+        results = basic.Sqrt.execute_batch(inputs,set(['val_out']),None)
+        self.assertEqual([r['val_out'].encode() for r in results],
+                         [repr(np.sqrt(2.0)),repr(np.sqrt(3.0)),'%r,%r' % (np.sqrt(2.0),np.sqrt(3.0))])
+
+    def test_scalar_and_array_outputs_agree(self):
+        self.assertEqual(self.value(basic.Log,'2').encode(),self.value(basic.Log,'2,2').encode().split(',')[0])
+
+
+
+class TestBinaryArrays(unittest.TestCase):
+
+    # Encodes an array as a binary-array Literal, and parses its lexical form back, as a client would send it
+    def round_trip(self,arr):
+        lexical = basic.binary_literal(arr).encode()
+        return basic.get_array(Literal(lexical,datatype=basic.BINARY_ARRAY))
+
+    def test_round_trip(self):
+        for arr in (np.array([np.sqrt(2.0),-0.0,1e-300,np.inf]),
+                    np.arange(12,dtype='int32').reshape(3,4),
+                    np.array([True,False]),
+                    np.array([1.5,2.5],dtype='>f4'), # Big-endian arrays are encoded little-endian
+                    np.array(7.0),
+                    np.zeros((0,3))):
+            out = self.round_trip(arr)
+            self.assertEqual(out.shape,arr.shape)
+            self.assertEqual(out.dtype.kind,arr.dtype.kind)
+            self.assertEqual(out.tolist(),arr.tolist())
+
+    def test_non_numeric_dtypes_are_rejected(self):
+        for lexical in ('|S3;1;YWJj','<c16;0;','<U1;1;YQAAAA=='):
+            self.assertRaises(SCRYError,basic.decode_binary_array,lexical)
+
+    def test_binary_inputs_give_binary_outputs(self):
+        arr = np.array([2.0,3.0])
+        out = basic.Sqrt.execute({'val_in':basic.binary_literal(arr)},set(['val_out']),None)['val_out']
+        self.assertTrue(basic.is_binary(out))
+        self.assertEqual(basic.get_array(out).tolist(),np.sqrt(arr).tolist())
+
+    def test_text_and_binary_inputs_agree(self):
+        text   = basic.Log.execute({'val_in':Literal('2,3')},set(['val_out']),None)['val_out']
+        binary = basic.Log.execute({'val_in':Literal('2,3')},set(['binary_out']),None)['binary_out']
+        self.assertEqual(basic.get_array(text).tolist(),basic.get_array(binary).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+import launch
+
+from metrics import Counter, Histogram, REGISTRY
+from time    import sleep
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registered = list(REGISTRY)
+
+    def tearDown(self): # Metrics register themselves, so those created by a test are removed again
+        REGISTRY[:] = self.registered
+
+    def test_counter(self):
+        counter = Counter('test_total','A counter',labels=('name',))
+        counter.inc(('a',))
+        counter.inc(('a',),value=2)
+        counter.inc(('b "quoted"',))
+        self.assertEqual(counter.render(),['# HELP test_total A counter',
+                                           '# TYPE test_total counter',
+                                           'test_total{name="a"} 3.0',
+                                           'test_total{name="b \\"quoted\\""} 1.0'])
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds','A histogram',buckets=(0.1,1.0))
+        for value in (0.05,0.5,0.5,5.0):
+            histogram.observe(value)
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1',lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 3',lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4',lines)
+        self.assertIn('test_seconds_sum 6.05',lines)
+        self.assertIn('test_seconds_count 4',lines)
+
+    def test_timer(self):
+        histogram = Histogram('test_seconds','A histogram')
+        with histogram.time(('stage',)):
+            sleep(0.01)
+        self.assertEqual(histogram.values[('stage',)][2],1)
+        self.assertGreaterEqual(histogram.values[('stage',)][1],0.01)
+
+    # Only the time spent producing the items is observed, once the iterator is exhausted or closed
+    def test_time_iter(self):
+        histogram = Histogram('test_seconds','A histogram')
+        def produce():
+            for i in range(3):
+                sleep(0.01)
+                yield i
+        items = histogram.time_iter(produce(),('stage',))
+        for item in items:
+            sleep(0.05) # Consuming the items is not timed
+        total = histogram.values[('stage',)][1]
+        self.assertGreaterEqual(total,0.03)
+        self.assertLess(total,0.15)
+
+        items = histogram.time_iter(produce(),('closed',))
+        next(items)
+        items.close() # E.g. when the client of a streamed response disconnects
+        self.assertEqual(histogram.values[('closed',)][2],1)
+
+    def test_endpoint(self):
+        client   = launch.orb.test_client()
+        response = client.get('/scry/metrics',environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        self.assertEqual(response.status_code,200)
+        self.assertIn('# TYPE scry_stage_seconds histogram',response.get_data())
+        self.assertEqual(client.get('/scry/metrics',environ_base={'REMOTE_ADDR':'192.0.2.1'}).status_code,500)
+
+
+if __name__ == '__main__':
+    unittest.main()
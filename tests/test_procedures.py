@@ -0,0 +1,165 @@
+import unittest
+
+import services.classes
+
+from services.classes import Procedure, Argument, PROCEDURE_CACHE, get_io_pool
+from cache            import CostAwareCache
+from utility          import SCRYError, assert_dir
+
+from rdflib           import Namespace
+from rdflib.term      import Literal
+from threading        import Lock, Event, Thread
+from os               import fork, waitpid, _exit, WEXITSTATUS
+from os.path          import join, isdir
+from tempfile         import mkdtemp
+from shutil           import rmtree
+
+TEST = Namespace('http://www.scry.com/test/')
+
+
+# Doubles its (integer) input, recording every input it was executed for
+class DoublingProcedure(Procedure):
+
+    def __init__(self,name='double',**kwargs):
+        super(DoublingProcedure,self).__init__(TEST[name],
+                                               author      = "SCRY tests",
+                                               description = "Doubles its input",
+                                               provenance  = "tests/test_procedures.py",
+                                               version     = '1.0',
+                                               **kwargs)
+        self.executed = list()
+        self.lock     = Lock()
+        self.add_input(Argument('in',TEST['argument/in'],description="An integer"),required=True,default=True)
+        self.add_output(Argument('out',TEST['argument/out'],description="Twice the input"),default=True)
+
+    def execute(self,input_dict,expected_outputs,handler):
+        with self.lock:
+            self.executed.append(input_dict['in'].toPython())
+        return {'out':Literal(input_dict['in'].toPython() * 2)}
+
+### END OF DoublingProcedure
+
+
+def inputs(*values):
+    return [{'in':Literal(v)} for v in values]
+
+def values(outputs):
+    return [o['out'].toPython() for o in outputs]
+
+
+class TestBatchInvocation(unittest.TestCase):
+
+    def test_batches_match_single_invocations(self):
+        proc = DoublingProcedure()
+        self.assertEqual(values(proc.invoke_batch(inputs(1,2,3),['out'],None)),[2,4,6])
+        self.assertEqual(proc.invoke(inputs(4)[0],['out'],None)['out'].toPython(),8)
+        self.assertEqual(proc.invoke_batch([],['out'],None),[])
+
+    # The invocations of an I/O-bound procedure's batch run concurrently, but their outputs keep the inputs' order
+    def test_io_bound_batches(self):
+        proc    = DoublingProcedure(io_bound=True)
+        release = Event()
+        execute = proc.execute
+        def wait_for_others(input_dict,expected_outputs,handler):
+            if input_dict['in'].toPython() == 1:
+                release.wait(5) # Only released once the invocation for 2 ran, which requires them to be concurrent
+            else:
+                release.set()
+            return execute(input_dict,expected_outputs,handler)
+        proc.execute = wait_for_others
+        self.assertEqual(values(proc.invoke_batch(inputs(1,2),['out'],None)),[2,4])
+        self.assertEqual(proc.executed,[2,1])
+
+    def test_batches_must_return_an_output_per_input(self):
+        proc = DoublingProcedure()
+        proc.execute_batch = lambda input_dicts, expected_outputs, handler: list()
+        self.assertRaises(SCRYError,proc.invoke_batch,inputs(1),['out'],None)
+
+    # Threads do not survive fork(), so a forked worker process gets a pool of its own
+    def test_io_pool_after_fork(self):
+        pool = get_io_pool()
+        self.assertIs(get_io_pool(),pool)
+        pid = fork()
+        if pid == 0:
+            try:
+                _exit(0 if get_io_pool() is not pool and values(DoublingProcedure(io_bound=True).invoke_batch(inputs(1,2),['out'],None)) == [2,4] else 1)
+            finally:
+                _exit(2)
+        self.assertEqual(WEXITSTATUS(waitpid(pid,0)[1]),0)
+        self.assertIs(services.classes.IO_POOL,pool)
+
+    # I/O-bound procedures may create the same (cache) directories concurrently
+    def test_concurrent_directory_creation(self):
+        root    = mkdtemp()
+        path    = join(root,'a','b','c')
+        errors  = list()
+        def create():
+            try:
+                assert_dir(path)
+            except OSError as e:
+                errors.append(e)
+        try:
+            threads = [Thread(target=create) for i in range(8)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            self.assertEqual(errors,list())
+            self.assertTrue(isdir(path))
+        finally:
+            rmtree(root)
+
+
+
+class TestMemoization(unittest.TestCase):
+
+    def setUp(self):
+        PROCEDURE_CACHE.clear()
+
+    def test_identical_invocations_are_executed_once(self):
+        proc = DoublingProcedure(memoize=True)
+        self.assertEqual(values(proc.invoke_batch(inputs(1,2,1),['out'],None)),[2,4,2])
+        self.assertEqual(values(proc.invoke_batch(inputs(2,3),['out'],None)),[4,6])
+        self.assertEqual(sorted(proc.executed),[1,2,3])
+
+    def test_new_cache_versions_miss(self):
+        proc = DoublingProcedure(memoize=True)
+        proc.invoke(inputs(1)[0],['out'],None)
+        proc.version = '1.1'
+        proc.invoke(inputs(1)[0],['out'],None)
+        self.assertEqual(proc.executed,[1,1])
+
+    def test_procedures_are_only_memoized_if_asked_to(self):
+        proc = DoublingProcedure()
+        proc.invoke(inputs(1)[0],['out'],None)
+        proc.invoke(inputs(1)[0],['out'],None)
+        self.assertEqual(proc.executed,[1,1])
+        self.assertEqual(len(PROCEDURE_CACHE),0)
+
+
+class TestCostAwareCache(unittest.TestCase):
+
+    def test_costly_entries_are_kept_longest(self):
+        cache = CostAwareCache(30)
+        cache.put('cheap',1,cost=1,size=10)
+        cache.put('costly',2,cost=100,size=10)
+        cache.put('other',3,cost=1,size=10)
+        cache.put('new',4,cost=1,size=10)
+        self.assertIsNone(cache.get('cheap'))
+        self.assertEqual(cache.get('costly'),2)
+        self.assertEqual(cache.size,30)
+
+    def test_unused_entries_eventually_lose_out(self):
+        cache = CostAwareCache(20)
+        cache.put('costly',1,cost=5,size=10)
+        for i in range(20): # Every eviction raises the priority of newer entries, until they outrank the unused one
+            cache.put(i,i,cost=1,size=10)
+            cache.get(i)
+        self.assertIsNone(cache.get('costly'))
+
+    def test_oversized_values_are_not_kept(self):
+        cache = CostAwareCache(10)
+        cache.put('a',1,cost=1,size=11)
+        self.assertEqual(len(cache),0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+import launch
+import profiler
+
+from test_query import QueryTestCase, QUERIES, ACCEPTED, parse_solutions
+
+from threading import current_thread
+from pstats    import Stats
+from os        import listdir
+from os.path   import join
+from tempfile  import mkdtemp
+from shutil    import rmtree
+
+
+class TestProfiler(QueryTestCase):
+
+    def setUp(self):
+        super(TestProfiler,self).setUp()
+        self.profile_dir     = profiler.PROFILE_DIR
+        profiler.PROFILE_DIR = mkdtemp()
+
+    def tearDown(self):
+        super(TestProfiler,self).tearDown()
+        rmtree(profiler.PROFILE_DIR)
+        profiler.PROFILE_DIR = self.profile_dir
+
+    def post(self,query,**request):
+        response = self.client.post('/scry/',data=dict(query=query,**request.pop('data',dict())),
+                                    headers=dict({'Accept':ACCEPTED['csv']},**request.pop('headers',dict())),
+                                    environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        self.assertEqual(response.status_code,200)
+        return parse_solutions(response.get_data(),'csv')
+
+    # Returns the paths of the saved profiles, without their extensions
+    def saved_profiles(self):
+        paths = list()
+        for date in listdir(profiler.PROFILE_DIR):
+            paths.extend(join(profiler.PROFILE_DIR,date,name) for name in listdir(join(profiler.PROFILE_DIR,date)))
+        return sorted(paths)
+
+    def test_profiled_queries(self):
+        for request in ({'data':{'profile':'true'}},{'headers':{'X-SCRY-Profile':'1'}}):
+            self.assertEqual(self.post(QUERIES['chain'],**request),self.resolve(QUERIES['chain']))
+        paths = self.saved_profiles()
+        self.assertEqual(len(paths),4)
+        self.assertEqual(sorted(set(p.rsplit('.',1)[1] for p in paths)),['collapsed','pstats'])
+        stats = Stats(paths[1])
+        self.assertTrue(any(name == 'resolve' for _, _, name in stats.stats))
+
+    def test_profiling_is_on_request(self):
+        self.post(QUERIES['single'])
+        self.post(QUERIES['single'],data={'profile':'false'})
+        self.post(QUERIES['single'],headers={'X-SCRY-Profile':'no'})
+        self.assertEqual(self.saved_profiles(),list())
+
+    def test_sampled_stacks(self):
+        sampler = profiler.StackSampler(current_thread(),1)
+        sampler.sample()
+        stack, = sampler.stacks.keys()
+        self.assertTrue(stack.endswith('sample (profiler.py:%d)' % profiler.StackSampler.sample.im_func.func_code.co_firstlineno))
+        self.assertIn(';test_sampled_stacks (test_profiler.py:',stack)
+
+### END OF TestProfiler
+
+
+if __name__ == '__main__':
+    unittest.main()
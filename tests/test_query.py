@@ -0,0 +1,284 @@
+import unittest
+
+import launch
+import query_handler
+import flask
+
+from query_handler    import QueryHandler, OrbDescriptionUnion, SCRY
+from streaming        import iter_rows
+from services.classes import Procedure, Argument
+from utility          import SCRYError
+
+from rdflib           import Namespace, Variable
+from rdflib.query     import Result
+from rdflib.term      import Literal, BNode
+from rdflib.graph     import ConjunctiveGraph, Graph, ModificationException
+from xml.etree        import ElementTree
+from cStringIO        import StringIO
+from csv              import reader
+from json             import loads
+
+TEST     = Namespace('http://www.scry.com/test/')
+PREFIXES = 'PREFIX scry: <http://www.scry.com/> PREFIX test: <http://www.scry.com/test/> '
+VALUES   = 'VALUES ?x { "a" "b" "c" } '
+ACCEPTED = {'csv' : 'text/csv',
+            'xml' : 'application/sparql-results+xml'}
+RESULTS  = '{http://www.w3.org/2005/sparql-results#}'
+
+QUERIES  = {'chain'  : PREFIXES + 'SELECT ?x ?y ?z WHERE { ' + VALUES +
+                       'GRAPH ?a { test:fan scry:input ?x ; scry:output ?y . } '
+                       'GRAPH ?b { test:fan2 scry:input ?y ; scry:output ?z . } }',
+            'single' : PREFIXES + 'SELECT ?y WHERE { test:fan scry:input "a" ; scry:output ?y . }',
+            'values' : PREFIXES + 'SELECT ?x ?y WHERE { ' + VALUES + 'test:fan scry:input ?x ; scry:output ?y . }',
+            'bind'   : PREFIXES + 'SELECT ?x ?b ?y WHERE { ' + VALUES + 'BIND(CONCAT(?x,"!") AS ?b) '
+                       'GRAPH ?g { test:fan scry:input ?b ; scry:output ?y . } }',
+            'filter' : PREFIXES + 'SELECT ?x ?y WHERE { ' + VALUES +
+                       'GRAPH ?g { test:fan scry:input ?x ; scry:output ?y . } FILTER(?x != "b") }',
+            'empty'  : PREFIXES + 'SELECT ?x ?y ?z WHERE { ' + VALUES +
+                       'GRAPH ?a { test:none scry:input ?x ; scry:output ?y . } '
+                       'GRAPH ?b { test:fan2 scry:input ?y ; scry:output ?z . } }',
+            'merged' : PREFIXES + 'SELECT ?x ?y WHERE { ' + VALUES +
+                       'test:fan scry:input ?x ; scry:output ?y . FILTER(?x != "b") }',
+            'orb'    : PREFIXES + 'SELECT ?proc WHERE { GRAPH scry:orb_description { ?proc a scry:procedure . } }'}
+
+
+# Generates 'fanout' solutions for every input, with an output derived from the input
+class FanoutProcedure(Procedure):
+
+    def __init__(self,name,fanout):
+        super(FanoutProcedure,self).__init__(TEST[name],
+                                             author      = "SCRY tests",
+                                             description = "Generates %i outputs per input" % fanout,
+                                             provenance  = "tests/test_query.py",
+                                             version     = '1.0')
+        self.fanout = fanout
+        self.add_input(Argument('in',TEST['argument/in'],description="Any RDF node"),required=True,default=True)
+        self.add_output(Argument('out',TEST['argument/out'],description="A Literal derived from the input"),default=True)
+
+    def execute(self,input_dict,expected_outputs,handler):
+        return [{'out':Literal(u'%s.%i' % (input_dict['in'],i))} for i in xrange(self.fanout)]
+
+### END OF FanoutProcedure
+
+
+def set_procedures():
+    service_config = dict()
+    for proc in (FanoutProcedure('fan',3),FanoutProcedure('fan2',3),FanoutProcedure('none',0)):
+        proc.assert_validity()
+        service_config[proc.uri] = proc
+    launch.set_services(service_config)
+
+# Returns the solutions of a CSV or XML serialized result as a sorted list, so results can be compared whatever
+# the order of their rows (or of the bindings within them)
+def parse_solutions(body,fmt):
+    if fmt == 'csv':
+        rows = list(reader(StringIO(body)))
+        return sorted(tuple(sorted((v,x) for v, x in zip(rows[0],row) if x)) for row in rows[1:])
+    solutions = list()
+    for result in ElementTree.fromstring(body).iter(RESULTS + 'result'):
+        solutions.append(tuple(sorted((b.get('name'),''.join(b.itertext()).strip()) for b in result)))
+    return sorted(solutions)
+
+
+# Compares the results of the same queries resolved with different settings of query_handler
+class QueryTestCase(unittest.TestCase):
+
+    SETTINGS = ('STREAM_RESULTS','FAST_PATH','PIPELINE_BINDINGS','PIPELINE_BATCH_ROWS','PIPELINE_BUFFER_ROWS','SERVICE_WORKERS')
+
+    def setUp(self):
+        self.settings = dict((name,getattr(query_handler,name)) for name in self.SETTINGS)
+        self.client   = launch.orb.test_client()
+        set_procedures()
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(query_handler,name,value)
+
+    def resolve(self,query,fmt='csv',**settings):
+        for name, value in settings.items():
+            setattr(query_handler,name,value)
+        query_handler.RESPONSE_CACHE.clear()
+        response = self.client.post('/scry/',data={'query':query},headers={'Accept':ACCEPTED[fmt]},
+                                    environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        body = response.get_data()
+        self.assertEqual(response.status_code,200,body)
+        return parse_solutions(body,fmt)
+
+    def explain(self,query,accept='application/json',**settings):
+        for name, value in settings.items():
+            setattr(query_handler,name,value)
+        response = self.client.post('/scry/',data={'query':query,'explain':'true'},headers={'Accept':accept},
+                                    environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        self.assertEqual(response.mimetype,'application/json')
+        return loads(response.get_data())
+
+    def assertSameResults(self,settings,other):
+        for name, query in sorted(QUERIES.items()):
+            for fmt in ACCEPTED:
+                self.assertEqual(self.resolve(query,fmt,**settings),self.resolve(query,fmt,**other),'%s (%s)' % (name,fmt))
+
+### END OF QueryTestCase
+
+
+class TestStreaming(QueryTestCase):
+
+    def test_streamed_results_match_serialized_ones(self):
+        for fast_path in (True,False):
+            self.assertSameResults({'STREAM_RESULTS':True ,'FAST_PATH':fast_path},
+                                   {'STREAM_RESULTS':False,'FAST_PATH':fast_path})
+
+    def test_result_sizes(self):
+        self.assertEqual(len(self.resolve(QUERIES['chain'])),27)
+        self.assertEqual(len(self.resolve(QUERIES['filter'])),6)
+        self.assertEqual(len(self.resolve(QUERIES['empty'])),0)
+
+    def test_streamed_rows_are_not_kept(self):
+        result = Result('SELECT')
+        result.vars         = [Variable('x')]
+        result._genbindings = iter([{Variable('x'):Literal(i)} for i in range(3)])
+        self.assertEqual(list(iter_rows(result)),[(Literal(i),) for i in range(3)])
+        self.assertFalse(result._bindings)
+
+    # The first chunk is serialized within resolve(), so errors evaluating the query are not sent as a truncated 200
+    def test_evaluation_errors_are_raised_with_the_first_chunk(self):
+        def solutions():
+            raise ValueError("Evaluation failed")
+            yield
+        qh                     = QueryHandler.__new__(QueryHandler) # Only the attributes stream_result() uses are set
+        qh.response_type       = 'text/csv'
+        qh.result              = Result('SELECT')
+        qh.result.vars         = [Variable('x')]
+        qh.result._genbindings = solutions()
+        self.assertRaises(ValueError,qh.stream_result)
+
+
+
+class TestFastPath(QueryTestCase):
+
+    def test_fast_path_results_match_evaluated_ones(self):
+        self.assertSameResults({'FAST_PATH':True},{'FAST_PATH':False})
+
+    def test_eligible_queries(self):
+        for name in ('single','values','orb'):
+            self.assertTrue(self.explain(QUERIES[name],FAST_PATH=True)['fast_path'],name)
+        for name in ('filter','chain'):
+            self.assertFalse(self.explain(QUERIES[name],FAST_PATH=True)['fast_path'],name)
+        self.assertFalse(self.explain(QUERIES['single'],FAST_PATH=False)['fast_path'])
+
+
+
+class TestPipelining(QueryTestCase):
+
+    def test_pipelined_results_match_sequential_ones(self):
+        self.assertSameResults({'PIPELINE_BINDINGS':True ,'SERVICE_WORKERS':4},
+                               {'PIPELINE_BINDINGS':False,'SERVICE_WORKERS':1})
+
+    # Single rows are passed on at a time, and producers may only run a row ahead of their consumers
+    def test_small_batches_and_buffers(self):
+        self.assertSameResults({'PIPELINE_BINDINGS':True ,'SERVICE_WORKERS':4,'PIPELINE_BATCH_ROWS':1,'PIPELINE_BUFFER_ROWS':1},
+                               {'PIPELINE_BINDINGS':False,'SERVICE_WORKERS':1})
+
+    def test_explain(self):
+        self.assertTrue(self.explain(QUERIES['chain'],PIPELINE_BINDINGS=True,SERVICE_WORKERS=4)['pipelined'])
+        self.assertFalse(self.explain(QUERIES['chain'],PIPELINE_BINDINGS=True,SERVICE_WORKERS=1)['pipelined'])
+
+
+
+class TestOrbDescription(QueryTestCase):
+
+    # Discovery queries which are not answered on the fast path are evaluated against the union of the request's graph and the description
+    def test_discovery_queries(self):
+        procedures = [(('proc',TEST[name].encode()),) for name in ('fan','fan2','none')]
+        optional   = PREFIXES + ('SELECT ?proc ?v WHERE { GRAPH scry:orb_description { ?proc a scry:procedure . '
+                                 'OPTIONAL { ?proc scry:version ?v } FILTER(STRSTARTS(STR(?proc),"http://www.scry.com/test/")) } }')
+        graphs     = PREFIXES + 'SELECT DISTINCT ?g WHERE { GRAPH ?g { ?s a scry:procedure } scry:orb scry:version ?v }' # Only queries using the orb see its description
+        orb        = PREFIXES + 'SELECT ?proc WHERE { scry:orb scry:procedure ?proc . FILTER(isIRI(?proc)) }'
+        for fast_path in (True,False):
+            self.assertEqual([tuple(p for p in row if p[0] == 'proc') for row in self.resolve(optional,FAST_PATH=fast_path)],procedures)
+            self.assertEqual(self.resolve(graphs,FAST_PATH=fast_path),[(('g',SCRY.orb_description.encode()),)])
+            self.assertEqual(self.resolve(orb,FAST_PATH=fast_path),procedures)
+
+    def test_solutions_and_description_together(self):
+        query = PREFIXES + ('SELECT ?x ?y ?proc WHERE { ' + VALUES + 'GRAPH ?g { test:fan scry:input ?x ; scry:output ?y . } '
+                            'GRAPH scry:orb_description { ?proc a scry:procedure } FILTER(?proc = test:none) }')
+        self.assertEqual(len(self.resolve(query,FAST_PATH=False)),9)
+
+    def test_union(self):
+        graph       = ConjunctiveGraph()
+        solution    = Graph(graph.store,BNode())
+        solution.add((TEST.a,TEST.b,TEST.c))
+        description = Graph(identifier=SCRY.orb_description)
+        description.add((SCRY.orb,SCRY.procedure,TEST.fan))
+        union = OrbDescriptionUnion(graph,description)
+        self.assertEqual(set(c.identifier for c in union.contexts()),set([solution.identifier,SCRY.orb_description]))
+        self.assertIs(union.get_context(SCRY.orb_description),description)
+        self.assertEqual(len(list(union.triples((None,None,None)))),2)
+        self.assertRaises(ModificationException,union.add,(TEST.a,TEST.b,TEST.d))
+        self.assertEqual(len(description),1) # Never copied into, or modified through, the union
+
+
+
+class TestExecutionPlan(QueryTestCase):
+
+    def test_steps_follow_the_dependencies(self):
+        steps = self.explain(QUERIES['chain'])['steps']
+        self.assertEqual([s['kind'] for s in steps],['ValuesHandler','CallHandler','CallHandler'])
+        self.assertEqual([s.get('procedure') for s in steps[1:]],[TEST.fan.encode(),TEST.fan2.encode()])
+        position = dict((s['handler'],i) for i, s in enumerate(steps))
+        for i, step in enumerate(steps):
+            self.assertTrue(all(position[dep] < i for dep in step['dependencies']))
+        self.assertEqual(steps[2]['joins'],[])
+        self.assertEqual(steps[2]['input_vars'],['y'])
+
+    def test_plans_are_reused(self):
+        query = QUERIES['bind'] + ' LIMIT 100' # Not yet compiled by another test
+        self.assertFalse(self.explain(query)['plan_reused'])
+        self.assertTrue(self.explain(query)['plan_reused'])
+        self.assertEqual(self.resolve(query),self.resolve(QUERIES['bind']))
+
+    # Explain is answered with JSON whatever the request accepts, and no services are invoked
+    def test_explain_ignores_content_negotiation(self):
+        self.assertEqual(self.explain(QUERIES['single'],accept='image/png')['query_type'],'SELECT')
+
+    def test_circular_dependencies_are_rejected(self):
+        query = PREFIXES + ('SELECT ?x ?y WHERE { GRAPH ?a { test:fan scry:input ?x ; scry:output ?y . } '
+                            'GRAPH ?b { test:fan2 scry:input ?y ; scry:output ?x . } }')
+        with launch.orb.test_request_context('/scry/',method='POST',data={'query':query},headers={'Accept':'text/csv'}):
+            qh = QueryHandler(flask.request,launch.ORB_GLOBALS)
+            self.assertRaises(SCRYError,qh.resolve)
+        self.assertIn('Circular',qh.output)
+
+
+
+class TestSolutionGraphs(QueryTestCase):
+
+    # Returns the contexts of the graph a query was resolved against which hold any triples
+    def resolve_contexts(self,query):
+        query_handler.FAST_PATH = False
+        with launch.orb.test_request_context('/scry/',method='POST',data={'query':query},headers={'Accept':'text/csv'}):
+            qh = QueryHandler(flask.request,launch.ORB_GLOBALS)
+            qh.resolve()
+        return [c for c in qh.graph.contexts() if len(c)]
+
+    # Without GRAPH ?variable patterns, all solutions and a single copy of their constant triples share a context
+    def test_solutions_share_a_context(self):
+        contexts = self.resolve_contexts(QUERIES['merged'])
+        self.assertEqual(len(contexts),1)
+        self.assertEqual(len(list(contexts[0].triples((TEST.fan,SCRY.input,None)))),3)
+        self.assertEqual(len(list(contexts[0].triples((TEST.fan,SCRY.output,None)))),9)
+
+    def test_graph_variables_get_a_context_per_solution(self):
+        contexts = self.resolve_contexts(QUERIES['filter'])
+        self.assertEqual(len(contexts),9)
+        for c in contexts:
+            self.assertEqual(len(list(c.triples((TEST.fan,SCRY.input,None)))),1)
+            self.assertEqual(len(list(c.triples((TEST.fan,SCRY.output,None)))),1)
+
+    # Without GRAPH patterns the query matches the union of the solutions, as it did when every solution had its own context
+    def test_results_match_the_union_of_the_solutions(self):
+        outputs = ['%s.%i' % (x,i) for x in 'abc' for i in range(3)]
+        self.assertEqual(self.resolve(QUERIES['merged'],FAST_PATH=False),[(('x',x),('y',y)) for x in 'ac' for y in outputs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+import launch
+import query_handler
+
+from services.classes import Procedure, Argument
+
+from rdflib           import Namespace
+from rdflib.term      import Literal
+
+TEST     = Namespace('http://www.scry.com/test/')
+PREFIXES = 'PREFIX scry: <http://www.scry.com/> PREFIX test: <http://www.scry.com/test/> '
+CALL     = PREFIXES + 'SELECT ?y WHERE { test:count scry:input "a" ; scry:output ?y . }'
+ORB      = PREFIXES + 'SELECT ?proc WHERE { GRAPH scry:orb_description { ?proc a scry:procedure . } }'
+
+
+# Returns its input, counting how often it was executed
+class CountingProcedure(Procedure):
+
+    def __init__(self,name,version='1.0',deterministic=True):
+        super(CountingProcedure,self).__init__(TEST[name],
+                                               author      = "SCRY tests",
+                                               description = "Counts its executions",
+                                               provenance  = "tests/test_response_cache.py",
+                                               version     = version)
+        self.deterministic = deterministic
+        self.executions    = 0
+        self.add_input(Argument('in',TEST['argument/in'],description="Any RDF node"),required=True,default=True)
+        self.add_output(Argument('out',TEST['argument/out'],description="The input"),default=True)
+
+    def execute(self,input_dict,expected_outputs,handler):
+        self.executions += 1
+        return {'out':input_dict['in']}
+
+### END OF CountingProcedure
+
+
+def set_procedures(*procs):
+    service_config = dict()
+    for proc in procs:
+        proc.assert_validity()
+        service_config[proc.uri] = proc
+    launch.set_services(service_config)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        query_handler.RESPONSE_CACHE.clear()
+        self.client = launch.orb.test_client()
+
+    # Streamed responses are only cached once they were sent in full, so their bodies are read right away
+    def query(self,query,**headers):
+        headers['Accept'] = 'text/csv'
+        response = self.client.post('/scry/',data={'query':query},headers=headers,environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        response.get_data()
+        return response
+
+    # Responses are only made conditional for GET requests
+    def get(self,query,**headers):
+        headers['Accept'] = 'text/csv'
+        response = self.client.get('/scry/',query_string={'query':query},headers=headers,environ_base={'REMOTE_ADDR':launch.IP_WHITELIST[0]})
+        response.get_data()
+        return response
+
+    def test_deterministic_responses_are_cached(self):
+        proc = CountingProcedure('count')
+        set_procedures(proc)
+        first  = self.query(CALL)
+        second = self.query(CALL)
+        third  = self.query(CALL)
+        self.assertEqual(proc.executions,1)
+        self.assertEqual(first.get_data(),second.get_data())
+        self.assertEqual(second.headers['ETag'],third.headers['ETag'])
+
+    def test_conditional_requests(self):
+        set_procedures(CountingProcedure('count'))
+        self.get(CALL)
+        etag = self.get(CALL).headers['ETag'] # Only cached responses have an ETag
+        self.assertEqual(self.get(CALL,**{'If-None-Match':etag}).status_code,304)
+        self.assertEqual(self.get(CALL,**{'If-None-Match':'"other"'}).status_code,200)
+
+    def test_new_procedure_versions_invalidate_responses(self):
+        proc = CountingProcedure('count')
+        set_procedures(proc)
+        self.query(CALL)
+        proc.version = '1.1'
+        self.query(CALL)
+        self.assertEqual(proc.executions,2)
+
+    def test_nondeterministic_responses_are_not_cached(self):
+        proc = CountingProcedure('count',deterministic=False)
+        set_procedures(proc)
+        self.query(CALL)
+        self.query(CALL)
+        self.assertEqual(proc.executions,2)
+
+    def test_resetting_the_services_invalidates_responses(self):
+        set_procedures(CountingProcedure('count'))
+        before = self.query(ORB).get_data()
+        set_procedures(CountingProcedure('count'),CountingProcedure('other'))
+        after  = self.query(ORB).get_data()
+        self.assertNotIn(TEST.other.encode(),before)
+        self.assertIn(TEST.other.encode(),after)
+
+
+if __name__ == '__main__':
+    unittest.main()
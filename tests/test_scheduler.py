@@ -0,0 +1,101 @@
+import unittest
+
+from scheduler       import DAGScheduler
+from context_handler import ContextHandler
+from utility         import SCRYError
+
+from threading       import Lock, Event
+
+
+# Records the order in which handlers were executed; a handler given an 'event' waits for it to be set, and one
+# given a 'starts' event sets it once it is executed
+class RecordingHandler(ContextHandler):
+
+    def __init__(self,name,log,dependencies=(),event=None,starts=None,fail=False):
+        super(RecordingHandler,self).__init__(None)
+        self.name         = name
+        self.log          = log
+        self.dependencies = set(dependencies)
+        self.event        = event
+        self.starts       = starts
+        self.fail         = fail
+
+    def execute(self):
+        if self.starts is not None:
+            self.starts.set()
+        if self.event is not None and not self.event.wait(5):
+            raise RuntimeError("%s waited in vain" % self.name)
+        if self.fail:
+            raise ValueError("%s failed" % self.name)
+        with self.log[0]:
+            self.log[1].append(self.name)
+        self.executed = True
+
+### END OF RecordingHandler
+
+
+class TestDAGScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.log = (Lock(),list())
+
+    def handler(self,name,*dependencies,**kwargs):
+        return RecordingHandler(name,self.log,dependencies,**kwargs)
+
+    # a <- b <- d, a <- c <- d, with 'e' independent of all others
+    def diamond(self):
+        a = self.handler('a')
+        b = self.handler('b',a)
+        c = self.handler('c',a)
+        d = self.handler('d',b,c)
+        e = self.handler('e')
+        return [d,c,e,b,a]
+
+    def assertRespectsDependencies(self,handlers):
+        order = self.log[1]
+        self.assertEqual(sorted(order),sorted(h.name for h in handlers))
+        for h in handlers:
+            for dep in h.dependencies:
+                self.assertLess(order.index(dep.name),order.index(h.name))
+
+    def test_sequential(self):
+        handlers = self.diamond()
+        DAGScheduler(handlers).run()
+        self.assertRespectsDependencies(handlers)
+
+    def test_parallel(self):
+        handlers = self.diamond()
+        DAGScheduler(handlers,workers=4).run()
+        self.assertRespectsDependencies(handlers)
+
+    def test_independent_handlers_run_concurrently(self):
+        started = Event()
+        first   = self.handler('first',event=started) # Waits until 'second' is running
+        second  = self.handler('second',starts=started)
+        DAGScheduler([first,second],workers=2).run()
+        self.assertEqual(self.log[1],['second','first'])
+
+    def test_executed_handlers_are_skipped(self):
+        handlers = self.diamond()
+        handlers[-1].executed = True # 'a'
+        DAGScheduler(handlers,workers=4).run()
+        self.assertNotIn('a',self.log[1])
+
+    def test_cycles_are_rejected(self):
+        a = self.handler('a')
+        b = self.handler('b',a)
+        a.dependencies.add(b)
+        for workers in (1,4):
+            self.assertRaises(SCRYError,DAGScheduler([a,b],workers=workers).run)
+
+    def test_failures_are_raised_and_stop_dependents(self):
+        a = self.handler('a',fail=True)
+        b = self.handler('b',a)
+        c = self.handler('c')
+        for workers in (1,4):
+            self.assertRaises(ValueError,DAGScheduler([a,b,c],workers=workers).run)
+            self.assertNotIn('b',self.log[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import launch
+import query_handler
+
+from server     import PoolWSGIServer, QuietRequestHandler
+from test_query import QUERIES, ACCEPTED, set_procedures, parse_solutions
+
+from threading  import Thread
+from urllib     import urlencode
+from urllib2    import urlopen, Request
+
+
+# Serves the orb on a free local port with the production server's thread pool, in the test's own process
+class TestPoolServer(unittest.TestCase):
+
+    def setUp(self):
+        set_procedures()
+        launch.IP_WHITELIST.append('127.0.0.1')
+        self.server = PoolWSGIServer(('127.0.0.1',0),QuietRequestHandler,4)
+        self.server.set_app(launch.orb)
+        self.server.start_threads()
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url    = 'http://127.0.0.1:%i/scry/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        launch.IP_WHITELIST.remove('127.0.0.1')
+
+    def query(self,name):
+        request = Request(self.url,urlencode({'query':QUERIES[name]}),{'Accept':ACCEPTED['csv']})
+        return parse_solutions(urlopen(request,timeout=30).read(),'csv')
+
+    # Requests served concurrently by the pool's threads share the orb's globals, but none of their state
+    def test_concurrent_queries(self):
+        names    = ['chain','filter','values','orb'] * 4
+        expected = dict((name,self.query(name)) for name in set(names))
+        results  = [None] * len(names)
+        query_handler.RESPONSE_CACHE.clear() # So the queries are resolved again, rather than answered from the cache
+        def run(i):
+            results[i] = self.query(names[i])
+        threads = [Thread(target=run,args=(i,)) for i in range(len(names))]
+        for t in threads: t.start()
+        for t in threads: t.join(60)
+        self.assertEqual(results,[expected[name] for name in names])
+        self.assertEqual(len(expected['chain']),27)
+
+### END OF TestPoolServer
+
+
+if __name__ == '__main__':
+    unittest.main()
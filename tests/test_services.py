@@ -0,0 +1,51 @@
+import unittest
+
+import services
+
+from services.classes import Procedure
+from rdflib.term      import URIRef
+from tempfile         import mkdtemp
+from shutil           import rmtree
+from os.path          import join
+
+
+# Stands in for procedures whose cached outputs depend on data outside of their source, like services.BLAST's
+class FingerprintedProcedure(Procedure):
+    def get_cache_version(self):
+        return '%s+fingerprint' % self.version
+
+
+class TestLazyProcedures(unittest.TestCase):
+
+    def setUp(self):
+        self.dir      = mkdtemp()
+        self.config   = join(self.dir,'registered_modules.txt')
+        self.manifest = join(self.dir,'service_manifest.json')
+        with open(self.config,'w') as f:
+            f.write('services.MATH.basic\n')
+        self.eager = services.load_procedures(self.config,self.manifest) # Writes the manifest
+        self.lazy  = services.load_procedures(self.config,self.manifest,lazy=True)
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_procedures_are_registered_from_the_manifest(self):
+        self.assertEqual(set(self.lazy),set(self.eager))
+        for uri, proc in self.lazy.items():
+            self.assertIsInstance(proc,services.LazyProcedure)
+            self.assertEqual(proc.version,self.eager[uri].version)
+            self.assertEqual(proc.deterministic,self.eager[uri].deterministic)
+
+    def test_cache_versions_do_not_import_modules(self):
+        for uri, proc in self.lazy.items():
+            self.assertEqual(proc.get_cache_version(),self.eager[uri].get_cache_version())
+            self.assertIsNone(proc.procedure)
+
+    def test_overridden_cache_versions_are_not_stored(self):
+        proc = FingerprintedProcedure(URIRef('http://www.scry.com/test/fingerprinted'),author='',description='',provenance='',version='1.0')
+        self.assertIsNone(services.describe_procedure(proc)['cache_version'])
+        self.assertEqual(services.describe_procedure(self.eager.values()[0])['cache_version'],self.eager.values()[0].version)
+
+
+if __name__ == '__main__':
+    unittest.main()
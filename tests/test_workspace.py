@@ -0,0 +1,97 @@
+import unittest
+
+from workspace import WorkspacePool
+from utility   import SCRYError
+
+from os        import listdir, stat, mkdir
+from os.path   import join, isdir, exists, sep
+from tempfile  import mkdtemp
+from shutil    import rmtree
+from stat      import S_IMODE
+from time      import time, sleep
+
+
+def write(path,size):
+    with open(path,'w') as f:
+        f.write('x' * size)
+
+# Waits for the reaper to process released workspaces
+def wait_for(condition,timeout=5):
+    end = time() + timeout
+    while not condition():
+        if time() > end:
+            raise AssertionError("Timed out")
+        sleep(0.01)
+
+
+class TestWorkspacePool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.pool = WorkspacePool(join(self.root,'scry'),size=1,query_quota=1000,total_quota=10000,max_age=3600,interval=3600)
+
+    def tearDown(self):
+        self.pool.close()
+        rmtree(self.root,ignore_errors=True)
+
+    def test_workspaces_are_private(self):
+        path = self.pool.acquire()
+        self.assertTrue(path.startswith(self.pool.root + sep))
+        for p in (self.pool.parent,self.pool.root,path):
+            self.assertEqual(S_IMODE(stat(p).st_mode),0700)
+
+    def test_released_workspaces_are_emptied_and_reused(self):
+        path = self.pool.acquire()
+        write(join(path,'file'),10)
+        mkdir(join(path,'dir'))
+        self.pool.release(path)
+        wait_for(lambda: self.pool.idle)
+        self.assertEqual(self.pool.acquire(),path)
+        self.assertEqual(listdir(path),[])
+
+    def test_only_a_limited_number_are_kept(self):
+        paths = [self.pool.acquire() for i in range(3)]
+        for path in paths:
+            self.pool.release(path)
+        wait_for(lambda: sum(exists(p) for p in paths) == 1)
+        self.assertEqual(len(self.pool.idle),1)
+
+    def test_query_quota(self):
+        first = self.pool.acquire()
+        write(join(first,'file'),600)
+        second = self.pool.acquire([first])
+        write(join(second,'file'),600)
+        self.assertRaises(SCRYError,self.pool.acquire,[first,second])
+
+    def test_workspaces_go_on_disk_beyond_the_total_quota(self):
+        path = self.pool.acquire()
+        write(join(path,'file'),20000)
+        self.pool.sweep()
+        spill = self.pool.acquire()
+        self.assertFalse(spill.startswith(self.pool.root + sep))
+        self.pool.release(spill)
+        wait_for(lambda: not exists(spill))
+
+    def test_sweeps_reclaim_stale_leases(self):
+        path = self.pool.acquire()
+        self.pool.max_age = 0
+        sleep(0.01)
+        self.pool.sweep()
+        self.assertNotIn(path,self.pool.leases)
+        self.assertEqual(self.pool.idle,[path])
+
+    def test_sweeps_remove_the_workspaces_of_dead_processes(self):
+        dead = join(self.pool.parent,'999999999') # Beyond any pid the kernel hands out
+        mkdir(dead)
+        self.pool.sweep()
+        self.assertFalse(exists(dead))
+
+    def test_close_removes_the_workspaces(self):
+        self.pool.acquire()
+        self.pool.close()
+        self.assertFalse(self.pool.reaper.is_alive())
+        self.assertFalse(isdir(self.pool.root))
+
+
+if __name__ == '__main__':
+    unittest.main()
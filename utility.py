@@ -2,7 +2,9 @@ from werkzeug.exceptions import HTTPException
 
 from os                  import mkdir
 from os.path             import sep, isdir, dirname
+from errno               import EEXIST
 
+# Creates a directory and any missing parents; safe to call concurrently for the same path (e.g. from io_bound procedures)
 def assert_dir(path):
     to_add = list()
     if path.endswith(sep): path = path[:-1]
@@ -12,7 +14,11 @@ def assert_dir(path):
     for i in xrange(len(to_add)):
         path = to_add.pop()
         print 'Making new directory: %s' % (path)
-        mkdir(path)
+        try:
+            mkdir(path)
+        except OSError as e:
+            if e.errno != EEXIST or not isdir(path):
+                raise # Unless another thread or process created it in the meantime
         
 class SCRYError(HTTPException):
     def __init__(self,desc):
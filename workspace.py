@@ -0,0 +1,213 @@
+from __init__  import WORKSPACE_ROOT, WORKSPACE_POOL_SIZE, WORKSPACE_QUERY_QUOTA, WORKSPACE_TOTAL_QUOTA, WORKSPACE_MAX_AGE, WORKSPACE_REAP_INTERVAL
+from utility   import SCRYError
+
+from os        import mkdir, listdir, remove, walk, getpid, kill, access, W_OK
+from os.path   import join, isdir, islink, getsize, dirname, sep
+from shutil    import rmtree
+from tempfile  import mkdtemp, gettempdir
+from threading import Thread, Lock
+from Queue     import Queue, Empty
+from errno     import ESRCH, EEXIST
+from time      import time
+from atexit    import register
+
+
+# Scratch directories for procedures (see QueryHandler.get_temp_dir), leased from a pool of reusable directories on
+# RAM-backed storage (WORKSPACE_ROOT, e.g. /dev/shm/scry), rather than created with mkdtemp() and rmtree()'d for every call.
+# Released directories are emptied by a background thread, which keeps up to WORKSPACE_POOL_SIZE of them for reuse, so a
+# request only ever pops a directory from the pool (or creates one) and hands it back. The same thread periodically:
+#  - reclaims directories leased longer than WORKSPACE_MAX_AGE seconds, whose requests presumably failed before cleaning up
+#  - removes the directories of processes which no longer exist (e.g. crashed workers of the production server)
+#  - measures how much space the leased directories take up
+# A query may use at most WORKSPACE_QUERY_QUOTA bytes: asking for another directory beyond that raises a SCRYError. To keep
+# requests from walking all their directories on every lease, only the most recently leased one is measured then; the others
+# count with their size as of that measurement or the last sweep. While
+# all workspaces together take up more than WORKSPACE_TOTAL_QUOTA bytes, new ones are created on disk instead, to keep
+# procedures from exhausting the machine's memory.
+
+# Workspaces hold the inputs and outputs of the users' queries, so like mkdtemp()'s they are only accessible to the
+# orb's own user -- as are the directories holding them, as WORKSPACE_ROOT is usually in a world-writable directory
+#
+# Every process has a pool of its own (in a subdirectory named after its pid), created on first use and again after a fork
+POOL      = None
+POOL_LOCK = Lock()
+
+def get_workspace_pool():
+    global POOL
+    with POOL_LOCK:
+        if POOL is None or POOL.pid != getpid():
+            POOL = WorkspacePool(get_root(WORKSPACE_ROOT),WORKSPACE_POOL_SIZE,WORKSPACE_QUERY_QUOTA,
+                                 WORKSPACE_TOTAL_QUOTA,WORKSPACE_MAX_AGE,WORKSPACE_REAP_INTERVAL)
+        return POOL
+
+# Stops the reaper and removes the process' workspaces when it exits, rather than leaving the reaper running while the
+# interpreter tears down its modules. Processes which exit through os._exit() skip this: the production server removes
+# the workspaces of its workers once they exit, and otherwise those of dead processes are removed by any pool's sweep.
+@register
+def close_workspace_pool():
+    with POOL_LOCK:
+        pool = POOL
+    if pool is not None and pool.pid == getpid(): # Forked children must not remove the pool of their parent
+        pool.close()
+
+def remove_workspaces(pid):
+    rmtree(join(get_root(WORKSPACE_ROOT),str(pid)),ignore_errors=True)
+
+# Falls back on the system's temporary directory if the configured root can not be used (e.g. there is no /dev/shm)
+def get_root(root):
+    parent = dirname(root.rstrip(sep))
+    if isdir(root) and access(root,W_OK) or isdir(parent) and access(parent,W_OK):
+        return root
+    return join(gettempdir(),'scry-workspaces')
+
+def make_private_dir(path):
+    try:
+        mkdir(path,0700)
+    except OSError as e:
+        if e.errno != EEXIST or not isdir(path):
+            raise # Unless another process created it in the meantime
+
+def dir_size(path):
+    size = 0
+    for dir_path, dir_names, file_names in walk(path):
+        for name in file_names:
+            file_path = join(dir_path,name)
+            if not islink(file_path):
+                try:
+                    size += getsize(file_path)
+                except OSError:
+                    pass # Removed while walking
+    return size
+
+def empty_dir(path):
+    for name in listdir(path):
+        sub_path = join(path,name)
+        if isdir(sub_path) and not islink(sub_path):
+            rmtree(sub_path,ignore_errors=True)
+        else:
+            remove(sub_path)
+
+def is_running(pid):
+    try:
+        kill(pid,0)
+    except OSError as e:
+        return e.errno != ESRCH
+    return True
+
+
+class WorkspacePool(object):
+
+    def __init__(self,root,size,query_quota,total_quota,max_age,interval):
+        self.pid         = getpid()
+        self.parent      = root                     # The directory holding the pools of all processes
+        self.root        = join(root,str(self.pid)) # The directory holding this process' workspaces
+        self.size        = size                     # The maximum number of idle workspaces kept for reuse
+        self.query_quota = query_quota              # The maximum number of bytes a query's workspaces may take up
+        self.total_quota = total_quota              # The number of bytes all workspaces may take up, before new ones are created on disk
+        self.max_age     = max_age                  # The number of seconds after which leased workspaces are reclaimed
+        self.interval    = interval                 # The number of seconds between the reaper's sweeps
+        self.idle        = list()                   # Empty workspaces, ready to be leased
+        self.leases      = dict()                   # Leased workspaces pointing to the time they were leased
+        self.sizes       = dict()                   # Leased workspaces pointing to the number of bytes they took up when last measured
+        self.released    = Queue()                  # Released workspaces, waiting to be emptied by the reaper
+        self.usage       = 0                        # The number of bytes taken up by the leased workspaces under 'root', as of the last sweep
+        self.count       = 0                        # The number of workspaces created under 'root', used to name them
+        self.lock        = Lock()
+        make_private_dir(self.parent)
+        make_private_dir(self.root)
+        self.reaper      = Thread(target=self.reap,name='scry-workspace-reaper') # Empties released workspaces, and sweeps periodically
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    # Returns the path of an empty workspace; 'leased' are the paths of the workspaces the query already holds
+    def acquire(self,leased=()):
+        if leased:
+            latest = leased[-1]
+            size   = dir_size(latest)
+            with self.lock:
+                if latest in self.leases:
+                    self.sizes[latest] = size
+                used = size + sum(self.sizes.get(path,0) for path in leased[:-1])
+            if used > self.query_quota:
+                raise SCRYError("This query's procedures exceeded their scratch space quota (%i of %i bytes used)." % (used,self.query_quota))
+        with self.lock:
+            if self.usage > self.total_quota:
+                path = mkdtemp(prefix='scry-')
+            elif self.idle:
+                path = self.idle.pop()
+            else:
+                self.count += 1
+                path = join(self.root,'ws-%i' % self.count)
+                make_private_dir(path)
+            self.leases[path] = time()
+        return path
+
+    def release(self,path):
+        with self.lock:
+            self.sizes.pop(path,None)
+            if self.leases.pop(path,None) is None:
+                return # Already reclaimed by the reaper
+        self.released.put(path)
+
+    def reap(self):
+        last_sweep = time()
+        while True:
+            try:
+                path = self.released.get(timeout=self.interval)
+                if path is None:
+                    return # Sent by close()
+                self.recycle(path)
+            except Empty:
+                pass
+            except Exception:
+                pass # The reaper must keep running; a workspace it fails to empty is simply not reused
+            if time() - last_sweep >= self.interval:
+                try:
+                    self.sweep()
+                except Exception:
+                    pass
+                last_sweep = time()
+
+    def close(self):
+        self.released.put(None)
+        self.reaper.join(10) # Waits for a sweep in progress to finish, within reason
+        rmtree(self.root,ignore_errors=True)
+
+    # Empties a released workspace and returns it to the pool, or removes it if the pool is full (or it is on disk)
+    def recycle(self,path):
+        if not path.startswith(self.root + sep):
+            rmtree(path,ignore_errors=True)
+            return
+        with self.lock:
+            keep = len(self.idle) < self.size
+        if not keep:
+            rmtree(path,ignore_errors=True)
+            return
+        empty_dir(path)
+        with self.lock:
+            self.idle.append(path)
+
+    def sweep(self):
+        now = time()
+        with self.lock:
+            stale = [path for path, leased in self.leases.items() if now - leased > self.max_age]
+            for path in stale:
+                del self.leases[path]
+                self.sizes.pop(path,None)
+        for path in stale:
+            self.recycle(path)
+
+        for name in listdir(self.parent):
+            if name.isdigit() and int(name) != self.pid and not is_running(int(name)):
+                rmtree(join(self.parent,name),ignore_errors=True)
+
+        with self.lock:
+            leased = list(self.leases)
+        sizes = dict((path,dir_size(path)) for path in leased)
+        with self.lock:
+            for path, size in sizes.items():
+                if path in self.leases: # Unless it was released while it was measured
+                    self.sizes[path] = size
+        self.usage = sum(size for path, size in sizes.items() if path.startswith(self.root + sep))
+
+### END OF WorkspacePool